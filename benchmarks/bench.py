@@ -0,0 +1,293 @@
+"""
+Benchmarks de los caminos calientes: clasificación, extracción, normalizadores,
+escalamiento por número de tipos, extracción de texto con fitz (servicio-ocr)
+y el patrón de escritura a la DB. Todo offline y con datos sintéticos.
+
+    python benchmarks/bench.py                      # todas las suites
+    python benchmarks/bench.py --suite sql --quick
+    python benchmarks/bench.py --save-baseline      # guarda baselines/default.json
+    python benchmarks/bench.py --check              # exit 1 si algo empeoró más que --tolerance
+    python benchmarks/bench.py --suite db --db-url postgresql://...   # default: SQLite en memoria
+
+Por caso se reporta ops/s, p50 y p95 (ms por llamada) y los mismos p50/p95
+relativos a un kernel de referencia (Python puro: regex, str, dict) medido en
+la misma corrida. La baseline y --check usan los relativos, así una baseline
+guardada en otra máquina sigue sirviendo; no corrige todo (fitz o la DB no
+escalan igual que el kernel entre máquinas), para eso queda --tolerance o una
+baseline propia con --baseline RUTA.
+"""
+import argparse
+import json
+import math
+import os
+import re
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import synthetic
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SQL_DIR = os.path.join(ROOT, "servicio-sql")
+OCR_DIR = os.path.join(ROOT, "servicio-ocr")
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "default.json")
+
+
+# =========================
+# Medición
+# =========================
+def _percentile(sorted_values: Sequence[float], p: float) -> float:
+    # Nearest-rank
+    if not sorted_values:
+        return 0.0
+    k = max(0, math.ceil(p / 100.0 * len(sorted_values)) - 1)
+    return sorted_values[k]
+
+
+def measure(fn: Callable[[Any], Any], inputs: Sequence[Any], min_time: float, min_calls: int = 5,
+            units_per_call: Optional[Callable[[Any], float]] = None) -> Dict[str, float]:
+    """
+    Llama fn(x) recorriendo `inputs` en ciclo hasta juntar `min_time` segundos
+    y al menos `min_calls` llamadas (más una vuelta de calentamiento).
+    """
+    for x in inputs[: min(len(inputs), 3)]:
+        fn(x)
+
+    latencies: List[float] = []
+    units = 0.0
+    started = time.perf_counter()
+    i = 0
+    while True:
+        x = inputs[i % len(inputs)]
+        t0 = time.perf_counter()
+        fn(x)
+        latencies.append(time.perf_counter() - t0)
+        if units_per_call:
+            units += units_per_call(x)
+        i += 1
+        if i >= min_calls and time.perf_counter() - started >= min_time:
+            break
+
+    total = sum(latencies)
+    latencies.sort()
+    result = {
+        "calls": len(latencies),
+        "ops_s": len(latencies) / total if total else 0.0,
+        "p50_ms": _percentile(latencies, 50) * 1000,
+        "p95_ms": _percentile(latencies, 95) * 1000,
+    }
+    if units_per_call:
+        result["units_s"] = units / total if total else 0.0
+    return result
+
+
+REFERENCE = "_referencia"
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def _reference_kernel(text: str):
+    # Trabajo parecido a los caminos calientes, sin depender del código del repo
+    counts: Dict[str, int] = {}
+    for word in _WORD_RE.findall(text.lower()):
+        counts[word] = counts.get(word, 0) + 1
+    return sorted(counts.items(), key=lambda kv: -kv[1])[:10]
+
+
+def measure_reference(min_time: float) -> Dict[str, float]:
+    texts = [synthetic.other_text(TEXT_SIZES["M"], seed) for seed in range(5)]
+    return measure(_reference_kernel, texts, min_time)
+
+
+def add_relative(results: Dict[str, Dict[str, float]], reference: Dict[str, float]) -> None:
+    for r in results.values():
+        r["rel_p50"] = r["p50_ms"] / reference["p50_ms"]
+        r["rel_p95"] = r["p95_ms"] / reference["p95_ms"]
+
+
+# =========================
+# Suites
+# =========================
+TEXT_SIZES = {"S": 20, "M": 200, "L": 2000}  # líneas por texto
+
+
+def suite_sql(min_time: float, quick: bool) -> Dict[str, Dict[str, float]]:
+    sys.path.insert(0, SQL_DIR)
+    from classifier import classify_document
+    from config_loader import build_snapshot, get_all_document_types, scan_document_types
+    from extractor import extract_fields, normalize_money, normalize_period
+    from pipeline import process_ocr_text
+
+    results = {}
+    liquidacion = get_all_document_types()["LIQUIDACION"]
+    for size, lines in TEXT_SIZES.items():
+        texts = [synthetic.liquidacion_text(lines, seed) for seed in range(20)]
+        # unid/s = caracteres por segundo
+        results[f"classify[{size}]"] = measure(classify_document, texts, min_time, units_per_call=len)
+        results[f"extract[{size}]"] = measure(lambda t: extract_fields(t, liquidacion), texts, min_time,
+                                              units_per_call=len)
+        results[f"process_ocr_text[{size}]"] = measure(process_ocr_text, texts, min_time, units_per_call=len)
+
+    others = [synthetic.other_text(TEXT_SIZES["M"], seed) for seed in range(20)]
+    results["classify_desconocido[M]"] = measure(classify_document, others, min_time)
+
+    montos = ["$ 1.234.567", "450.000", "1,234,567", "abc", "  98.000 "]
+    periodos = ["01/2025", "Octubre del 2025", "MARZO 2024", "12/2030", "sin periodo"]
+    results["normalize_money"] = measure(lambda v: normalize_money(v, liquidacion), montos, min_time, min_calls=1000)
+    results["normalize_period"] = measure(lambda v: normalize_period(v, liquidacion), periodos, min_time,
+                                          min_calls=1000)
+
+    # Escalamiento por número de tipos (mismo texto M, registro armado aparte)
+    texts = [synthetic.liquidacion_text(TEXT_SIZES["M"], seed) for seed in range(20)]
+    for n in (1, 10, 100) if quick else (1, 10, 100, 400):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = synthetic.write_document_types(n, tmp, liquidacion)
+            files, _ = scan_document_types(path, {})
+            classifier = build_snapshot(files).classifier
+        results[f"classify_types[{n}]"] = measure(lambda t: classify_document(t, classifier), texts, min_time)
+    return results
+
+
+def suite_ocr(min_time: float, quick: bool) -> Dict[str, Dict[str, float]]:
+    # servicio-ocr también se llama main.py: va primero en el path (la suite sql no importa main)
+    sys.path.insert(0, OCR_DIR)
+    import main as ocr_main
+
+    results = {}
+    for pages in (1, 10) if quick else (1, 10, 50):
+        pdfs = [synthetic.make_pdf(pages, seed) for seed in range(3)]
+        # unid/s = páginas por segundo
+        results[f"extraer_texto[{pages}p]"] = measure(ocr_main.extraer_texto, pdfs, min_time, min_calls=3,
+                                                      units_per_call=lambda _, p=pages: p)
+    return results
+
+
+def suite_db(min_time: float, quick: bool, db_url: str) -> Dict[str, Dict[str, float]]:
+    """
+    Patrón de escritura de ingest: un INSERT+commit por documento vs un INSERT
+    multi-fila por batch. Tabla propia (bench_documentos), se borra al final.
+    """
+    from sqlalchemy import JSON, Column, Integer, MetaData, String, Table, Text, create_engine, insert
+
+    engine = create_engine(db_url)
+    meta = MetaData()
+    tabla = Table(
+        "bench_documentos", meta,
+        Column("id", Integer, primary_key=True),
+        Column("nombre_archivo", String),
+        Column("tipo_documento", String),
+        Column("contenido", JSON),
+        Column("texto_ocr", Text),
+    )
+    meta.drop_all(engine)
+    meta.create_all(engine)
+
+    texts = [synthetic.liquidacion_text(TEXT_SIZES["M"], seed) for seed in range(20)]
+
+    def _row(t):
+        return {"nombre_archivo": "bench.pdf", "tipo_documento": "Pendiente", "contenido": {"archivo": "bench.pdf"},
+                "texto_ocr": t}
+
+    def _uno(t):
+        with engine.begin() as conn:
+            conn.execute(insert(tabla), [_row(t)])
+
+    batch = 100
+    batches = [[_row(t) for t in (texts * 10)[i: i + batch]] for i in range(0, batch * 2, batch)]
+
+    def _batch(rows):
+        with engine.begin() as conn:
+            conn.execute(insert(tabla), rows)
+
+    results = {}  # unid/s = filas por segundo
+    try:
+        results["db_insert_por_fila"] = measure(_uno, texts, min_time, units_per_call=lambda _: 1)
+        results[f"db_insert_batch[{batch}]"] = measure(_batch, batches, min_time, units_per_call=len)
+    finally:
+        meta.drop_all(engine)
+        engine.dispose()
+    return results
+
+
+# =========================
+# Baselines
+# =========================
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], tolerance: float) -> List[str]:
+    # Relativos al kernel de referencia; absolutos solo si la baseline es de antes de los relativos
+    regressions = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if not base or name == REFERENCE:
+            continue
+        p50, p95 = ("rel_p50", "rel_p95") if "rel_p50" in base else ("p50_ms", "p95_ms")
+        if r[p50] > base[p50] * (1 + tolerance):
+            regressions.append(f"{name}: {p50} {r[p50]:.3f} vs baseline {base[p50]:.3f}")
+        elif r[p95] > base[p95] * (1 + 2 * tolerance):
+            regressions.append(f"{name}: {p95} {r[p95]:.3f} vs baseline {base[p95]:.3f}")
+    return regressions
+
+
+def _print_table(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]]):
+    print(f"{'caso':32} {'ops/s':>12} {'p50 ms':>10} {'p95 ms':>10} {'p50 rel':>9} {'unid/s':>14} {'vs base p50':>12}")
+    for name, r in results.items():
+        base = baseline.get(name)
+        key = "rel_p50" if base and "rel_p50" in base else "p50_ms"
+        delta = f"{(r[key] / base[key] - 1) * 100:+.1f}%" if base and base[key] and name != REFERENCE else "-"
+        units = f"{r['units_s']:.1f}" if "units_s" in r else "-"
+        print(f"{name:32} {r['ops_s']:12.1f} {r['p50_ms']:10.3f} {r['p95_ms']:10.3f} {r['rel_p50']:9.3f} "
+              f"{units:>14} {delta:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--suite", choices=["sql", "ocr", "db", "all"], default="all")
+    parser.add_argument("--quick", action="store_true", help="Menos tiempo y menos casos")
+    parser.add_argument("--min-time", type=float, default=None, help="Segundos por caso (default 1.0, --quick 0.2)")
+    parser.add_argument("--db-url", default=os.getenv("BENCH_DATABASE_URL", "sqlite://"))
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--check", action="store_true", help="Exit 1 si hay regresiones contra la baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Regresión si p50 empeora más que esto")
+    parser.add_argument("--json", dest="json_out", default=None, help="Guardar resultados en este archivo")
+    args = parser.parse_args()
+
+    min_time = args.min_time if args.min_time is not None else (0.2 if args.quick else 1.0)
+    reference = measure_reference(min_time)
+    results: Dict[str, Dict[str, float]] = {}
+    if args.suite in ("sql", "all"):
+        results.update(suite_sql(min_time, args.quick))
+    if args.suite in ("ocr", "all"):
+        results.update(suite_ocr(min_time, args.quick))
+    if args.suite in ("db", "all"):
+        results.update(suite_db(min_time, args.quick, args.db_url))
+    # Al principio y al final: el más rápido de los dos (menos ruido por frecuencia de CPU / vecinos)
+    reference = min(reference, measure_reference(min_time), key=lambda r: r["p50_ms"])
+    results[REFERENCE] = reference
+    add_relative(results, reference)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    _print_table(results, baseline)
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({**baseline, **results}, f, indent=2, sort_keys=True)
+        print(f"Baseline guardada en {args.baseline}")
+
+    regressions = compare(results, baseline, args.tolerance)
+    for r in regressions:
+        print(f"REGRESIÓN {r}")
+    if args.check and regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Datos sintéticos reproducibles (con semilla) para los benchmarks: textos de
+liquidación, PDFs multipágina y directorios con N tipos de documento.
+"""
+import copy
+import json
+import os
+import random
+
+MESES = ["ENERO", "FEBRERO", "MARZO", "ABRIL", "MAYO", "JUNIO", "JULIO", "AGOSTO",
+         "SEPTIEMBRE", "OCTUBRE", "NOVIEMBRE", "DICIEMBRE"]
+
+_RELLENO = [
+    "Sueldo base", "Gratificación legal", "Horas extra", "Bono de producción", "Colación", "Movilización",
+    "AFP Modelo", "Salud Fonasa", "Seguro de cesantía", "Impuesto único", "Anticipo", "Préstamo caja",
+    "Días trabajados", "Cargo: Operario", "Centro de costo 12", "Observaciones",
+]
+
+
+def _rut(rng: random.Random) -> str:
+    n = rng.randint(5_000_000, 25_999_999)
+    dv = rng.choice("0123456789K")
+    return f"{n // 1_000_000}.{n // 1000 % 1000:03d}.{n % 1000:03d}-{dv}"
+
+
+def _monto(rng: random.Random) -> str:
+    return f"{rng.randint(300_000, 4_000_000):,}".replace(",", ".")
+
+
+def liquidacion_text(lines: int, seed: int = 0) -> str:
+    """
+    Texto tipo OCR de una liquidación de sueldo con ~`lines` líneas: encabezado
+    y totales reales al principio/final y líneas de relleno en medio.
+    """
+    rng = random.Random(seed)
+    head = [
+        "LIQUIDACIÓN DE SUELDO",
+        f"Empleador: Empresa {rng.randint(1, 999)} SpA  RUT {_rut(rng)}",
+        f"Trabajador: Persona {rng.randint(1, 999)}  RUT {_rut(rng)}",
+        f"Periodo: {rng.choice(MESES).capitalize()} del {rng.randint(2020, 2026)}",
+    ]
+    body = [f"{rng.choice(_RELLENO)} {_monto(rng)}" for _ in range(max(0, lines - 8))]
+    tail = [
+        f"TOTAL IMPONIBLE $ {_monto(rng)}",
+        f"TOTAL HABERES {_monto(rng)}",
+        f"TOTAL DESCUENTOS {_monto(rng)}",
+        f"LÍQUIDO A RECIBIR {_monto(rng)}",
+    ]
+    return "\n".join(head + body + tail)
+
+
+def other_text(lines: int, seed: int = 0) -> str:
+    # Documento que no es liquidación (camino DESCONOCIDO)
+    rng = random.Random(seed)
+    return "\n".join(f"Cláusula {i}: {rng.choice(_RELLENO)} {rng.randint(1, 10**6)}" for i in range(lines))
+
+
+def make_pdf(pages: int, seed: int = 0, lines_per_page: int = 40) -> bytes:
+    import fitz
+
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page()
+        y = 72
+        text = liquidacion_text(lines_per_page, seed=rng.randint(0, 10**9)).split("\n")
+        for line in text[:lines_per_page]:
+            page.insert_text((72, y), line, fontsize=9)
+            y += 16
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def write_document_types(n: int, dest_dir: str, base_config: dict, keywords_per_type: int = 8, seed: int = 0) -> str:
+    """
+    Crea `dest_dir`/document_types con el tipo base más n-1 tipos generados
+    (keywords propias y mismos campos), para medir cómo escala el clasificador.
+    """
+    rng = random.Random(seed)
+    path = os.path.join(dest_dir, "document_types")
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, "base.json"), "w", encoding="utf-8") as f:
+        json.dump(base_config, f, ensure_ascii=False)
+
+    for i in range(n - 1):
+        cfg = copy.deepcopy(base_config)
+        cfg["id"] = f"TIPO_SINTETICO_{i}"
+        clasif = cfg.setdefault("clasificacion", {})
+        clasif["palabras_clave"] = [
+            f"{rng.choice(_RELLENO).upper()} {rng.choice(MESES)} FORMULARIO {i}-{j}" for j in range(keywords_per_type)
+        ]
+        clasif["regex_titulo"] = f"FORMULARIO\\s+{i}\\b"
+        with open(os.path.join(path, f"sintetico_{i:04d}.json"), "w", encoding="utf-8") as f:
+            json.dump(cfg, f, ensure_ascii=False)
+    return path
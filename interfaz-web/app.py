@@ -1,3 +1,5 @@
+import time
+
 import streamlit as st
 import requests
 
@@ -7,36 +9,87 @@ st.image("logo-aps.png", width=150)
 st.title("Extractor de Datos para Análisis SQL")
 st.markdown("---")
 
+# URL de tu motor potente con 2GB RAM
+url = "https://servicio-1-ocr-v2-22596087784.europe-west1.run.app"
+# Máximo que se espera un job en segundo plano antes de dejar de consultar
+JOB_TIMEOUT_SEGUNDOS = 30 * 60
+
+
+def mostrar_resultado(res):
+    st.success("✅ Datos persistidos en PostgreSQL")
+    if res.get('cache_hit'):
+        st.info(f"Este PDF ya estaba cargado (id {res.get('id')}): se reutilizó sin volver a extraer.")
+
+    col1, col2 = st.columns([1, 2])
+    with col1:
+        st.subheader("Metadatos de Control")
+        st.write(f"**Archivo:** {archivo.name}")
+        st.write(f"**Tipo detectado:** {res.get('tipo_archivo', 'Auto')}")
+
+    with col2:
+        st.subheader("Contenido Almacenado (para SQL)")
+        # Aquí mostramos el texto completo que se guardó en la columna 'contenido'
+        texto_final = res.get('texto', res.get('data_extraida', 'No se recuperó texto'))
+        st.text_area("Texto Bruto Extraído", texto_final, height=400)
+
+
+def esperar_job(job_id):
+    # Polling de /jobs/<id> mostrando páginas procesadas / total
+    barra = st.progress(0.0, text="En cola...")
+    limite = time.monotonic() + JOB_TIMEOUT_SEGUNDOS
+    while True:
+        if time.monotonic() > limite:
+            barra.empty()
+            st.error(f"El job {job_id} no terminó en {JOB_TIMEOUT_SEGUNDOS // 60} minutos; "
+                     f"se puede consultar más tarde en {url}/jobs/{job_id}")
+            return None
+        r = requests.get(f"{url}/jobs/{job_id}", timeout=30)
+        if r.status_code != 200:
+            barra.empty()
+            st.error(f"Error consultando el job: {r.status_code}")
+            return None
+        job = r.json()
+        total = job.get('paginas_total') or 0
+        hechas = job.get('paginas_hechas') or 0
+        if job['estado'] == 'LISTO':
+            barra.progress(1.0, text="Listo")
+            return job['resultado']
+        if job['estado'] == 'ERROR':
+            barra.empty()
+            st.error(f"Error del motor: {job.get('error')}")
+            return None
+        if total:
+            barra.progress(min(hechas / total, 1.0), text=f"Páginas {hechas} de {total}")
+        time.sleep(1)
+
+
 archivo = st.file_uploader("Cargar PDF o Imagen", type=['pdf', 'jpg', 'png', 'jpeg'])
+modo_async = st.checkbox("Procesar en segundo plano (recomendado para PDF grandes)")
 
 if archivo:
     if st.button("EJECUTAR EXTRACCIÓN COMPLETA"):
-        with st.spinner("El motor está discriminando el tipo de archivo y realizando OCR..."):
+        files = {"file": (archivo.name, archivo.getvalue(), archivo.type)}
+        if modo_async:
             try:
-                # URL de tu motor potente con 2GB RAM
-                url = "https://servicio-1-ocr-v2-22596087784.europe-west1.run.app"
-                files = {"file": (archivo.name, archivo.getvalue(), archivo.type)}
-                
-                r = requests.post(url, files=files, timeout=300)
-                
-                if r.status_code == 200:
-                    res = r.json()
-                    st.success("✅ Datos persistidos en PostgreSQL")
-                    
-                    col1, col2 = st.columns([1, 2])
-                    with col1:
-                        st.subheader("Metadatos de Control")
-                        st.write(f"**Archivo:** {archivo.name}")
-                        st.write(f"**Tipo detectado:** {res.get('tipo_archivo', 'Auto')}")
-                    
-                    with col2:
-                        st.subheader("Contenido Almacenado (para SQL)")
-                        # Aquí mostramos el texto completo que se guardó en la columna 'contenido'
-                        texto_final = res.get('texto', res.get('data_extraida', 'No se recuperó texto'))
-                        st.text_area("Texto Bruto Extraído", texto_final, height=400)
+                r = requests.post(f"{url}/jobs", files=files, timeout=60)
+                if r.status_code == 202:
+                    res = esperar_job(r.json()['job_id'])
+                    if res:
+                        mostrar_resultado(res)
                 else:
                     st.error(f"Error del motor: {r.status_code}")
             except Exception as e:
                 st.error(f"Error de conexión: {e}")
+        else:
+            with st.spinner("El motor está discriminando el tipo de archivo y realizando OCR..."):
+                try:
+                    r = requests.post(url, files=files, timeout=300)
+
+                    if r.status_code == 200:
+                        mostrar_resultado(r.json())
+                    else:
+                        st.error(f"Error del motor: {r.status_code}")
+                except Exception as e:
+                    st.error(f"Error de conexión: {e}")
 
 st.sidebar.warning("Foco: Extracción completa para análisis posterior mediante consultas JSONB.")
@@ -0,0 +1,215 @@
+"""
+Modo ASGI de servicio-ocr para muchos uploads lentos concurrentes:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8080
+    gunicorn -k uvicorn.workers.UvicornWorker --bind :8080 --workers 1 asgi:app
+
+POST / (mismo contrato y misma respuesta que main.py) se atiende en el event
+loop: el body se lee async, la DB va por asyncpg y PyMuPDF corre en un
+executor acotado (ASYNC_PARSE_WORKERS). Los uploads desde STREAMING_MIN_BYTES
+(o sin Content-Length) van al POST / de Flask, que ya los procesa sin tenerlos
+enteros en memoria (PDF a disco, COPY y respuesta en streaming). El resto de
+las rutas (/jobs, /batch, /metrics, ...) es la app Flask de main.py montada
+tal cual.
+"""
+import asyncio, hashlib, json, os, time, uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import asyncpg
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+
+import main as ocr
+from metrics import METRICS
+
+# Parseos de PDF simultáneos por proceso (PDFs >= PARALLEL_MIN_PAGES siguen usando el pool de procesos)
+ASYNC_PARSE_WORKERS = int(os.environ.get('ASYNC_PARSE_WORKERS', str(os.cpu_count() or 1)))
+# Uploads esperando parseo; más que esto => 503 (backpressure en vez de acumular PDFs en memoria)
+ASYNC_PARSE_QUEUE = int(os.environ.get('ASYNC_PARSE_QUEUE', '256'))
+ASYNC_DB_POOL_MIN = int(os.environ.get('ASYNC_DB_POOL_MIN', '2'))
+ASYNC_DB_POOL_MAX = int(os.environ.get('ASYNC_DB_POOL_MAX', '16'))
+
+_parse_executor = ThreadPoolExecutor(max_workers=ASYNC_PARSE_WORKERS, thread_name_prefix='ocr-parse')
+_parse_cupos = None  # se crean en el lifespan, dentro del event loop del worker
+_pg = None
+_hay_columna_texto = False
+
+class _Saturado(Exception):
+    pass
+
+async def _crear_pool():
+    return await asyncpg.create_pool(
+        host=os.environ.get('DB_HOST', '34.176.211.158'),
+        database=os.environ.get('DB_NAME', 'postgres'),
+        user=os.environ.get('DB_USER', 'postgres'),
+        password=os.environ.get('DB_PASS', 'TU_PASSWORD'),
+        min_size=ASYNC_DB_POOL_MIN, max_size=ASYNC_DB_POOL_MAX)
+
+@asynccontextmanager
+async def lifespan(app):
+    global _pg, _parse_cupos
+    _parse_cupos = asyncio.Semaphore(ASYNC_PARSE_WORKERS + ASYNC_PARSE_QUEUE)
+    _pg = await _crear_pool()
+    try:
+        yield
+    finally:
+        await _pg.close()
+        _parse_executor.shutdown(wait=False)
+
+async def _parsear(fuente):
+    if _parse_cupos.locked():
+        raise _Saturado()
+    async with _parse_cupos:
+        inicio = time.perf_counter()
+        texto = await asyncio.get_running_loop().run_in_executor(_parse_executor, ocr.extraer_texto, fuente)
+        METRICS.observe("stage_duration_seconds", time.perf_counter() - inicio, stage="parse_async")
+        return texto
+
+async def _leer_upload(upload):
+    # (bytes, sha256): acá solo llegan uploads chicos (ver _es_grande)
+    h = hashlib.sha256()
+    partes = []
+    while True:
+        bloque = await upload.read(ocr.STREAMING_CHUNK)
+        if not bloque:
+            break
+        h.update(bloque)
+        partes.append(bloque)
+    return b''.join(partes), h.hexdigest()
+
+async def _texto_documento(conn):
+    # Igual que main.texto_documento
+    global _hay_columna_texto
+    if not _hay_columna_texto:
+        _hay_columna_texto = await conn.fetchval(ocr.SQL_HAY_COLUMNA_TEXTO) is not None
+    return ocr.expresion_texto(_hay_columna_texto)
+
+async def _buscar_duplicado(conn, huella):
+    # Igual que main.buscar_duplicado: primero el LRU (compartido con la app Flask), luego el índice
+    encontrado = ocr.buscar_en_cache(huella)
+    if encontrado is not None and encontrado[1] is not None:
+        return encontrado
+    with METRICS.stage("dedup_lookup"):
+        doc_id = encontrado[0] if encontrado is not None else await conn.fetchval(
+            "SELECT id FROM documentos WHERE contenido->>'hash_archivo' = $1 ORDER BY id LIMIT 1", huella)
+        if doc_id is None:
+            return None
+        texto = await conn.fetchval(f"SELECT {await _texto_documento(conn)} FROM documentos d WHERE d.id = $1", doc_id)
+    ocr.cachear(huella, doc_id, texto)
+    return doc_id, texto or ""
+
+async def _guardar(nombre, texto, huella):
+    # Igual que main.guardar_documento: (id, cache_hit)
+    contenido = {"contenido": texto, "archivo": nombre}
+    if huella:
+        contenido["hash_archivo"] = huella
+    inline = await run_in_threadpool(ocr.procesar_inline, texto)
+    if inline:
+        contenido.update(inline['contenido'])
+
+    with METRICS.stage("db_insert"):
+        async with _pg.acquire() as conn, conn.transaction():
+            if huella:
+                await conn.execute("SELECT pg_advisory_xact_lock(hashtext($1))", huella)
+                existente = await conn.fetchval(
+                    "SELECT id FROM documentos WHERE contenido->>'hash_archivo' = $1 ORDER BY id LIMIT 1", huella)
+                if existente is not None:
+                    METRICS.inc("duplicados_total", origen="carrera")
+                    return existente, True
+            nuevo_id = await conn.fetchval(
+                "INSERT INTO documentos (nombre_archivo, contenido, tipo_documento) VALUES ($1, $2::jsonb, $3) "
+                "RETURNING id", nombre, json.dumps(contenido), inline['tipo_documento'] if inline else None)
+            if inline and inline.get('campos'):
+                await _guardar_campos(conn, nuevo_id, inline['campos'])
+    if huella:
+        ocr.cachear(huella, nuevo_id, texto)
+    return nuevo_id, False
+
+async def _guardar_campos(conn, doc_id, campos):
+    # Transacción anidada = savepoint: si falla, el documento se guarda igual
+    try:
+        async with conn.transaction():
+            await conn.executemany(
+                "INSERT INTO documento_campos (documento_id, tipo_documento, campo, valor_num, valor_txt) "
+                "VALUES ($1, $2, $3, $4, $5)",
+                [(doc_id, c['tipo_documento'], c['campo'], c['valor_num'], c['valor_txt']) for c in campos])
+    except Exception as e:
+        print(f"No se pudieron guardar los campos tipados de {doc_id}: {e}")
+
+async def _encolar(upload):
+    # Igual que main.encolar_job; los workers de jobs son los threads de main.py
+    job_id = uuid.uuid4().hex
+    pdf = await upload.read()
+    async with _pg.acquire() as conn:
+        await conn.execute("INSERT INTO ocr_jobs (id, estado, nombre_archivo, pdf) VALUES ($1, 'PENDIENTE', $2, $3)",
+                           job_id, upload.filename, pdf)
+    METRICS.inc("jobs_total", estado="PENDIENTE")
+    ocr.avisar_jobs()
+    return JSONResponse({"job_id": job_id, "estado": "PENDIENTE", "status_url": f"/jobs/{job_id}"}, status_code=202)
+
+async def procesar(request):
+    inicio = time.perf_counter()
+    status = 200
+    try:
+        form = await request.form(max_files=1)
+        upload = form.get('file')
+        if upload is None or isinstance(upload, str):
+            status = 500
+            return JSONResponse({"error": "'file'"}, status_code=500)
+        if request.query_params.get('async') in ('1', 'true'):
+            status = 202
+            return await _encolar(upload)
+
+        data, huella = await _leer_upload(upload)
+        if not ocr.DEDUP_ENABLED:
+            huella = None
+        if huella:
+            async with _pg.acquire() as conn:
+                duplicado = await _buscar_duplicado(conn, huella)
+            if duplicado:
+                METRICS.inc("duplicados_total", origen="dedup")
+                return JSONResponse({"cache_hit": True, "id": duplicado[0], "texto": duplicado[1]})
+        texto = await _parsear(data)
+
+        nuevo_id, cache_hit = await _guardar(upload.filename, texto, huella)
+        return JSONResponse({"cache_hit": cache_hit, "id": nuevo_id, "texto": texto})
+    except _Saturado:
+        status = 503
+        return JSONResponse({"error": "Servicio saturado, reintentar"}, status_code=503)
+    except Exception as e:
+        status = 500
+        return JSONResponse({"error": str(e)}, status_code=500)
+    finally:
+        METRICS.observe("request_duration_seconds", time.perf_counter() - inicio, endpoint="procesar_async")
+        METRICS.inc("requests_total", endpoint="procesar_async", method="POST", status=status)
+
+_flask = WSGIMiddleware(ocr.app)
+
+def _es_grande(request):
+    try:
+        return int(request.headers['content-length']) >= ocr.STREAMING_MIN_BYTES
+    except (KeyError, ValueError):
+        return True
+
+class _PostRaiz:
+    # App ASGI (no endpoint de Request) para poder pasarle el request sin leer a Flask
+    async def __call__(self, scope, receive, send):
+        request = Request(scope, receive)
+        if _es_grande(request):
+            await _flask(scope, receive, send)
+            return
+        respuesta = await procesar(request)
+        await respuesta(scope, receive, send)
+
+app = Starlette(
+    routes=[
+        Route('/', _PostRaiz(), methods=['POST']),
+        Mount('/', app=_flask),
+    ],
+    lifespan=lifespan,
+)
@@ -1,6 +1,23 @@
 import os, json, psycopg2, fitz
-from flask import Flask, request, jsonify
+import hashlib, multiprocessing, queue, tempfile, threading, time, urllib.request, uuid, zipfile
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from psycopg2.extras import execute_values
+from flask import Flask, Response, request, jsonify
+from metrics import METRICS, install_flask
 app = Flask(__name__)
+install_flask(app, "servicio_ocr")
+
+# PDFs con al menos PARALLEL_MIN_PAGES páginas se extraen por rangos en un pool de procesos
+PARALLEL_MIN_PAGES = int(os.environ.get('PARALLEL_MIN_PAGES', '100'))
+PARALLEL_WORKERS = int(os.environ.get('PARALLEL_WORKERS', str(os.cpu_count() or 1)))
+_pool = None
+_pool_lock = threading.Lock()
+
+# Uploads desde este tamaño van por el camino streaming (disco en vez de RAM)
+STREAMING_MIN_BYTES = int(os.environ.get('STREAMING_MIN_BYTES', str(10 * 1024 * 1024)))
+STREAMING_CHUNK = 64 * 1024
 
 def get_db_connection():
     return psycopg2.connect(
@@ -10,26 +27,890 @@ def get_db_connection():
         password=os.environ.get('DB_PASS', 'TU_PASSWORD')
     )
 
+# Pool de conexiones a Postgres: uno por proceso, del tamaño de los threads de gunicorn
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '8'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '30'))
+DB_POOL_MAX_AGE = float(os.environ.get('DB_POOL_MAX_AGE', '1800'))   # se recicla pasada esta edad
+DB_POOL_PING_IDLE = float(os.environ.get('DB_POOL_PING_IDLE', '30'))  # SELECT 1 si estuvo ociosa más que esto
+
+class PoolConexiones:
+    def __init__(self, crear, tamano, timeout, max_edad, ping_ocioso):
+        self._crear = crear
+        self._timeout = timeout
+        self._max_edad = max_edad
+        self._ping_ocioso = ping_ocioso
+        self._cupos = threading.BoundedSemaphore(tamano)
+        self._libres = queue.LifoQueue()  # (conn, creada, devuelta)
+        self._lock = threading.Lock()
+        self.tamano = tamano
+        self._m = {"checkouts": 0, "en_uso": 0, "creadas": 0, "recicladas": 0, "descartadas": 0,
+                   "timeouts": 0, "espera_total_s": 0.0, "espera_max_s": 0.0}
+
+    def _sumar(self, **valores):
+        with self._lock:
+            for k, v in valores.items():
+                self._m[k] += v
+
+    def _sana(self, conn, creada, devuelta):
+        ahora = time.monotonic()
+        if ahora - creada > self._max_edad:
+            self._sumar(recicladas=1)
+            return False
+        if conn.closed:
+            self._sumar(descartadas=1)
+            return False
+        if ahora - devuelta > self._ping_ocioso:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+            except Exception:
+                self._sumar(descartadas=1)
+                return False
+        return True
+
+    def _obtener(self):
+        while True:
+            try:
+                conn, creada, devuelta = self._libres.get_nowait()
+            except queue.Empty:
+                with METRICS.stage("db_connect"):
+                    conn = self._crear()
+                self._sumar(creadas=1)
+                return conn, time.monotonic()
+            if self._sana(conn, creada, devuelta):
+                return conn, creada
+            self._cerrar(conn)
+
+    def _cerrar(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def conexion(self):
+        inicio = time.monotonic()
+        if not self._cupos.acquire(timeout=self._timeout):
+            self._sumar(timeouts=1)
+            raise RuntimeError(f"Timeout ({self._timeout}s) esperando una conexión del pool")
+        espera = time.monotonic() - inicio
+        METRICS.observe("stage_duration_seconds", espera, stage="db_pool_wait")
+        with self._lock:
+            self._m["checkouts"] += 1
+            self._m["en_uso"] += 1
+            self._m["espera_total_s"] += espera
+            self._m["espera_max_s"] = max(self._m["espera_max_s"], espera)
+
+        conn = None
+        try:
+            conn, creada = self._obtener()
+            yield conn
+        finally:
+            if conn is not None:
+                self._devolver(conn, creada)
+            self._sumar(en_uso=-1)
+            self._cupos.release()
+
+    def _devolver(self, conn, creada):
+        # Nunca vuelve al pool una conexión cerrada o con una transacción a medias
+        try:
+            if not conn.closed and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except Exception:
+            pass
+        if conn.closed or conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            self._sumar(descartadas=1)
+            self._cerrar(conn)
+            return
+        self._libres.put((conn, creada, time.monotonic()))
+
+    def metricas(self):
+        with self._lock:
+            m = dict(self._m)
+        m["tamano"] = self.tamano
+        m["libres"] = self._libres.qsize()
+        m["espera_promedio_s"] = m["espera_total_s"] / m["checkouts"] if m["checkouts"] else 0.0
+        return m
+
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
+def get_db_pool():
+    global _db_pool
+    if _db_pool is None:
+        with _db_pool_lock:
+            if _db_pool is None:
+                _db_pool = PoolConexiones(get_db_connection, DB_POOL_SIZE, DB_POOL_TIMEOUT,
+                                          DB_POOL_MAX_AGE, DB_POOL_PING_IDLE)
+    return _db_pool
+
+# Deduplicación por hash del PDF: LRU en proceso + índice en la tabla (contenido->>'hash_archivo',
+# lo crea migrate-schema de servicio-sql)
+DEDUP_ENABLED = os.environ.get('DEDUP_ENABLED', '1') != '0'
+DEDUP_CACHE_SIZE = int(os.environ.get('DEDUP_CACHE_SIZE', '128'))
+DEDUP_CACHE_MAX_TEXT = int(os.environ.get('DEDUP_CACHE_MAX_TEXT', '100000'))  # textos más largos: solo el id
+
+class CacheLRU:
+    def __init__(self, tamano):
+        self.tamano = tamano
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, clave):
+        with self._lock:
+            valor = self._datos.get(clave)
+            if valor is not None:
+                self._datos.move_to_end(clave)
+            return valor
+
+    def put(self, clave, valor):
+        if self.tamano <= 0:
+            return
+        with self._lock:
+            self._datos[clave] = valor
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.tamano:
+                self._datos.popitem(last=False)
+
+    def __len__(self):
+        return len(self._datos)
+
+_dedup_cache = CacheLRU(DEDUP_CACHE_SIZE)
+
+# servicio-sql mueve el texto de contenido->>'contenido' a la columna texto_ocr al procesar.
+# La columna la crea su migrate-schema (este servicio no hace DDL): mientras no exista
+# el texto se lee solo del JSONB.
+TEXTO_DOCUMENTO = "COALESCE(d.texto_ocr, d.contenido->>'contenido')"
+SQL_HAY_COLUMNA_TEXTO = ("SELECT 1 FROM information_schema.columns WHERE table_schema = current_schema() "
+                         "AND table_name = 'documentos' AND column_name = 'texto_ocr'")
+_hay_columna_texto = False
+
+def expresion_texto(hay_columna):
+    return TEXTO_DOCUMENTO if hay_columna else "d.contenido->>'contenido'"
+
+def texto_documento(cur):
+    # Expresión SQL del texto de un documento (alias d); consulta el catálogo solo hasta ver la columna
+    global _hay_columna_texto
+    if not _hay_columna_texto:
+        cur.execute(SQL_HAY_COLUMNA_TEXTO)
+        _hay_columna_texto = cur.fetchone() is not None
+    return expresion_texto(_hay_columna_texto)
+
+def buscar_en_cache(huella):
+    # (id, texto o None si era muy largo para el LRU) o None
+    return _dedup_cache.get(huella)
+
+def cachear(huella, nuevo_id, texto):
+    _dedup_cache.put(huella, (nuevo_id, texto if texto is not None and len(texto) <= DEDUP_CACHE_MAX_TEXT else None))
+
+def _buscar_en_db(cur, huella):
+    cur.execute("SELECT id FROM documentos WHERE contenido->>'hash_archivo' = %s ORDER BY id LIMIT 1", (huella,))
+    fila = cur.fetchone()
+    return fila[0] if fila else None
+
+def buscar_duplicado(huella):
+    """
+    (id, texto) de un documento ya guardado con el mismo PDF, o None.
+    Primero el LRU; si no está, el índice en la tabla.
+    """
+    encontrado = buscar_en_cache(huella)
+    if encontrado is not None and encontrado[1] is not None:
+        return encontrado
+
+    with METRICS.stage("dedup_lookup"), get_db_pool().conexion() as conn:
+        with conn.cursor() as cur:
+            doc_id = encontrado[0] if encontrado is not None else _buscar_en_db(cur, huella)
+            if doc_id is None:
+                conn.rollback()
+                return None
+            cur.execute(f"SELECT {texto_documento(cur)} FROM documentos d WHERE d.id = %s", (doc_id,))
+            fila = cur.fetchone()
+        conn.rollback()
+    if fila is None:
+        return None
+    cachear(huella, doc_id, fila[0])
+    return doc_id, fila[0] or ""
+
+def _buscar_varios_en_db(cur, huellas):
+    cur.execute("SELECT DISTINCT ON (contenido->>'hash_archivo') contenido->>'hash_archivo', id FROM documentos "
+                "WHERE contenido->>'hash_archivo' = ANY(%s) ORDER BY contenido->>'hash_archivo', id", (list(huellas),))
+    return dict(cur.fetchall())
+
+def _bloquear_huella(cur, huella):
+    # Serializa dos uploads simultáneos del mismo PDF y revisa de nuevo dentro de la transacción
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (huella,))
+    return _buscar_en_db(cur, huella)
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn: hacer fork de un proceso con 8 threads (gunicorn) no es seguro
+                _pool = ProcessPoolExecutor(max_workers=PARALLEL_WORKERS,
+                                            mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+def _abrir_pdf(fuente):
+    # fuente: bytes en memoria o ruta a un archivo (MuPDF lo lee desde disco)
+    if isinstance(fuente, str):
+        return fitz.open(fuente, filetype="pdf")
+    return fitz.open(stream=fuente, filetype="pdf")
+
+def _extraer_rango(fuente, inicio, fin):
+    # Cada worker abre su propia copia del mismo PDF
+    with _abrir_pdf(fuente) as doc:
+        return [doc[i].get_text() for i in range(inicio, fin)]
+
+def iterar_paginas(fuente):
+    # Generador: las etapas se miden a mano (un `with` también contaría el tiempo del consumidor)
+    inicio = time.perf_counter()
+    with _abrir_pdf(fuente) as doc:
+        METRICS.observe("stage_duration_seconds", time.perf_counter() - inicio, stage="fitz_open")
+        n = doc.page_count
+        METRICS.inc("paginas_total", n)
+        if n < PARALLEL_MIN_PAGES or PARALLEL_WORKERS <= 1:
+            for p in doc:
+                inicio = time.perf_counter()
+                texto = p.get_text()
+                METRICS.observe("stage_duration_seconds", time.perf_counter() - inicio, stage="get_text")
+                yield texto
+            return
+
+    # Rangos contiguos (uno por worker) y se entregan en orden: mismo texto que el loop secuencial
+    paso = -(-n // min(PARALLEL_WORKERS, n))
+    rangos = [(i, min(i + paso, n)) for i in range(0, n, paso)]
+    futuros = [get_pool().submit(_extraer_rango, fuente, a, b) for a, b in rangos]
+    for f in futuros:
+        inicio = time.perf_counter()
+        paginas = f.result()
+        METRICS.observe("stage_duration_seconds", time.perf_counter() - inicio, stage="get_text_pool_wait")
+        yield from paginas
+
+def extraer_texto(fuente):
+    return ''.join(iterar_paginas(fuente))
+
+def _extraer_todo(fuente):
+    # Para el pool del batch: dentro del worker siempre secuencial (sin pool anidado)
+    with _abrir_pdf(fuente) as doc:
+        return ''.join(p.get_text() for p in doc)
+
+def _copy_escape(valor):
+    # Formato texto de COPY: \N es NULL; backslash, tab y saltos de línea van escapados
+    if valor is None:
+        return b'\\N'
+    return (valor.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')).encode('utf-8')
+
+class _LectorCopy:
+    # File-like para copy_expert: va armando la fila COPY por partes, nunca entera en memoria
+    def __init__(self, partes):
+        self._partes = iter(partes)
+        self._buf = b''
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buf) < size:
+            parte = next(self._partes, None)
+            if parte is None:
+                break
+            self._buf += parte
+        if size < 0:
+            size = len(self._buf)
+        data, self._buf = self._buf[:size], self._buf[size:]
+        return data
+
+def _fila_copy(nuevo_id, nombre, texto_json, huella):
+    # Misma fila que el INSERT normal: contenido = {"contenido": texto, "archivo": nombre, "hash_archivo": huella}
+    yield str(nuevo_id).encode() + b'\t' + _copy_escape(nombre) + b'\t{"contenido": "'
+    texto_json.seek(0)
+    for bloque in iter(lambda: texto_json.read(STREAMING_CHUNK), b''):
+        yield bloque.replace(b'\\', b'\\\\')
+    yield b'", "archivo": ' + _copy_escape(json.dumps(nombre))
+    if huella:
+        yield b', "hash_archivo": "' + huella.encode() + b'"'
+    yield b'}\n'
+
+def _respuesta_duplicado(doc_id, texto):
+    return jsonify({"cache_hit": True, "id": doc_id, "texto": texto})
+
+def _guardar_en_disco(file, destino):
+    # Copia el upload por bloques calculando el hash de paso
+    h = hashlib.sha256()
+    for bloque in iter(lambda: file.stream.read(STREAMING_CHUNK), b''):
+        h.update(bloque)
+        destino.write(bloque)
+    return h.hexdigest()
+
+def _tamano_upload(file):
+    if request.content_length:
+        return request.content_length
+    pos = file.stream.tell()
+    file.stream.seek(0, os.SEEK_END)
+    tamano = file.stream.tell()
+    file.stream.seek(pos)
+    return tamano
+
+def procesar_streaming(file):
+    """
+    Upload grande: PDF a disco, texto (ya escapado como string JSON) a un temporal
+    página a página, INSERT vía COPY leyendo ese temporal y respuesta en streaming.
+    En memoria solo queda una página / un bloque a la vez.
+    """
+    tmp_pdf = tempfile.NamedTemporaryFile(suffix='.pdf', delete=False)
+    texto_json = tempfile.TemporaryFile()
+    try:
+        try:
+            huella = _guardar_en_disco(file, tmp_pdf)
+            tmp_pdf.close()
+            if not DEDUP_ENABLED:
+                huella = None
+
+            duplicado = buscar_duplicado(huella) if huella else None
+            if duplicado:
+                texto_json.close()
+                return _respuesta_duplicado(*duplicado)
+
+            for pagina in iterar_paginas(tmp_pdf.name):
+                texto_json.write(json.dumps(pagina)[1:-1].encode('ascii'))
+        finally:
+            tmp_pdf.close()
+            os.unlink(tmp_pdf.name)
+
+        with get_db_pool().conexion() as conn:
+            cur = conn.cursor()
+            existente = _bloquear_huella(cur, huella) if huella else None
+            if existente is None:
+                # COPY no tiene RETURNING: pedimos el id antes
+                cur.execute("SELECT nextval(pg_get_serial_sequence('documentos', 'id'))")
+                nuevo_id = cur.fetchone()[0]
+                with METRICS.stage("db_copy"):
+                    cur.copy_expert("COPY documentos (id, nombre_archivo, contenido) FROM STDIN",
+                                    _LectorCopy(_fila_copy(nuevo_id, file.filename, texto_json, huella)))
+            conn.commit()
+            cur.close()
+
+        if existente is not None:
+            # Otro upload del mismo PDF ganó la carrera mientras extraíamos
+            texto_json.close()
+            return _respuesta_duplicado(*(buscar_duplicado(huella) or (existente, "")))
+        if huella:
+            cachear(huella, nuevo_id, None)
+    except Exception:
+        texto_json.close()
+        raise
+
+    def _respuesta():
+        # Mismo JSON que jsonify({"cache_hit", "id", "texto"})
+        try:
+            yield f'{{"cache_hit":false,"id":{nuevo_id},"texto":"'.encode()
+            texto_json.seek(0)
+            for bloque in iter(lambda: texto_json.read(STREAMING_CHUNK), b''):
+                yield bloque
+            yield b'"}\n'
+        finally:
+            texto_json.close()
+
+    return Response(_respuesta(), mimetype='application/json')
+
+# Clasificación + extracción antes del INSERT vía servicio-sql (POST .../process-text/ingest).
+# Sin URL, o si falla, se guarda como siempre y queda para /process-doc o reprocess.
+INLINE_PROCESS_URL = os.environ.get('INLINE_PROCESS_URL')
+INLINE_PROCESS_TIMEOUT = float(os.environ.get('INLINE_PROCESS_TIMEOUT', '5'))
+
+def procesar_inline(texto):
+    if not INLINE_PROCESS_URL or not texto.strip():
+        return None
+    try:
+        METRICS.inc("inline_process_total")
+        req = urllib.request.Request(INLINE_PROCESS_URL, data=json.dumps({"ocr_text": texto}).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'}, method='POST')
+        with METRICS.stage("inline_process"), urllib.request.urlopen(req, timeout=INLINE_PROCESS_TIMEOUT) as r:
+            return json.loads(r.read())
+    except Exception as e:
+        METRICS.inc("inline_process_errores_total")
+        print(f"Proceso inline falló, se difiere: {e}")
+        return None
+
+def _guardar_campos(cur, doc_id, campos):
+    # En un savepoint: si la tabla de campos no existe o algo falla, el documento se guarda igual
+    cur.execute("SAVEPOINT campos")
+    try:
+        execute_values(cur, "INSERT INTO documento_campos (documento_id, tipo_documento, campo, valor_num, valor_txt) "
+                            "VALUES %s", [(doc_id, c['tipo_documento'], c['campo'], c['valor_num'], c['valor_txt'])
+                                          for c in campos])
+        cur.execute("RELEASE SAVEPOINT campos")
+    except Exception as e:
+        cur.execute("ROLLBACK TO SAVEPOINT campos")
+        print(f"No se pudieron guardar los campos tipados de {doc_id}: {e}")
+
+def guardar_documento(nombre, texto, huella):
+    """
+    INSERT del documento (o id del ya existente si otro upload con el mismo hash
+    ganó la carrera). Devuelve (id, cache_hit).
+    """
+    contenido = {"contenido": texto, "archivo": nombre}
+    if huella:
+        contenido["hash_archivo"] = huella
+    inline = procesar_inline(texto)
+    if inline:
+        contenido.update(inline['contenido'])
+
+    with METRICS.stage("db_insert"), get_db_pool().conexion() as conn:
+        cur = conn.cursor()
+        existente = _bloquear_huella(cur, huella) if huella else None
+        if existente is not None:
+            conn.rollback()
+            METRICS.inc("duplicados_total", origen="carrera")
+            return existente, True
+        cur.execute("INSERT INTO documentos (nombre_archivo, contenido, tipo_documento) VALUES (%s, %s, %s) RETURNING id",
+                    (nombre, json.dumps(contenido), inline['tipo_documento'] if inline else None))
+        nuevo_id = cur.fetchone()[0]
+        if inline and inline.get('campos'):
+            _guardar_campos(cur, nuevo_id, inline['campos'])
+        conn.commit()
+        cur.close()
+    if huella:
+        cachear(huella, nuevo_id, texto)
+    return nuevo_id, False
+
 @app.route('/', methods=['POST'])
 def procesar():
     try:
         file = request.files['file']
+        if request.args.get('async') in ('1', 'true'):
+            return encolar_job(file)
+        if _tamano_upload(file) >= STREAMING_MIN_BYTES:
+            return procesar_streaming(file)
         file_bytes = file.read()
-        texto = ""
-        with fitz.open(stream=file_bytes, filetype="pdf") as doc:
-            for p in doc: texto += p.get_text()
-        
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("INSERT INTO documentos (nombre_archivo, contenido) VALUES (%s, %s) RETURNING id",
-                    (file.filename, json.dumps({"contenido": texto, "archivo": file.filename})))
-        nuevo_id = cur.fetchone()[0]
+        huella = hashlib.sha256(file_bytes).hexdigest() if DEDUP_ENABLED else None
+        duplicado = buscar_duplicado(huella) if huella else None
+        if duplicado:
+            METRICS.inc("duplicados_total", origen="dedup")
+            return _respuesta_duplicado(*duplicado)
+
+        texto = extraer_texto(file_bytes)
+        nuevo_id, cache_hit = guardar_documento(file.filename, texto, huella)
+        return jsonify({"cache_hit": cache_hit, "id": nuevo_id, "texto": texto})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# =========================
+# Modo asíncrono: cola de jobs en Postgres (tabla ocr_jobs) + threads en background
+# =========================
+JOBS_WORKERS = int(os.environ.get('JOBS_WORKERS', '1'))
+JOBS_POLL_SECONDS = float(os.environ.get('JOBS_POLL_SECONDS', '1'))
+JOBS_STALE_SECONDS = float(os.environ.get('JOBS_STALE_SECONDS', '600'))  # PROCESANDO sin avance => se reencola
+JOBS_PROGRESS_SECONDS = 2.0
+
+JOBS_MAX_INTENTOS = int(os.environ.get('JOBS_MAX_INTENTOS', '3'))  # tomas de un job antes de darlo por perdido
+# PENDIENTE que nadie tomó en este tiempo (sin workers, cola atascada) => ERROR; el cliente ya no espera
+JOBS_PENDIENTE_MAX_SECONDS = float(os.environ.get('JOBS_PENDIENTE_MAX_SECONDS', '3600'))
+
+# La tabla ocr_jobs la crea migrate-schema de servicio-sql; aquí solo se arrancan los threads
+# (al importar el módulo, ver el final del archivo)
+_jobs_iniciados = False
+_jobs_lock = threading.Lock()
+_jobs_aviso = threading.Event()
+
+def iniciar_workers_jobs():
+    global _jobs_iniciados
+    if _jobs_iniciados:
+        return
+    with _jobs_lock:
+        if _jobs_iniciados:
+            return
+        for n in range(JOBS_WORKERS):
+            threading.Thread(target=_worker_jobs, name=f"ocr-job-{n}", daemon=True).start()
+        _jobs_iniciados = True
+
+def avisar_jobs():
+    # Despierta a los workers sin esperar JOBS_POLL_SECONDS
+    _jobs_aviso.set()
+
+def encolar_job(file):
+    job_id = uuid.uuid4().hex
+    with get_db_pool().conexion() as conn:
+        with conn.cursor() as cur:
+            cur.execute("INSERT INTO ocr_jobs (id, estado, nombre_archivo, pdf) VALUES (%s, 'PENDIENTE', %s, %s)",
+                        (job_id, file.filename, psycopg2.Binary(file.read())))
         conn.commit()
-        cur.close()
-        conn.close()
-        return jsonify({"id": nuevo_id, "texto": texto})
+    METRICS.inc("jobs_total", estado="PENDIENTE")
+    avisar_jobs()
+    return jsonify({"job_id": job_id, "estado": "PENDIENTE", "status_url": f"/jobs/{job_id}"}), 202
+
+def _tomar_job():
+    # SKIP LOCKED: varias instancias/threads pueden tomar jobs sin pisarse.
+    # Un PROCESANDO sin avance es un worker que murió; cada toma suma un intento y
+    # pasadas JOBS_MAX_INTENTOS el job queda en ERROR (un PDF que tumba al worker
+    # no se reintenta para siempre). Un PENDIENTE más viejo que
+    # JOBS_PENDIENTE_MAX_SECONDS también pasa a ERROR.
+    with get_db_pool().conexion() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE ocr_jobs SET estado = 'ERROR', pdf = NULL, actualizado = now(),
+                       error = CASE WHEN estado = 'PENDIENTE' THEN 'Job vencido sin ser tomado'
+                                    ELSE 'Job abandonado tras ' || intentos || ' intentos' END
+                WHERE (estado = 'PROCESANDO' AND actualizado < now() - make_interval(secs => %s)
+                       AND intentos >= %s)
+                   OR (estado = 'PENDIENTE' AND creado < now() - make_interval(secs => %s))""",
+                        (JOBS_STALE_SECONDS, JOBS_MAX_INTENTOS, JOBS_PENDIENTE_MAX_SECONDS))
+            if cur.rowcount:
+                METRICS.inc("jobs_total", cur.rowcount, estado="ERROR")
+            cur.execute("""
+                UPDATE ocr_jobs SET estado = 'PROCESANDO', intentos = intentos + 1, actualizado = now()
+                WHERE id = (
+                    SELECT id FROM ocr_jobs
+                    WHERE estado = 'PENDIENTE'
+                       OR (estado = 'PROCESANDO' AND actualizado < now() - make_interval(secs => %s)
+                           AND intentos < %s)
+                    ORDER BY creado
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT 1
+                )
+                RETURNING id, nombre_archivo, pdf""", (JOBS_STALE_SECONDS, JOBS_MAX_INTENTOS))
+            fila = cur.fetchone()
+        conn.commit()
+    return fila
+
+def _actualizar_job(job_id, **campos):
+    asignaciones = ", ".join(f"{k} = %s" for k in campos)
+    with get_db_pool().conexion() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"UPDATE ocr_jobs SET {asignaciones}, actualizado = now() WHERE id = %s",
+                        (*campos.values(), job_id))
+        conn.commit()
+
+def _ejecutar_job(job_id, nombre, pdf):
+    data = bytes(pdf)
+    huella = hashlib.sha256(data).hexdigest() if DEDUP_ENABLED else None
+    duplicado = buscar_duplicado(huella) if huella else None
+    if duplicado:
+        _actualizar_job(job_id, estado='LISTO', documento_id=duplicado[0], cache_hit=True, pdf=None)
+        return
+
+    partes = []
+    with _abrir_pdf(data) as doc:
+        total = doc.page_count
+        _actualizar_job(job_id, paginas_total=total)
+        ultimo_aviso = time.monotonic()
+        for n, p in enumerate(doc, start=1):
+            partes.append(p.get_text())
+            if time.monotonic() - ultimo_aviso >= JOBS_PROGRESS_SECONDS:
+                _actualizar_job(job_id, paginas_hechas=n)
+                ultimo_aviso = time.monotonic()
+
+    nuevo_id, cache_hit = guardar_documento(nombre, ''.join(partes), huella)
+    _actualizar_job(job_id, estado='LISTO', paginas_hechas=total, documento_id=nuevo_id,
+                    cache_hit=cache_hit, pdf=None)
+
+def _worker_jobs():
+    while True:
+        try:
+            fila = _tomar_job()
+        except Exception as e:
+            print(f"Error tomando job OCR: {e}")
+            fila = None
+        if fila is None:
+            _jobs_aviso.wait(JOBS_POLL_SECONDS)
+            _jobs_aviso.clear()
+            continue
+        job_id, nombre, pdf = fila
+        try:
+            with METRICS.stage("job"):
+                _ejecutar_job(job_id, nombre, pdf)
+            METRICS.inc("jobs_total", estado="LISTO")
+        except Exception as e:
+            METRICS.inc("jobs_total", estado="ERROR")
+            try:
+                _actualizar_job(job_id, estado='ERROR', error=str(e), pdf=None)
+            except Exception as e2:
+                print(f"Error marcando job {job_id} como ERROR: {e2}")
+
+@app.route('/jobs', methods=['POST'])
+def crear_job():
+    try:
+        return encolar_job(request.files['file'])
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def estado_job(job_id):
+    with get_db_pool().conexion() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT j.estado, j.nombre_archivo, j.paginas_total, j.paginas_hechas, j.documento_id, "
+                        f"j.cache_hit, j.error, {texto_documento(cur)} "
+                        "FROM ocr_jobs j LEFT JOIN documentos d ON d.id = j.documento_id AND j.estado = 'LISTO' "
+                        "WHERE j.id = %s", (job_id,))
+            fila = cur.fetchone()
+        conn.rollback()
+    if fila is None:
+        return jsonify({"error": "Job no encontrado"}), 404
+
+    estado, nombre, total, hechas, doc_id, cache_hit, error, texto = fila
+    respuesta = {"job_id": job_id, "estado": estado, "archivo": nombre,
+                 "paginas_total": total, "paginas_hechas": hechas}
+    if estado == 'LISTO':
+        # Mismo resultado que el POST / síncrono
+        respuesta["resultado"] = {"cache_hit": bool(cache_hit), "id": doc_id, "texto": texto or ""}
+    if error:
+        respuesta["error"] = error
+    return jsonify(respuesta)
+
+BATCH_MAX_FILES = int(os.environ.get('BATCH_MAX_FILES', '500'))
+# Por archivo (parte multipart o entrada de zip) y por batch completo. Todo se vuelca a
+# temporales, pero en Cloud Run /tmp vive en memoria: el total queda muy por debajo del contenedor
+BATCH_MAX_FILE_BYTES = int(os.environ.get('BATCH_MAX_FILE_BYTES', str(64 * 1024 * 1024)))
+BATCH_MAX_TOTAL_BYTES = int(os.environ.get('BATCH_MAX_TOTAL_BYTES', str(256 * 1024 * 1024)))
+# Archivos que se extraen e insertan juntos: acota los textos en memoria a la vez
+BATCH_CHUNK = int(os.environ.get('BATCH_CHUNK', str(max(2 * PARALLEL_WORKERS, 4))))
+
+class _ArchivoGrande(Exception):
+    pass
+
+def _es_zip(f):
+    return (f.filename or '').lower().endswith('.zip') or f.mimetype in ('application/zip', 'application/x-zip-compressed')
+
+def _volcar(origen, directorio, limite):
+    # Copia `origen` por bloques a un temporal calculando el hash de paso; corta al pasar `limite`
+    h = hashlib.sha256()
+    total = 0
+    with tempfile.NamedTemporaryFile(dir=directorio, suffix='.pdf', delete=False) as destino:
+        for bloque in iter(lambda: origen.read(STREAMING_CHUNK), b''):
+            total += len(bloque)
+            if total > limite:
+                destino.close()
+                os.unlink(destino.name)
+                raise _ArchivoGrande(f"archivo de más de {limite} bytes")
+            h.update(bloque)
+            destino.write(bloque)
+    return destino.name, h.hexdigest(), total
+
+def _archivos_batch(directorio):
+    """
+    (nombre, ruta, huella, error) desde multipart (campo "files" o "file", repetible)
+    y/o archivos .zip. Cada archivo queda en un temporal dentro de `directorio`;
+    en memoria solo hay un bloque a la vez.
+    """
+    restante = BATCH_MAX_TOTAL_BYTES
+    for f in request.files.getlist('files') + request.files.getlist('file'):
+        if not _es_zip(f):
+            try:
+                ruta, huella, tamano = _volcar(f.stream, directorio, min(BATCH_MAX_FILE_BYTES, restante))
+            except _ArchivoGrande:
+                limite = "del batch" if restante < BATCH_MAX_FILE_BYTES else "por archivo"
+                yield f.filename, None, None, f"supera el máximo {limite} ({min(BATCH_MAX_FILE_BYTES, restante)} bytes)"
+                continue
+            restante -= tamano
+            yield f.filename, ruta, huella, None
+            continue
+        try:
+            with zipfile.ZipFile(f.stream) as z:
+                # zipfile no descomprime más allá de file_size: basta con revisar lo declarado
+                entradas = [info for info in z.infolist() if not info.is_dir()]
+                total = sum(info.file_size for info in entradas)
+                if len(entradas) > BATCH_MAX_FILES:
+                    yield f.filename, None, None, f"zip con {len(entradas)} archivos (máximo {BATCH_MAX_FILES})"
+                    continue
+                if total > restante:
+                    yield f.filename, None, None, f"zip de {total} bytes descomprimido (quedan {restante} en el batch)"
+                    continue
+                for info in entradas:
+                    if info.file_size > BATCH_MAX_FILE_BYTES:
+                        yield info.filename, None, None, f"archivo de {info.file_size} bytes (máximo {BATCH_MAX_FILE_BYTES})"
+                        continue
+                    with z.open(info) as entrada:
+                        ruta, huella, tamano = _volcar(entrada, directorio, BATCH_MAX_FILE_BYTES)
+                    restante -= tamano
+                    yield info.filename, ruta, huella, None
+        except (zipfile.BadZipFile, OSError, _ArchivoGrande) as e:
+            yield f.filename, None, None, f"zip inválido: {e}"
+
+_SQL_INSERT_BATCH = "INSERT INTO documentos (id, nombre_archivo, contenido) VALUES %s"
+
+def _insertar_batch(cur, filas):
+    """
+    Un INSERT multi-fila; si falla (p. ej. un texto con \\u0000 que JSONB no
+    acepta) se reintenta fila por fila con un savepoint cada una, así una fila
+    mala no tumba el batch. Devuelve {id: error} de las filas que no entraron.
+    """
+    cur.execute("SAVEPOINT batch")
+    try:
+        execute_values(cur, _SQL_INSERT_BATCH, filas, page_size=len(filas))
+        cur.execute("RELEASE SAVEPOINT batch")
+        return {}
+    except psycopg2.Error:
+        cur.execute("ROLLBACK TO SAVEPOINT batch")
+    fallidos = {}
+    for fila in filas:
+        cur.execute("SAVEPOINT fila")
+        try:
+            execute_values(cur, _SQL_INSERT_BATCH, [fila])
+            cur.execute("RELEASE SAVEPOINT fila")
+        except psycopg2.Error as e:
+            cur.execute("ROLLBACK TO SAVEPOINT fila")
+            fallidos[fila[0]] = ": ".join(filter(None, (e.diag.message_primary, e.diag.message_detail))) or str(e)
+    return fallidos
+
+@app.route('/batch', methods=['POST'])
+def procesar_batch():
+    """
+    Varios PDFs por request: cada archivo va a un temporal, y la extracción (pool
+    de procesos, que recibe rutas y no bytes) + INSERT multi-fila se hacen por
+    tandas de BATCH_CHUNK. Un archivo malo solo marca error en su resultado.
+    """
+    with tempfile.TemporaryDirectory(prefix='batch-') as directorio:
+        archivos = []
+        for item in _archivos_batch(directorio):
+            archivos.append(item)
+            if len(archivos) > BATCH_MAX_FILES:
+                return jsonify({"error": f"Máximo {BATCH_MAX_FILES} archivos por batch"}), 400
+        if not archivos:
+            return jsonify({"error": "No se recibieron archivos (campo 'files' o un .zip)"}), 400
+
+        resultados = [{"archivo": nombre} for nombre, _, _, _ in archivos]
+        pendientes = {}    # índice -> (huella, ruta) a extraer
+        primero = {}       # huella -> índice del primer archivo con ese contenido en el batch
+        for i, (nombre, ruta, huella, error) in enumerate(archivos):
+            if error:
+                resultados[i]["error"] = error
+                continue
+            huella = huella if DEDUP_ENABLED else None
+            if huella and huella in primero:
+                resultados[i]["duplicado_de"] = primero[huella]
+                continue
+            if huella:
+                primero[huella] = i
+            pendientes[i] = (huella, ruta)
+
+        try:
+            # Duplicados ya guardados: LRU y luego una sola consulta para el resto
+            if DEDUP_ENABLED and pendientes:
+                sin_cache = []
+                for i, (huella, _) in list(pendientes.items()):
+                    en_cache = buscar_en_cache(huella)
+                    if en_cache is not None:
+                        resultados[i].update(id=en_cache[0], cache_hit=True)
+                        del pendientes[i]
+                    else:
+                        sin_cache.append(huella)
+                if sin_cache:
+                    with get_db_pool().conexion() as conn:
+                        with conn.cursor() as cur:
+                            existentes = _buscar_varios_en_db(cur, sin_cache)
+                        conn.rollback()
+                    for i, (huella, _) in list(pendientes.items()):
+                        if huella in existentes:
+                            resultados[i].update(id=existentes[huella], cache_hit=True)
+                            del pendientes[i]
+
+            orden = sorted(pendientes)
+            for desde in range(0, len(orden), BATCH_CHUNK):
+                tanda = orden[desde:desde + BATCH_CHUNK]
+                _procesar_tanda({i: pendientes[i] for i in tanda}, resultados)
+                for i in tanda:
+                    os.unlink(pendientes[i][1])
+        except Exception as e:
+            return jsonify({"error": str(e), "resultados": resultados}), 500
+
+    # Repetidos dentro del mismo batch: mismo id que el primero
+    for r in resultados:
+        if "duplicado_de" in r:
+            origen = resultados[r.pop("duplicado_de")]
+            if "id" in origen:
+                r.update(id=origen["id"], cache_hit=True)
+            else:
+                r["error"] = origen.get("error", "sin resultado")
+
+    errores = sum(1 for r in resultados if "error" in r)
+    METRICS.inc("batch_archivos_total", len(resultados) - errores, resultado="ok")
+    METRICS.inc("batch_archivos_total", errores, resultado="error")
+    return jsonify({"total": len(resultados), "ok": len(resultados) - errores, "errores": errores,
+                    "resultados": resultados})
+
+def _error_archivo(e, ruta, nombre):
+    # MuPDF nombra la ruta del temporal en sus errores: mostramos el nombre del upload
+    return str(e).replace(ruta, nombre)
+
+def _procesar_tanda(tanda, resultados):
+    # tanda: índice -> (huella, ruta). Extrae, inserta con ids reservados y cachea
+    textos = {}
+    inicio = time.perf_counter()
+    if PARALLEL_WORKERS > 1 and len(tanda) > 1:
+        futuros = {i: get_pool().submit(_extraer_todo, ruta) for i, (_, ruta) in tanda.items()}
+        for i, fut in futuros.items():
+            try:
+                textos[i] = fut.result()
+            except Exception as e:
+                resultados[i]["error"] = _error_archivo(e, tanda[i][1], resultados[i]["archivo"])
+    else:
+        for i, (_, ruta) in tanda.items():
+            try:
+                textos[i] = _extraer_todo(ruta)
+            except Exception as e:
+                resultados[i]["error"] = _error_archivo(e, ruta, resultados[i]["archivo"])
+    METRICS.observe("stage_duration_seconds", time.perf_counter() - inicio, stage="batch_extract")
+
+    # Un solo INSERT multi-fila con ids reservados (así cada id queda asociado a su archivo)
+    a_insertar = sorted(textos)
+    if not a_insertar:
+        return
+    with METRICS.stage("db_insert_batch"), get_db_pool().conexion() as conn:
+        cur = conn.cursor()
+        huellas = sorted({tanda[i][0] for i in a_insertar if tanda[i][0]})
+        if huellas:
+            # Un solo round-trip; orden fijo: dos batches no se bloquean en cruz
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext(h)) FROM unnest(%s::text[]) h ORDER BY h",
+                        (huellas,))
+        existentes = _buscar_varios_en_db(cur, huellas) if huellas else {}
+        for i in list(a_insertar):
+            huella = tanda[i][0]
+            if huella in existentes:
+                resultados[i].update(id=existentes[huella], cache_hit=True)
+                a_insertar.remove(i)
+
+        if a_insertar:
+            cur.execute("SELECT nextval(pg_get_serial_sequence('documentos', 'id')) "
+                        "FROM generate_series(1, %s)", (len(a_insertar),))
+            ids = [fila[0] for fila in cur.fetchall()]
+            filas = []
+            for doc_id, i in zip(ids, a_insertar):
+                nombre = resultados[i]["archivo"]
+                contenido = {"contenido": textos[i], "archivo": nombre}
+                if tanda[i][0]:
+                    contenido["hash_archivo"] = tanda[i][0]
+                filas.append((doc_id, nombre, json.dumps(contenido)))
+            fallidos = _insertar_batch(cur, filas)
+            for doc_id, i in zip(ids, a_insertar):
+                if doc_id in fallidos:
+                    resultados[i]["error"] = fallidos[doc_id]
+                else:
+                    resultados[i].update(id=doc_id, cache_hit=False)
+            a_insertar = [i for i in a_insertar if "error" not in resultados[i]]
+        conn.commit()
+        cur.close()
+
+    for i in a_insertar:
+        if tanda[i][0]:
+            cachear(tanda[i][0], resultados[i]["id"], textos[i])
+
+@app.route('/metrics/db-pool', methods=['GET'])
+def metricas_db_pool():
+    return jsonify(get_db_pool().metricas())
+
+def _gauge_db_pool():
+    # Solo si el pool ya existe: el scrape no debe abrir conexiones
+    if _db_pool is None:
+        return {}
+    return {(("campo", k),): v for k, v in _db_pool.metricas().items()}
+
+METRICS.gauge("db_pool", _gauge_db_pool)
+METRICS.gauge("dedup_cache_entradas", lambda: len(_dedup_cache))
+
+# Los workers de jobs arrancan con cada proceso de gunicorn, no con el primer request:
+# así los PENDIENTE que quedaron de un reinicio se retoman solos. Los procesos del pool
+# (spawn) también importan este módulo y no deben arrancarlos. JOBS_WORKERS=0 los apaga.
+if multiprocessing.parent_process() is None:
+    iniciar_workers_jobs()
+
 if __name__ == "__main__":
     app.run(host='0.0.0.0', port=8080)
@@ -0,0 +1,258 @@
+"""
+Métricas en proceso (contadores, gauges e histogramas) en formato de texto de
+Prometheus, timers por etapa y profiling por muestreo de requests.
+
+Sin dependencias externas. Hay una copia idéntica en servicio-ocr/metrics.py
+porque cada servicio se construye con su propio directorio como contexto de
+Docker (cloudbuild.yaml, Dockerfile de cada uno) y no puede importar nada de
+fuera de él: mantener ambas sincronizadas (diff servicio-*/metrics.py vacío).
+
+Las métricas viven en la memoria de cada proceso y no se suman entre procesos:
+- con gunicorn cada scrape de /metrics lo atiende un solo worker y muestra solo
+  lo suyo (etiqueta pid). Los Dockerfile corren un worker con --threads, así
+  que por instancia el scrape es completo; con más workers habría que pasar a
+  un registro compartido (p. ej. prometheus_client en modo multiproceso).
+- lo que se mide en un ProcessPoolExecutor se pierde salvo que el worker lo
+  junte con capture() y el padre lo registre con replay() (ver
+  pipeline.process_many).
+"""
+import cProfile
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Segundos: de 1 ms a 1 min (OCR de PDFs grandes llega a decenas de segundos)
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Profiling por muestreo: fracción de requests (0 = apagado) y dónde dejar los .prof
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/profiles")
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    items = key + extra
+    if not items:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in items)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+
+class _Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self, n_buckets: int):
+        self.counts = [0] * n_buckets
+        self.total = 0.0
+        self.count = 0
+
+
+class Metrics:
+    """
+    Registro de métricas de un servicio. Todos los nombres llevan `prefix`.
+    """
+
+    def __init__(self, prefix: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.prefix = prefix
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, _Histogram]] = {}
+        self._gauges: Dict[str, Callable[[], object]] = {}
+        self._help: Dict[str, str] = {}
+        self._captured = threading.local()
+
+    def describe(self, name: str, text: str):
+        self._help[name] = text
+
+    def _capture(self, kind: str, name: str, value: float, labels: Dict[str, object]):
+        captured = getattr(self._captured, "items", None)
+        if captured is not None:
+            captured.append((kind, name, value, labels))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        self._capture("inc", name, value, labels)
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        self._capture("observe", name, seconds, labels)
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            h = series.get(key)
+            if h is None:
+                h = series[key] = _Histogram(len(self.buckets))
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    h.counts[i] += 1
+                    break
+            h.total += seconds
+            h.count += 1
+
+    @contextmanager
+    def capture(self):
+        """
+        with metrics.capture() as items: ... -> además de registrarlos, junta en
+        `items` los inc/observe hechos en este thread (picklable), para que un
+        proceso hijo los devuelva y el padre los registre con replay(items).
+        """
+        previous = getattr(self._captured, "items", None)
+        items: List[Tuple[str, str, float, Dict[str, object]]] = []
+        self._captured.items = items
+        try:
+            yield items
+        finally:
+            self._captured.items = previous
+
+    def replay(self, items: List[Tuple[str, str, float, Dict[str, object]]]):
+        for kind, name, value, labels in items:
+            if kind == "inc":
+                self.inc(name, value, **labels)
+            else:
+                self.observe(name, value, **labels)
+
+    def gauge(self, name: str, fn: Callable[[], object]):
+        """
+        Gauge calculado al hacer scrape. fn() devuelve un número o un dict
+        {etiquetas (tupla de pares): valor}.
+        """
+        self._gauges[name] = fn
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def stage(self, stage: str):
+        """
+        with metrics.stage("classify"): ...  -> histograma stage_duration_seconds{stage=...}
+        """
+        return self.timer("stage_duration_seconds", stage=stage)
+
+    def render(self) -> str:
+        pid = (("pid", str(os.getpid())),)
+        lines: List[str] = []
+
+        def _header(name: str, kind: str):
+            full = f"{self.prefix}_{name}"
+            if name in self._help:
+                lines.append(f"# HELP {full} {self._help[name]}")
+            lines.append(f"# TYPE {full} {kind}")
+            return full
+
+        with self._lock:
+            counters = {n: dict(s) for n, s in self._counters.items()}
+            histograms = {
+                n: {k: (list(h.counts), h.total, h.count) for k, h in s.items()} for n, s in self._histograms.items()
+            }
+
+        for name in sorted(counters):
+            full = _header(name, "counter")
+            for key, value in sorted(counters[name].items()):
+                lines.append(f"{full}{_format_labels(key, pid)} {value}")
+
+        for name in sorted(histograms):
+            full = _header(name, "histogram")
+            for key, (counts, total, count) in sorted(histograms[name].items()):
+                cumulative = 0
+                for bound, c in zip(self.buckets, counts):
+                    cumulative += c
+                    lines.append(f"{full}_bucket{_format_labels(key, pid + (('le', repr(bound)),))} {cumulative}")
+                lines.append(f"{full}_bucket{_format_labels(key, pid + (('le', '+Inf'),))} {count}")
+                lines.append(f"{full}_sum{_format_labels(key, pid)} {total}")
+                lines.append(f"{full}_count{_format_labels(key, pid)} {count}")
+
+        for name in sorted(self._gauges):
+            try:
+                value = self._gauges[name]()
+            except Exception:
+                continue
+            full = _header(name, "gauge")
+            if isinstance(value, dict):
+                for key, v in sorted(value.items()):
+                    lines.append(f"{full}{_format_labels(tuple(key), pid)} {v}")
+            else:
+                lines.append(f"{full}{_format_labels((), pid)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+# Registro único del proceso; install_flask le pone el prefijo del servicio
+METRICS = Metrics("app")
+
+
+def install_flask(app, prefix: str, metrics: Metrics = METRICS, path: str = "/metrics"):
+    """
+    Contadores/latencia por endpoint, requests en curso, la ruta `path` y el
+    profiling por muestreo (PROFILE_SAMPLE_RATE): el request elegido deja un
+    .prof en PROFILE_DIR (abrir con `python -m pstats` o snakeviz).
+    """
+    from flask import Response, g, request
+
+    metrics.prefix = prefix
+    in_flight = [0]
+    in_flight_lock = threading.Lock()
+    metrics.gauge("requests_in_flight", lambda: in_flight[0])
+    metrics.describe("requests_total", "Requests por endpoint, método y status")
+    metrics.describe("request_duration_seconds", "Latencia por endpoint")
+    metrics.describe("stage_duration_seconds", "Duración de cada etapa interna")
+
+    @app.before_request
+    def _metrics_start():
+        with in_flight_lock:
+            in_flight[0] += 1
+        g._metrics_started = time.perf_counter()
+        g._profiler = None
+        if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:  # otro profiler activo (Python 3.12+): este request se salta
+                return
+            g._profiler = profiler
+
+    @app.teardown_request
+    def _metrics_end(exc):
+        started = g.pop("_metrics_started", None)
+        if started is None:
+            return
+        with in_flight_lock:
+            in_flight[0] -= 1
+        endpoint = request.endpoint or "desconocido"
+        metrics.observe("request_duration_seconds", time.perf_counter() - started, endpoint=endpoint)
+        status = getattr(g, "_metrics_status", 500 if exc is not None else 200)
+        metrics.inc("requests_total", endpoint=endpoint, method=request.method, status=status)
+
+        profiler: Optional[cProfile.Profile] = g.pop("_profiler", None)
+        if profiler is not None:
+            profiler.disable()
+            try:
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+                filename = f"{endpoint}-{int(time.time() * 1000)}-{os.getpid()}.prof"
+                profiler.dump_stats(os.path.join(PROFILE_DIR, filename))
+            except OSError as e:
+                print(f"No se pudo guardar el profile: {e}")
+
+    @app.after_request
+    def _metrics_status(response):
+        g._metrics_status = response.status_code
+        return response
+
+    def _metrics_view():
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+    app.add_url_rule(path, "metrics", _metrics_view, methods=["GET"])
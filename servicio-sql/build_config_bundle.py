@@ -0,0 +1,56 @@
+"""
+Valida los JSON de document_types y los deja precompilados en un bundle que
+config_loader carga al iniciar (una lectura, sin json.load ni normalizar
+keywords por tipo). Se corre en el build de la imagen:
+
+    python build_config_bundle.py [--out RUTA]
+
+Sale con código 1 si algún JSON es inválido o trae un regex que no compila.
+"""
+import argparse
+import re
+import sys
+
+from config_loader import CONFIG_BUNDLE_PATH, DOCUMENT_TYPES_PATH, build_snapshot, scan_document_types, write_bundle
+from extractor import compile_extraction_plan
+
+
+def validate(files) -> list:
+    errores = []
+    for filename, lf in files.items():
+        regex_title = (lf.config.get("clasificacion", {}) or {}).get("regex_titulo")
+        if regex_title:
+            try:
+                re.compile(regex_title, flags=re.IGNORECASE)
+            except re.error as e:
+                errores.append(f"{filename}: regex_titulo inválido: {e}")
+        for pattern, compiled in compile_extraction_plan(lf.config).patterns.items():
+            if isinstance(compiled, re.error):
+                errores.append(f"{filename}: regex de campo inválido {pattern!r}: {compiled}")
+    return errores
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default=CONFIG_BUNDLE_PATH, help="Ruta del bundle (default: CONFIG_BUNDLE_PATH)")
+    args = parser.parse_args()
+
+    try:
+        files, _ = scan_document_types(DOCUMENT_TYPES_PATH, {})
+        snapshot = build_snapshot(files)
+    except Exception as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    errores = validate(files)
+    if errores:
+        for error in errores:
+            print(f"ERROR: {error}", file=sys.stderr)
+        sys.exit(1)
+
+    write_bundle(snapshot, args.out)
+    print(f"Bundle {args.out}: {len(snapshot.types)} tipos (config {snapshot.fingerprint[:12]})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,22 @@
-import re
-from unidecode import unidecode
-from config_loader import get_all_document_types
+import os
+from config_loader import get_compiled_classifier
+from metrics import METRICS
+from text_normalization import normalize_text
 
-
-def normalize_text(text: str) -> str:
-    """
-    Normaliza para comparación:
-    - sin acentos
-    - mayúsculas
-    - colapsa espacios
-    """
-    if not text:
-        return ""
-    text = unidecode(text)
-    text = text.upper()
-    text = re.sub(r"\s+", " ", text).strip()
-    return text
+# Clasificación escalonada: primero solo los primeros N caracteres (título y
+# keywords casi siempre están en la primera página) y el texto completo solo si
+# el prefijo no basta para asegurar el mismo resultado (ver classify_document).
+# 0 = siempre texto completo.
+CLASSIFY_PREFIX_CHARS = int(os.getenv("CLASSIFY_PREFIX_CHARS", "6000"))
 
 
-def safe_regex_search(pattern: str, text: str) -> bool:
-    if not pattern:
-        return False
-    try:
-        return re.search(pattern, text, flags=re.IGNORECASE) is not None
-    except re.error:
-        return False
+def _text_prefix(ocr_text: str, max_chars: int) -> str:
+    # Cortamos en el último salto de línea para no partir una keyword a la mitad
+    cut = ocr_text.rfind("\n", 0, max_chars)
+    return ocr_text[: cut if cut > 0 else max_chars]
 
 
-def classify_document(ocr_text: str):
+def classify_document(ocr_text: str, compiled=None, prefix_chars: int = None):
     """
     Devuelve: (tipo_documento, confianza, metodo, detalles)
 
@@ -38,83 +27,133 @@ def classify_document(ocr_text: str):
       * (opcional) bonus por "señales" extra si las agregas en config
     - Si no alcanza confianza_minima, aún puede devolver el "mejor candidato"
       como BAJA_CONFIANZA (útil para debug y para no quedar siempre en DESCONOCIDO).
+
+    `compiled`: clasificador de un snapshot del registro ya tomado (por defecto el vigente).
+    `prefix_chars`: tamaño del prefijo de la primera pasada (por defecto
+    CLASSIFY_PREFIX_CHARS). Si el prefijo decide, detalles["prefijo"] = caracteres usados.
+
+    El prefijo solo decide si el texto completo no puede cambiar el resultado:
+    lo que calza en el prefijo sigue calzando en el texto completo, así que el
+    ganador tiene que tener ya todas sus keywords y su regex (su puntaje no
+    puede subir) y ningún otro tipo puede alcanzarlo con su puntaje máximo
+    (ni empatarlo si va antes, porque en empate gana el primero). Con los
+    pesos por defecto (0.55 + 0.45 = 1.0) eso es: ganador completo y ningún
+    tipo anterior que pueda llegar a su puntaje. Un regex de título que deje de
+    calzar con más texto (anclado con $ o con lookahead negativo) rompe el
+    supuesto: esos tipos no deberían usar el prefijo (CLASSIFY_PREFIX_CHARS=0).
+    """
+    if compiled is None:
+        compiled = get_compiled_classifier()
+    if prefix_chars is None:
+        prefix_chars = CLASSIFY_PREFIX_CHARS
+
+    if ocr_text and 0 < prefix_chars < len(ocr_text):
+        prefix = _text_prefix(ocr_text, prefix_chars)
+        prefix_text = normalize_text(prefix)
+        prefix_hits = compiled.matcher.find(prefix_text)
+        result, final = _classify_text(prefix_text, compiled, prefix_hits)
+        # BAJA_CONFIANZA o DESCONOCIDO siempre pueden cambiar con el resto del texto
+        if final and result[2] == "REGLAS":
+            METRICS.inc("classify_prefijo_total", resultado="decide")
+            result[3]["prefijo"] = len(prefix)
+            return result
+        METRICS.inc("classify_prefijo_total", resultado="texto_completo")
+
+        # Si el corte cayó en un salto de línea, el texto completo reutiliza lo ya
+        # hecho con el prefijo: normalizar por partes da el mismo texto (los
+        # espacios del corte colapsan en uno) y las keywords nuevas son las que
+        # terminan después del prefijo, así que basta buscar desde
+        # max_keyword_len - 1 caracteres antes del corte.
+        if ocr_text.startswith("\n", len(prefix)):
+            text = " ".join(filter(None, (prefix_text, normalize_text(ocr_text[len(prefix):]))))
+            seam = max(0, len(prefix_text) - compiled.max_keyword_len + 1)
+            return _classify_text(text, compiled, prefix_hits | compiled.matcher.find(text[seam:]))[0]
+
+    return _classify_text(normalize_text(ocr_text), compiled)[0]
+
+
+def _classify_text(text: str, compiled, hits=None):
+    """
+    (resultado, final). final=True si más texto no puede cambiar el resultado:
+    el ganador ya tiene su puntaje máximo y ningún otro tipo puede superarlo
+    (o empatarlo, si va antes en el orden).
+
+    `hits`: keywords de `text` ya buscadas (por defecto se buscan aquí).
     """
-    text = normalize_text(ocr_text)
-    doc_types = get_all_document_types()
+    # Una sola pasada sobre el texto para las keywords de todos los tipos
+    if hits is None:
+        hits = compiled.matcher.find(text)
 
     best_type = "DESCONOCIDO"
     best_score = 0.0
     best_details = {"matches": [], "confianza_minima": None}
+    best_complete = False
+    best_index = -1
+    max_scores = []  # puntaje máximo posible de cada tipo, en orden
 
-    for type_id, cfg in doc_types.items():
-        if type_id == "DESCONOCIDO":
-            continue
-
-        clasif = cfg.get("clasificacion", {})
-        keywords = clasif.get("palabras_clave", []) or []
-        regex_title = clasif.get("regex_titulo", "") or ""
-        min_conf = float(clasif.get("confianza_minima", 0.8))
-
-        # Pesos configurables (si no vienen, usamos defaults buenos)
-        pesos = clasif.get("pesos", {}) or {}
-        w_keywords = float(pesos.get("keywords", 0.55))   # peso total máximo por keywords
-        w_regex = float(pesos.get("regex_titulo", 0.45))  # bonus por regex
-
+    # Keywords, regex y pesos vienen precompilados desde config_loader:
+    # aquí solo hacemos el trabajo que depende del texto.
+    for type_id, ct in compiled.types.items():
         matches = []
         score = 0.0
+        regex_hit = False
 
         # 1) Keywords: usamos proporción (en vez de +0.15 por cada una)
-        kw_norms = []
-        for kw in keywords:
-            kwn = normalize_text(str(kw))
-            if kwn:
-                kw_norms.append((kw, kwn))
-
         found = 0
-        for raw_kw, kw_n in kw_norms:
-            if kw_n in text:
+        for raw_kw, kw_n in ct.keywords:
+            if kw_n in hits:
                 found += 1
                 matches.append({"tipo": "keyword", "valor": raw_kw})
 
-        if kw_norms:
-            ratio = found / max(1, len(kw_norms))
-            score += w_keywords * ratio  # 0..w_keywords
+        if ct.keywords:
+            ratio = found / max(1, len(ct.keywords))
+            score += ct.w_keywords * ratio  # 0..w_keywords
 
         # 2) Regex título
-        if regex_title:
-            if safe_regex_search(regex_title, text):
-                score += w_regex
-                matches.append({"tipo": "regex_titulo", "valor": regex_title})
+        if ct.regex_title:
+            if ct.regex_title_compiled is not None:
+                if ct.regex_title_compiled.search(text):
+                    score += ct.w_regex
+                    regex_hit = True
+                    matches.append({"tipo": "regex_titulo", "valor": ct.regex_title})
             else:
                 # si el regex viene malo, lo marcamos (sin romper)
-                try:
-                    re.compile(regex_title)
-                except re.error:
-                    matches.append({"tipo": "regex_error", "valor": regex_title})
+                matches.append({"tipo": "regex_error", "valor": ct.regex_title})
 
         confianza = max(0.0, min(1.0, score))
+        regex_ok = ct.regex_title_compiled is not None
+        max_score = (ct.w_keywords if ct.keywords else 0.0) + (ct.w_regex if regex_ok else 0.0)
+        max_scores.append(max(0.0, min(1.0, max_score)))
 
         # Nos quedamos con el mejor SIEMPRE (para debug)
         if confianza > best_score:
             best_score = confianza
             best_type = type_id
+            best_index = len(max_scores) - 1
+            best_complete = found == len(ct.keywords) and regex_hit == regex_ok
             best_details = {
                 "matches": matches,
-                "confianza_minima": min_conf,
+                "confianza_minima": ct.min_conf,
                 "score": round(confianza, 4),
                 "keywords_found": found,
-                "keywords_total": len(kw_norms),
+                "keywords_total": len(ct.keywords),
             }
 
     # --- Política de salida ---
+    final = best_complete and all(
+        m < best_score if i < best_index else m <= best_score
+        for i, m in enumerate(max_scores)
+        if i != best_index
+    )
+
     # Si no hay nada, DESCONOCIDO
     if best_score <= 0.0:
-        return ("DESCONOCIDO", 0.0, "REGLAS", {"matches": []})
+        return ("DESCONOCIDO", 0.0, "REGLAS", {"matches": []}), False
 
     # Si el mejor candidato no alcanza su umbral, devolvemos BAJA_CONFIANZA
     # (Si prefieres la lógica antigua, cambia esto por DESCONOCIDO)
     min_conf_best = best_details.get("confianza_minima") or 0.8
     if best_score < float(min_conf_best):
-        return (best_type, best_score, "REGLAS_BAJA_CONFIANZA", best_details)
+        return (best_type, best_score, "REGLAS_BAJA_CONFIANZA", best_details), final
 
-    return (best_type, best_score, "REGLAS", best_details)
+    return (best_type, best_score, "REGLAS", best_details), final
@@ -1,6 +1,17 @@
+import hashlib
 import json
 import os
-from typing import Dict, Any, Optional
+import pickle
+import re
+import sys
+import threading
+import time
+from dataclasses import dataclass, replace
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Pattern, Tuple
+
+from keyword_matcher import KEYWORD_MATCHER_MIN_PATTERNS, build_keyword_matcher
+from text_normalization import normalize_text
 
 
 BASE_PATH = os.path.dirname(os.path.abspath(__file__))
@@ -83,15 +94,145 @@ def _resolve_document_types_path() -> str:
 DOCUMENT_TYPES_PATH = _resolve_document_types_path()
 
 
-def load_document_types() -> Dict[str, Dict[str, Any]]:
+@dataclass(frozen=True)
+class CompiledDocumentType:
+    """
+    Reglas de clasificación de un tipo ya preparadas para usarse en caliente:
+    keywords normalizadas, regex de título compilado y pesos validados.
+    """
+    type_id: str
+    keywords: Tuple[Tuple[str, str], ...]  # (keyword original, keyword normalizada)
+    regex_title: str
+    regex_title_compiled: Optional[Pattern]
+    min_conf: float
+    w_keywords: float
+    w_regex: float
+
+
+def _as_float(value: Any, default: float, type_id: str, field: str) -> float:
+    if value is None:
+        return default
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Tipo {type_id}: '{field}' debe ser numérico (recibido: {value!r})")
+
+
+def compile_document_type(type_id: str, cfg: Dict[str, Any]) -> CompiledDocumentType:
+    clasif = cfg.get("clasificacion", {}) or {}
+    pesos = clasif.get("pesos", {}) or {}
+
+    # Normalizamos una sola vez (y descartamos las que quedan vacías)
+    keywords = []
+    for kw in clasif.get("palabras_clave", []) or []:
+        kwn = normalize_text(str(kw))
+        if kwn:
+            keywords.append((kw, kwn))
+
+    regex_title = clasif.get("regex_titulo", "") or ""
+    regex_compiled = None
+    if regex_title:
+        try:
+            regex_compiled = re.compile(regex_title, flags=re.IGNORECASE)
+        except re.error:
+            # Un regex malo no bota el servicio: se reporta como regex_error al clasificar
+            regex_compiled = None
+
+    return CompiledDocumentType(
+        type_id=type_id,
+        keywords=tuple(keywords),
+        regex_title=regex_title,
+        regex_title_compiled=regex_compiled,
+        min_conf=_as_float(clasif.get("confianza_minima"), 0.8, type_id, "confianza_minima"),
+        w_keywords=_as_float(pesos.get("keywords"), 0.55, type_id, "pesos.keywords"),
+        w_regex=_as_float(pesos.get("regex_titulo"), 0.45, type_id, "pesos.regex_titulo"),
+    )
+
+
+@dataclass(frozen=True)
+class CompiledClassifier:
+    """
+    Tipos compilados + un único matcher con las keywords de todos los tipos,
+    para recorrer el texto una sola vez por documento.
+    """
+    types: Dict[str, CompiledDocumentType]
+    matcher: Any  # SubstringMatcher | AhoCorasickMatcher (ver keyword_matcher)
+    max_keyword_len: int = 0  # para buscar keywords que crucen el corte del prefijo
+
+
+def build_classifier(compiled: Dict[str, CompiledDocumentType], matcher: Any = None) -> CompiledClassifier:
+    """
+    `matcher`: uno ya construido (del bundle); se usa solo si tiene exactamente
+    las mismas keywords.
+    """
+    all_keywords = [kw_n for ct in compiled.values() for _, kw_n in ct.keywords]
+    if matcher is None or matcher.patterns != tuple(dict.fromkeys(k for k in all_keywords if k)):
+        matcher = build_keyword_matcher(all_keywords)
+    return CompiledClassifier(types=compiled, matcher=matcher,
+                              max_keyword_len=max(map(len, matcher.patterns), default=0))
+
+
+def config_fingerprint(types: Dict[str, Dict[str, Any]]) -> str:
+    """
+    Hash del conjunto efectivo de configs (contenido canónico, incluye "version").
+    Es global y no por tipo: agregar o cambiar cualquier tipo puede cambiar
+    la clasificación de un documento.
     """
-    Carga todos los JSON de DOCUMENT_TYPES_PATH y los devuelve como dict { ID_TIPO: config }
+    h = hashlib.sha256()
+    for type_id in sorted(types):
+        h.update(type_id.encode("utf-8"))
+        h.update(json.dumps(types[type_id], sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    return h.hexdigest()
+
+
+# =========================
+# Registro recargable en caliente
+# =========================
+# Cada cuántos segundos se revisa (mtime/tamaño, y checksum si cambiaron) el
+# directorio de tipos. 0 = se carga una sola vez al iniciar.
+CONFIG_RELOAD_INTERVAL = float(os.getenv("CONFIG_RELOAD_INTERVAL", "30"))
+
+
+@dataclass(frozen=True)
+class LoadedTypeFile:
+    mtime_ns: int
+    size: int
+    checksum: str
+    type_id: str
+    config: Dict[str, Any]
+    compiled: Optional[CompiledDocumentType]  # None para DESCONOCIDO
+    loaded_at: str
+
+
+@dataclass(frozen=True)
+class RegistrySnapshot:
     """
-    types: Dict[str, Dict[str, Any]] = {}
+    Estado completo e inmutable del registro. Se reemplaza entero al recargar,
+    así quien lo tomó sigue con una versión coherente (tipos, clasificador y
+    fingerprint siempre de la misma carga).
+    """
+    types: Dict[str, Dict[str, Any]]
+    classifier: CompiledClassifier
+    fingerprint: str
+    files: Dict[str, LoadedTypeFile]  # nombre de archivo -> carga
+
+    def type_versions(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            lf.type_id: {
+                "version": str(lf.config.get("version", "1.0")),
+                "checksum": lf.checksum,
+                "archivo": filename,
+                "cargado": lf.loaded_at,
+            }
+            for filename, lf in self.files.items()
+            if self.types.get(lf.type_id) is lf.config
+        }
 
-    if not os.path.isdir(DOCUMENT_TYPES_PATH):
+
+def _list_type_files(path: str) -> List[str]:
+    if not os.path.isdir(path):
         searched = {
-            "DOCUMENT_TYPES_PATH_resuelto": DOCUMENT_TYPES_PATH,
+            "DOCUMENT_TYPES_PATH_resuelto": path,
             "ENV_DOCUMENT_TYPES_PATH": os.getenv("DOCUMENT_TYPES_PATH"),
             "ENV_CONFIG_PATH": os.getenv("CONFIG_PATH"),
             "BASE_PATH": BASE_PATH,
@@ -104,37 +245,223 @@ def load_document_types() -> Dict[str, Dict[str, Any]]:
             f"Detalles: {json.dumps(searched, ensure_ascii=False)}"
         )
 
-    filenames = [f for f in os.listdir(DOCUMENT_TYPES_PATH) if f.endswith(".json")]
+    filenames = [f for f in os.listdir(path) if f.endswith(".json")]
     if not filenames:
-        raise RuntimeError(f"El directorio existe pero no hay JSON en: {DOCUMENT_TYPES_PATH}")
+        raise RuntimeError(f"El directorio existe pero no hay JSON en: {path}")
+    return filenames
 
-    for filename in filenames:
-        full_path = os.path.join(DOCUMENT_TYPES_PATH, filename)
 
-        try:
-            with open(full_path, "r", encoding="utf-8") as f:
-                config = json.load(f)
-        except Exception as e:
-            raise RuntimeError(f"Error leyendo JSON {full_path}: {e}")
+def _load_type_file(full_path: str, filename: str, st: os.stat_result, raw: bytes, checksum: str) -> LoadedTypeFile:
+    try:
+        config = json.loads(raw.decode("utf-8"))
+    except Exception as e:
+        raise RuntimeError(f"Error leyendo JSON {full_path}: {e}")
+
+    doc_id = str(config.get("id", "")).strip()
+    if not doc_id:
+        raise ValueError(f"{filename} no tiene campo 'id' válido")
+
+    return LoadedTypeFile(
+        mtime_ns=st.st_mtime_ns,
+        size=st.st_size,
+        checksum=checksum,
+        type_id=doc_id,
+        config=config,
+        compiled=compile_document_type(doc_id, config) if doc_id != "DESCONOCIDO" else None,
+        loaded_at=datetime.utcnow().isoformat() + "Z",
+    )
+
 
-        doc_id = str(config.get("id", "")).strip()
-        if not doc_id:
-            raise ValueError(f"{filename} no tiene campo 'id' válido")
+def scan_document_types(path: str, previous: Dict[str, LoadedTypeFile]) -> Tuple[Dict[str, LoadedTypeFile], bool]:
+    """
+    Relee solo los JSON nuevos o modificados (mtime/tamaño distinto y checksum
+    distinto); el resto se reutiliza ya compilado. Devuelve (archivos, hubo_cambios).
+    Cualquier error (JSON inválido, id faltante, pesos no numéricos) se lanza
+    sin tocar nada: el registro sigue con la carga anterior.
+    """
+    files: Dict[str, LoadedTypeFile] = {}
+    changed = False
+    for filename in _list_type_files(path):
+        full_path = os.path.join(path, filename)
+        st = os.stat(full_path)
+        prev = previous.get(filename)
+        if prev is not None and prev.mtime_ns == st.st_mtime_ns and prev.size == st.st_size:
+            files[filename] = prev
+            continue
+
+        with open(full_path, "rb") as f:
+            raw = f.read()
+        checksum = hashlib.sha256(raw).hexdigest()
+        if prev is not None and prev.checksum == checksum:
+            # Solo lo tocaron: guardamos el stat nuevo para no volver a leerlo
+            files[filename] = replace(prev, mtime_ns=st.st_mtime_ns, size=st.st_size)
+            continue
+
+        files[filename] = _load_type_file(full_path, filename, st, raw, checksum)
+        changed = True
+
+    if set(files) != set(previous):
+        changed = True
+    return files, changed
+
+
+def build_snapshot(files: Dict[str, LoadedTypeFile], matcher: Any = None) -> RegistrySnapshot:
+    # Mismo criterio que antes: orden de listdir y, si dos archivos traen el mismo id, gana el último
+    by_type: Dict[str, LoadedTypeFile] = {}
+    for lf in files.values():
+        by_type[lf.type_id] = lf
+
+    types = {type_id: lf.config for type_id, lf in by_type.items()}
+    compiled = {type_id: lf.compiled for type_id, lf in by_type.items() if lf.compiled is not None}
+    return RegistrySnapshot(
+        types=types,
+        classifier=build_classifier(compiled, matcher),
+        fingerprint=config_fingerprint(types),
+        files=files,
+    )
+
+
+# =========================
+# Bundle precompilado (ver build_config_bundle.py)
+# =========================
+# Por defecto junto al directorio de tipos: /app/config/document_types.bundle
+CONFIG_BUNDLE_PATH = os.getenv("CONFIG_BUNDLE_PATH") or os.path.join(
+    os.path.dirname(DOCUMENT_TYPES_PATH), "document_types.bundle"
+)
+BUNDLE_FORMAT = 1
+
+
+def bundle_key() -> str:
+    """
+    Identifica el código que compiló el bundle: si cambia la normalización, la
+    compilación de tipos o el matcher de keywords (código o umbral
+    KEYWORD_MATCHER_MIN_PATTERNS), o Python / unidecode, el bundle se ignora.
+    """
+    try:
+        from importlib.metadata import version
+        unidecode_version = version("Unidecode")
+    except Exception:
+        unidecode_version = "?"
+    h = hashlib.sha256(
+        f"{BUNDLE_FORMAT}|{sys.version_info[:2]}|{unidecode_version}|{KEYWORD_MATCHER_MIN_PATTERNS}".encode("utf-8")
+    )
+    for module_file in ("config_loader.py", "text_normalization.py", "keyword_matcher.py"):
+        with open(os.path.join(BASE_PATH, module_file), "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def write_bundle(snapshot: RegistrySnapshot, bundle_path: str) -> None:
+    tmp_path = f"{bundle_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(
+            {"key": bundle_key(), "files": snapshot.files, "matcher": snapshot.classifier.matcher},
+            f,
+            protocol=pickle.HIGHEST_PROTOCOL,
+        )
+    os.replace(tmp_path, bundle_path)
+
+
+def load_bundle(bundle_path: str) -> Tuple[Dict[str, LoadedTypeFile], Any]:
+    """
+    (archivos ya compilados, matcher de keywords) del bundle, o ({}, None) si
+    no existe o es de otro código.
+
+    No se valida aquí contra los JSON: scan_document_types reutiliza cada
+    entrada solo si su archivo tiene el mismo stat o el mismo checksum (las
+    que no calzan se recompilan desde el JSON) y build_classifier usa el
+    matcher solo si las keywords resultantes son las mismas.
+    """
+    if not bundle_path or not os.path.isfile(bundle_path):
+        return {}, None
+    try:
+        with open(bundle_path, "rb") as f:
+            data = pickle.load(f)
+        if data.get("key") != bundle_key():
+            print(f"Bundle {bundle_path} es de otra versión del código, se usan los JSON")
+            return {}, None
+        return data["files"], data["matcher"]
+    except Exception as e:
+        print(f"No se pudo leer el bundle {bundle_path}, se usan los JSON: {e}")
+        return {}, None
+
+
+class DocumentTypeRegistry:
+    """
+    Tipos de documento cargados desde `path`, recargables sin reiniciar.
+
+    snapshot() devuelve la carga vigente; como mucho cada `reload_interval`
+    segundos revisa el directorio. Si hay cambios se compila solo lo que cambió
+    y se reemplaza el snapshot de una vez. La revisión la hace un solo thread
+    (los demás siguen clasificando con el snapshot actual, sin esperar).
+    """
+
+    def __init__(self, path: str, reload_interval: float = 0.0, bundle_path: Optional[str] = None):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.reloads = 0
+        self.last_error: Optional[str] = None
+        self._lock = threading.Lock()
+        bundled, matcher = load_bundle(bundle_path)
+        files, _ = scan_document_types(path, bundled)
+        self.from_bundle = sum(
+            1 for filename, lf in files.items() if filename in bundled and bundled[filename].config is lf.config
+        )
+        self._snapshot = build_snapshot(files, matcher)
+        self._next_check = time.monotonic() + reload_interval
+
+    def snapshot(self) -> RegistrySnapshot:
+        if self.reload_interval > 0 and time.monotonic() >= self._next_check:
+            self.check()
+        return self._snapshot
+
+    def check(self) -> bool:
+        """
+        Revisa el directorio ahora. True si se cargó una versión nueva.
+        """
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            self._next_check = time.monotonic() + self.reload_interval
+            current = self._snapshot
+            try:
+                files, changed = scan_document_types(self.path, current.files)
+                new = build_snapshot(files) if changed else replace(current, files=files)
+            except Exception as e:
+                if self.last_error != str(e):
+                    print(f"Recarga de document_types falló, se mantiene la versión anterior: {e}")
+                self.last_error = str(e)
+                return False
+            self.last_error = None
+            self._snapshot = new
+            if changed:
+                self.reloads += 1
+                print(f"document_types recargados (config {new.fingerprint[:12]})")
+            return changed
+        finally:
+            self._lock.release()
 
-        types[doc_id] = config
 
-    return types
+REGISTRY = DocumentTypeRegistry(DOCUMENT_TYPES_PATH, CONFIG_RELOAD_INTERVAL, CONFIG_BUNDLE_PATH)
 
 
-# Cache en memoria (se carga una vez por proceso)
-DOCUMENT_TYPES = load_document_types()
+def get_registry_snapshot() -> RegistrySnapshot:
+    return REGISTRY.snapshot()
 
 
 def get_document_type(type_id: str):
     if type_id is None:
         return None
-    return DOCUMENT_TYPES.get(str(type_id).strip())
+    return get_registry_snapshot().types.get(str(type_id).strip())
 
 
 def get_all_document_types():
-    return DOCUMENT_TYPES
+    return get_registry_snapshot().types
+
+
+def get_compiled_classifier() -> CompiledClassifier:
+    return get_registry_snapshot().classifier
+
+
+def get_config_fingerprint() -> str:
+    return get_registry_snapshot().fingerprint
@@ -1,4 +1,7 @@
 import re
+from dataclasses import dataclass
+from typing import Dict, Optional, Pattern, Tuple, Union
+
 from unidecode import unidecode
 
 
@@ -32,6 +35,12 @@ def normalize_money(value: str, config):
         return None
 
 
+_PERIOD_NUM_RE = re.compile(r"(\d{2})/(20\d{2})")
+_PERIOD_NAME_RE = re.compile(
+    r"(ENERO|FEBRERO|MARZO|ABRIL|MAYO|JUNIO|JULIO|AGOSTO|SEPTIEMBRE|OCTUBRE|NOVIEMBRE|DICIEMBRE)\s+(?:DEL\s+)?(20\d{2})"
+)
+
+
 def normalize_period(value: str, config):
     """
     Convierte:
@@ -44,7 +53,7 @@ def normalize_period(value: str, config):
     value = unidecode(value).upper()
 
     # Caso 01/2025
-    m = re.search(r"(\d{2})/(20\d{2})", value)
+    m = _PERIOD_NUM_RE.search(value)
     if m:
         month_num = m.group(1)
         year = m.group(2)
@@ -54,63 +63,162 @@ def normalize_period(value: str, config):
             return f"{month_name} {year}"
 
     # Caso OCTUBRE 2025
-    m = re.search(r"(ENERO|FEBRERO|MARZO|ABRIL|MAYO|JUNIO|JULIO|AGOSTO|SEPTIEMBRE|OCTUBRE|NOVIEMBRE|DICIEMBRE)\s+(?:DEL\s+)?(20\d{2})", value)
+    m = _PERIOD_NAME_RE.search(value)
     if m:
         return f"{m.group(1)} {m.group(2)}"
 
     return None
 
 
+_NUMBER_RE = re.compile(r"[\d\.,]+")
+_UNICODE_ONLY_SPACES_RE = re.compile("[\x1c-\x1f]")
+_KEY_WINDOW = 200
+
+
+@dataclass(frozen=True)
+class FieldPlan:
+    name: str
+    keys: Tuple[str, ...]  # claves_busqueda ya normalizadas
+    regex: Optional[str]
+    regex_opts: Tuple[str, ...]
+    is_number: bool
+    is_period: bool
+    required: bool
+
+
+@dataclass(frozen=True)
+class ExtractionPlan:
+    """
+    Campos de un tipo de documento preparados para extraer: claves normalizadas
+    y cada patrón distinto compilado una sola vez (aunque lo usen varios campos).
+
+    Cada patrón se compila también con re.ASCII: tras unidecode el texto es
+    ASCII y el motor va bastante más rápido (sobre todo con (?i)). La única
+    diferencia posible son los separadores 0x1C-0x1F, que en modo Unicode
+    cuentan como espacio; si el texto los trae se usan los patrones Unicode.
+    """
+    fields: Tuple[FieldPlan, ...]
+    patterns: Dict[str, Union[Pattern, re.error]]
+    ascii_patterns: Dict[str, Union[Pattern, re.error]]
+
+
+def compile_extraction_plan(doc_config: dict) -> ExtractionPlan:
+    fields = []
+    patterns: Dict[str, Union[Pattern, re.error]] = {}
+    ascii_patterns: Dict[str, Union[Pattern, re.error]] = {}
+
+    for field_name, cfg in doc_config.get("campos", {}).items():
+        regex = cfg.get("regex") or None
+        regex_opts = tuple(cfg.get("regex_opciones", []))
+
+        for pattern in ((regex,) if regex else ()) + regex_opts:
+            if pattern not in patterns:
+                try:
+                    patterns[pattern] = re.compile(pattern)
+                except re.error as e:
+                    # Se levanta recién si el campo llega a usarlo (igual que antes)
+                    patterns[pattern] = ascii_patterns[pattern] = e
+                    continue
+                try:
+                    ascii_patterns[pattern] = re.compile(pattern, re.ASCII)
+                except (re.error, ValueError):  # p.ej. un (?u) explícito
+                    ascii_patterns[pattern] = patterns[pattern]
+
+        fields.append(
+            FieldPlan(
+                name=field_name,
+                keys=tuple(normalize_text(key) for key in cfg.get("claves_busqueda", [])),
+                regex=regex,
+                regex_opts=regex_opts,
+                is_number=cfg.get("tipo") == "number",
+                is_period=field_name == "periodo_remuneracion",
+                required=bool(cfg.get("obligatorio")),
+            )
+        )
+
+    return ExtractionPlan(fields=tuple(fields), patterns=patterns, ascii_patterns=ascii_patterns)
+
+
+# Plan por config (por identidad del dict: cada carga/recarga del registro trae dicts nuevos)
+_PLAN_CACHE: Dict[int, Tuple[dict, ExtractionPlan]] = {}
+_PLAN_CACHE_MAX = 128
+
+
+def get_extraction_plan(doc_config: dict) -> ExtractionPlan:
+    cached = _PLAN_CACHE.get(id(doc_config))
+    if cached is not None and cached[0] is doc_config:
+        return cached[1]
+
+    plan = compile_extraction_plan(doc_config)
+    if len(_PLAN_CACHE) >= _PLAN_CACHE_MAX:
+        _PLAN_CACHE.clear()
+    # Guardamos también el dict para que su id no se reutilice mientras esté en caché
+    _PLAN_CACHE[id(doc_config)] = (doc_config, plan)
+    return plan
+
+
 def extract_fields(ocr_text: str, doc_config: dict):
     text = normalize_text(ocr_text)
+    plan = get_extraction_plan(doc_config)
 
-    campos_config = doc_config.get("campos", {})
     results = {}
     missing = []
     errors = []
 
-    for field_name, cfg in campos_config.items():
+    patterns = plan.patterns if _UNICODE_ONLY_SPACES_RE.search(text) else plan.ascii_patterns
+
+    # Memo por documento: cada clave y cada patrón se busca una sola vez en el texto
+    key_hits: Dict[str, int] = {}
+    pattern_hits: Dict[str, Optional[str]] = {}
+
+    def _search(pattern: str) -> Optional[str]:
+        if pattern not in pattern_hits:
+            compiled = patterns[pattern]
+            if isinstance(compiled, re.error):
+                raise compiled
+            m = compiled.search(text)
+            pattern_hits[pattern] = m.group(0) if m else None
+        return pattern_hits[pattern]
+
+    for field in plan.fields:
         value = None
 
         # Buscar por claves
-        keys = cfg.get("claves_busqueda", [])
-        for key in keys:
-            key_norm = normalize_text(key)
-            idx = text.find(key_norm)
+        for key_norm in field.keys:
+            idx = key_hits.get(key_norm)
+            if idx is None:
+                idx = key_hits[key_norm] = text.find(key_norm)
             if idx != -1:
-                # Tomamos una ventana de texto luego de la clave
-                window = text[idx: idx + 200]
-                numbers = re.findall(r"[\d\.,]+", window)
-                if numbers:
-                    value = numbers[0]
+                # Primer número en una ventana de texto luego de la clave
+                m = _NUMBER_RE.search(text, idx, idx + _KEY_WINDOW)
+                if m:
+                    value = m.group(0)
                     break
 
         # Buscar por regex
         if not value:
-            regex = cfg.get("regex")
-            if regex:
-                m = re.search(regex, text)
-                if m:
-                    value = m.group(0)
-
-            regex_opts = cfg.get("regex_opciones", [])
-            for r in regex_opts:
-                m = re.search(r, text)
-                if m:
-                    value = m.group(0)
+            if field.regex:
+                found = _search(field.regex)
+                if found is not None:
+                    value = found
+
+            for r in field.regex_opts:
+                found = _search(r)
+                if found is not None:
+                    value = found
                     break
 
         # Normalizaciones especiales
         if value:
-            if cfg.get("tipo") == "number":
+            if field.is_number:
                 value = normalize_money(value, doc_config)
-            if field_name == "periodo_remuneracion":
+            if field.is_period:
                 value = normalize_period(value, doc_config)
 
         if value is None:
-            if cfg.get("obligatorio"):
-                missing.append(field_name)
+            if field.required:
+                missing.append(field.name)
         else:
-            results[field_name] = value
+            results[field.name] = value
 
     return results, missing, errors
@@ -0,0 +1,83 @@
+"""
+Generador local de envelopes de Pub/Sub push para probar pubsub_push sin GCP.
+
+    python fake_pubsub.py --url http://localhost:8080/ -n 2000 -c 64
+
+Arma envelopes con el mismo formato que manda una suscripción push
+({"message": {"data": base64(json), "messageId", ...}, "subscription"}) y los
+postea en paralelo, reportando throughput y cuántos fueron ack (2xx).
+"""
+import argparse
+import base64
+import json
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+
+SUBSCRIPTION = "projects/local/subscriptions/fake-push"
+
+
+def make_envelope(data: dict, message_id: str = None) -> dict:
+    return {
+        "message": {
+            "data": base64.b64encode(json.dumps(data, ensure_ascii=False).encode("utf-8")).decode("ascii"),
+            "messageId": message_id or uuid.uuid4().hex,
+            "publishTime": datetime.utcnow().isoformat() + "Z",
+            "attributes": {},
+        },
+        "subscription": SUBSCRIPTION,
+    }
+
+
+def fake_payload(i: int) -> dict:
+    # Mismo formato que guarda servicio-ocr: {"archivo", "url_storage", "contenido": texto}
+    return {
+        "archivo": f"fake_{i:06d}.pdf",
+        "url_storage": f"gs://fake-bucket/fake_{i:06d}.pdf",
+        "contenido": (
+            f"LIQUIDACION DE SUELDO\nRUT 12.345.678-{i % 10}\nPERIODO ENERO 2025\n"
+            f"TOTAL HABERES {100000 + i}\nLIQUIDO A PAGAR {90000 + i}\n"
+        ),
+    }
+
+
+def post_envelope(url: str, envelope: dict, timeout: float = 30) -> int:
+    req = urllib.request.Request(
+        url,
+        data=json.dumps(envelope).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as r:
+            return r.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8080/")
+    parser.add_argument("-n", type=int, default=1000, help="Cantidad de mensajes")
+    parser.add_argument("-c", type=int, default=32, help="Requests concurrentes")
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.c) as pool:
+        codes = list(pool.map(lambda i: post_envelope(args.url, make_envelope(fake_payload(i))), range(args.n)))
+    elapsed = time.monotonic() - started
+
+    acks = sum(1 for c in codes if 200 <= c < 300)
+    print(f"{args.n} mensajes en {elapsed:.2f}s ({args.n / elapsed:.1f} msg/s): {acks} ack, {args.n - acks} nack")
+    for code in sorted(set(codes) - set(range(200, 300))):
+        print(f"  status {code}: {codes.count(code)}")
+
+
+if __name__ == "__main__":
+    main()
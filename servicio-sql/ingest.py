@@ -0,0 +1,113 @@
+import os
+import threading
+import time
+from typing import Any, Callable, List, Optional
+
+
+# Micro-batching del push de Pub/Sub: cada request espera a que su mensaje quede
+# guardado en un flush conjunto (así el 2xx = ack llega solo después del commit).
+PUBSUB_BATCH_ENABLED = os.getenv("PUBSUB_BATCH", "0").strip().lower() in ("1", "true", "yes", "si", "sí")
+PUBSUB_BATCH_SIZE = int(os.getenv("PUBSUB_BATCH_SIZE", "200"))
+PUBSUB_BATCH_WAIT_MS = float(os.getenv("PUBSUB_BATCH_WAIT_MS", "10"))
+PUBSUB_BATCH_TIMEOUT = float(os.getenv("PUBSUB_BATCH_TIMEOUT", "30"))  # segundos máximos esperando el flush
+
+
+class _Ticket:
+    __slots__ = ("item", "done", "error")
+
+    def __init__(self, item: Any):
+        self.item = item
+        self.done = threading.Event()
+        self.error: Optional[Exception] = None
+
+
+class MicroBatcher:
+    """
+    Junta items enviados desde varios threads y los entrega a `flush_fn(items)`
+    en grupos de hasta `max_items`, o cuando el primero lleva `max_wait_ms`
+    esperando. submit() bloquea hasta que el grupo del item se guardó y relanza
+    el error si el flush falló. Si falla un grupo se reintenta item por item,
+    así solo falla (y Pub/Sub reenvía) el mensaje que de verdad no entra. Si
+    vence el timeout antes del flush, el item se saca del buffer.
+
+    Cada proceso (worker de gunicorn) tiene su propio buffer y su thread de
+    flush, que se crea en el primer submit (después del fork). No hay estado
+    compartido entre workers.
+    """
+
+    def __init__(self, flush_fn: Callable[[List[Any]], None], max_items: int, max_wait_ms: float):
+        self.flush_fn = flush_fn
+        self.max_items = max(1, max_items)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._pending: List[_Ticket] = []
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self.flushes = 0
+        self.items = 0
+
+    def _ensure_thread(self):
+        # Perezoso: el thread nace dentro del worker de gunicorn, no en el master
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="pubsub-batcher", daemon=True)
+            self._thread.start()
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def submit(self, item: Any, timeout: Optional[float] = None) -> None:
+        ticket = _Ticket(item)
+        with self._cond:
+            self._ensure_thread()
+            self._pending.append(ticket)
+            if len(self._pending) == 1 or len(self._pending) >= self.max_items:
+                self._cond.notify()
+        if not ticket.done.wait(timeout):
+            with self._cond:
+                # Si ningún flush lo tomó aún se saca del buffer: el mensaje vuelve por
+                # el reintento de Pub/Sub y no debe guardarse también desde acá
+                if ticket in self._pending:
+                    self._pending.remove(ticket)
+                    raise TimeoutError("El batch no llegó a flush a tiempo")
+            # Ya va en un flush en curso: puede quedar guardado igual (el INSERT es
+            # idempotente por messageId, ver _flush_documentos)
+            if not ticket.done.is_set():
+                raise TimeoutError("El flush del batch no terminó a tiempo")
+        if ticket.error is not None:
+            raise ticket.error
+
+    def _take_batch(self) -> List[_Ticket]:
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            deadline = time.monotonic() + self.max_wait
+            while len(self._pending) < self.max_items:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._pending[: self.max_items]
+            del self._pending[: self.max_items]
+            return batch
+
+    def _flush(self, batch: List[_Ticket]) -> bool:
+        try:
+            self.flush_fn([t.item for t in batch])
+        except Exception as e:
+            for t in batch:
+                t.error = e
+            return False
+        self.flushes += 1
+        self.items += len(batch)
+        return True
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if not self._flush(batch) and len(batch) > 1:
+                # Un mensaje malo no debe tumbar (y hacer reintentar) a todo el grupo:
+                # se reintenta de a uno y solo fallan los que fallan solos
+                for t in batch:
+                    t.error = None
+                    self._flush([t])
+            for t in batch:
+                t.done.set()
@@ -0,0 +1,95 @@
+import os
+from collections import deque
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set
+
+
+# Bajo este número de keywords distintas, N búsquedas `in` (en C) siguen siendo
+# más rápidas que recorrer el autómata carácter a carácter en Python.
+# Con 0 se usa siempre el autómata.
+KEYWORD_MATCHER_MIN_PATTERNS = int(os.getenv("KEYWORD_MATCHER_MIN_PATTERNS", "256"))
+
+
+class SubstringMatcher:
+    """
+    Estrategia simple: una búsqueda `in` por keyword. Es la más rápida cuando
+    hay pocas keywords en total.
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns = tuple(dict.fromkeys(p for p in patterns if p))
+
+    def find(self, text: str) -> Set[str]:
+        if not text:
+            return set()
+        return {p for p in self.patterns if p in text}
+
+
+class AhoCorasickMatcher:
+    """
+    Autómata Aho-Corasick sobre todas las keywords: recorre el texto una sola
+    vez y devuelve las keywords que aparecen (como substring, igual que `in`).
+
+    Las transiciones se resuelven completas al construir (fail incluido), así el
+    recorrido es un solo lookup de dict por carácter.
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns = tuple(dict.fromkeys(p for p in patterns if p))
+
+        goto: List[Dict[str, int]] = [{}]
+        outputs: List[Set[str]] = [set()]
+        for pattern in self.patterns:
+            state = 0
+            for ch in pattern:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    goto.append({})
+                    outputs.append(set())
+                    nxt = len(goto) - 1
+                    goto[state][ch] = nxt
+                state = nxt
+            outputs[state].add(pattern)
+
+        # BFS desde la raíz: cada estado hereda salidas y transiciones de su fail,
+        # que siempre es menos profundo y por lo tanto ya está resuelto.
+        fail = [0] * len(goto)
+        delta: List[Dict[str, int]] = [{} for _ in goto]
+        delta[0] = goto[0]
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            delta[state] = {**delta[fail[state]], **goto[state]}
+            outputs[state] |= outputs[fail[state]]
+            for ch, nxt in goto[state].items():
+                fail[nxt] = delta[fail[state]].get(ch, 0)
+                queue.append(nxt)
+
+        self._delta = delta
+        self._outputs: List[Optional[FrozenSet[str]]] = [frozenset(o) if o else None for o in outputs]
+
+    def find(self, text: str) -> Set[str]:
+        found: Set[str] = set()
+        if not text:
+            return found
+
+        delta = self._delta
+        outputs = self._outputs
+        state = 0
+        for ch in text:
+            state = delta[state].get(ch, 0)
+            out = outputs[state]
+            if out is not None:
+                found |= out
+        return found
+
+
+def build_keyword_matcher(patterns: Iterable[str], min_patterns: Optional[int] = None):
+    """
+    Elige la estrategia según cuántas keywords distintas hay. Ambas devuelven
+    exactamente el mismo conjunto de keywords encontradas.
+    """
+    patterns = tuple(dict.fromkeys(p for p in patterns if p))
+    threshold = KEYWORD_MATCHER_MIN_PATTERNS if min_patterns is None else min_patterns
+    if len(patterns) >= threshold:
+        return AhoCorasickMatcher(patterns)
+    return SubstringMatcher(patterns)
@@ -1,19 +1,64 @@
 import os
 import base64
 import json
+import time
 from datetime import datetime
 
-from flask import Flask, request, jsonify
+import click
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import (
+    Integer,
+    String,
+    Text,
+    and_,
+    cast,
+    column,
+    delete,
+    false,
+    func,
+    insert,
+    literal,
+    or_,
+    select,
+    tuple_,
+    update,
+    values,
+)
+from sqlalchemy.dialects.postgresql import JSONB, REGCONFIG, TSVECTOR
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from unidecode import unidecode
 
 # Nuevos imports (Fase 1)
-from classifier import classify_document
-from extractor import extract_fields
-from config_loader import get_document_type
+from config_loader import REGISTRY, get_all_document_types, get_document_type, get_registry_snapshot
+from metrics import METRICS, install_flask
+from ingest import PUBSUB_BATCH_ENABLED, PUBSUB_BATCH_SIZE, PUBSUB_BATCH_TIMEOUT, PUBSUB_BATCH_WAIT_MS, MicroBatcher
+from schema import (
+    BUSQUEDA_CONFIG,
+    CAMPOS_TABLE,
+    backfill_statements,
+    index_name,
+    schema_statements,
+    search_backfill_statement,
+    typed_field_rows,
+)
+from pipeline import (
+    RESULT_KEYS,
+    MissingConfigError,
+    apply_result_to_contenido,
+    is_up_to_date,
+    process_for_ingest,
+    process_for_storage,
+    process_many,
+    process_ocr_text_cached,
+)
 
 app = Flask(__name__)
 print("Servicio SQL activo")
+install_flask(app, "servicio_sql")
+
+# Clasificar + extraer en pubsub_push antes del INSERT (si falla, queda "Pendiente" como siempre)
+INGEST_INLINE_PROCESS = os.getenv("INGEST_INLINE_PROCESS", "0").strip().lower() in ("1", "true", "yes", "si", "sí")
 # =========================
 # Configuración Base de Datos (ENV)
 # =========================
@@ -37,34 +82,102 @@ class Documento(db.Model):
     tipo_documento = db.Column(db.String)  # ej: LIQUIDACION / DESCONOCIDO / Pendiente
     url_almacenamiento = db.Column(db.String)
     contenido = db.Column(JSONB)  # aquí guardas el payload OCR (y luego extracción)
+    texto_ocr = db.Column(db.Text)  # texto OCR (se escribe una vez; no vive en contenido)
+    # tsvector del texto OCR; lo mantiene un trigger (migrate-schema), nunca se escribe desde acá
+    busqueda = db.deferred(db.Column(TSVECTOR))
     fecha_proceso = db.Column(db.DateTime, default=datetime.utcnow)
+    # messageId de Pub/Sub (índice único): un reenvío del mismo mensaje no duplica el documento
+    pubsub_message_id = db.Column(db.String)
+
+
+class DocumentoCampo(db.Model):
+    # Campos extraídos con tipo real, para reportes SQL (la crea migrate-schema)
+    __tablename__ = CAMPOS_TABLE
+    documento_id = db.Column(db.Integer, db.ForeignKey("documentos.id", ondelete="CASCADE"), primary_key=True)
+    campo = db.Column(db.String, primary_key=True)
+    tipo_documento = db.Column(db.String, nullable=False)
+    valor_num = db.Column(db.Numeric)
+    valor_txt = db.Column(db.Text)
 
 
 # =========================
 # Utilidades
 # =========================
-def _get_ocr_text_from_contenido(contenido: dict) -> str:
+# Llaves donde puede venir el texto OCR, en orden de preferencia ("ocr.texto" = anidado)
+_OCR_TEXT_KEYS = ("ocr_text", "texto", "text", "ocr", "contenido_texto", "contenido", "ocr.texto")
+
+
+def _find_ocr_text(contenido: dict):
     """
     Intenta obtener el texto OCR desde distintas llaves comunes.
     Ajusta esto cuando confirmemos el formato real que te entrega servicio-ocr.
+    Devuelve (ruta, texto), con ruta tipo "texto" u "ocr.texto"; ("", "") si no hay.
     """
     if not isinstance(contenido, dict):
-        return ""
+        return "", ""
 
-    # posibles llaves
-    for k in ["ocr_text", "texto", "text", "ocr", "contenido_texto"]:
-        val = contenido.get(k)
+    for path in _OCR_TEXT_KEYS:
+        val = contenido
+        for k in path.split("."):
+            val = val.get(k) if isinstance(val, dict) else None
         if isinstance(val, str) and val.strip():
-            return val
+            return path, val
 
-    # si viene como contenido["ocr"]["texto"]
-    ocr = contenido.get("ocr")
-    if isinstance(ocr, dict):
-        texto = ocr.get("texto")
-        if isinstance(texto, str) and texto.strip():
-            return texto
+    return "", ""
 
-    return ""
+
+def _pop_ocr_text(contenido: dict) -> str:
+    """
+    Saca el texto OCR del payload (para guardarlo en la columna texto_ocr).
+    """
+    path, texto = _find_ocr_text(contenido)
+    if path:
+        *parents, last = path.split(".")
+        node = contenido
+        for k in parents:
+            node = node[k]
+        del node[last]
+    return texto
+
+
+def _document_text(texto_ocr, contenido):
+    """
+    (texto, ruta en contenido a mover a texto_ocr o "" si ya está en la columna)
+    """
+    if isinstance(texto_ocr, str) and texto_ocr.strip():
+        return texto_ocr, ""
+    path, texto = _find_ocr_text(contenido)
+    return texto, path
+
+
+def _campos_rows(doc_id: int, doc_type: str, result: dict) -> list:
+    config = get_document_type(doc_type) if doc_type != "DESCONOCIDO" else None
+    if not config:
+        return []
+    return typed_field_rows(doc_id, doc_type, result["extraccion"].get("campos"), config.get("campos"))
+
+
+def _replace_documento_campos(doc_ids, rows):
+    """
+    Reemplaza los campos tipados de esos documentos: un DELETE y un INSERT
+    multi-fila, dentro de la transacción de db.session (sin commit).
+    """
+    if not doc_ids:
+        return
+    tabla = DocumentoCampo.__table__
+    db.session.execute(delete(tabla).where(tabla.c.documento_id.in_(list(doc_ids))))
+    if rows:
+        db.session.execute(insert(tabla), rows)
+
+
+def _force_requested() -> bool:
+    """
+    force por query string (?force=1) o en el body JSON ({"force": true}).
+    """
+    raw = request.args.get("force")
+    if raw is None:
+        raw = (request.get_json(silent=True) or {}).get("force")
+    return str(raw).strip().lower() in ("1", "true", "yes", "si", "sí")
 
 
 # =========================
@@ -86,19 +199,99 @@ def pubsub_push():
         return f"Bad Request: error decoding message: {str(e)}", 400
 
     try:
-        new_doc = Documento(
-            nombre_archivo=data.get("archivo"),
-            url_almacenamiento=data.get("url_storage"),
-            contenido=data,  # payload OCR original (luego agregamos extracción aquí mismo)
-            tipo_documento="Pendiente",
-        )
-        db.session.add(new_doc)
-        db.session.commit()
+        item = _documento_row(data, pubsub_message.get("messageId") or pubsub_message.get("message_id"))
+        if PUBSUB_BATCH_ENABLED:
+            # 201 (= ack) solo cuando el batch que incluye este mensaje quedó confirmado
+            _pubsub_batcher.submit(item, timeout=PUBSUB_BATCH_TIMEOUT)
+        else:
+            _flush_documentos([item])
         return "OK", 201
     except Exception as e:
         return f"Error: {str(e)}", 500
 
 
+def _documento_row(data, message_id=None):
+    """
+    (fila para documentos, campos tipados sin documento_id). Con
+    INGEST_INLINE_PROCESS la fila ya va clasificada/extraída.
+    """
+    texto_ocr = _pop_ocr_text(data) if isinstance(data, dict) else ""
+    row = {
+        "nombre_archivo": data.get("archivo"),
+        "url_almacenamiento": data.get("url_storage"),
+        "contenido": data,  # payload OCR original (luego agregamos extracción aquí mismo)
+        "texto_ocr": texto_ocr or None,
+        "tipo_documento": "Pendiente",
+        "fecha_proceso": datetime.utcnow(),
+        "pubsub_message_id": message_id,
+    }
+    campos = []
+    if INGEST_INLINE_PROCESS and texto_ocr.strip():
+        try:
+            doc_type, patch = process_for_ingest(texto_ocr)
+            campos = _campos_rows(None, doc_type, patch)
+        except Exception as e:
+            # Fallback: se guarda "Pendiente" y lo toma /process-doc o reprocess
+            print(f"Proceso inline falló, queda Pendiente: {e}")
+        else:
+            data.update(patch)
+            row["tipo_documento"] = doc_type
+    return row, campos
+
+
+def _flush_documentos(items):
+    """
+    Un solo INSERT multi-fila por batch (más los campos tipados de los que
+    vinieron procesados), en una transacción. Los ids se reservan antes para
+    asociar cada fila con sus campos; un messageId ya guardado (Pub/Sub reenvía
+    si el ack no llegó) se salta con ON CONFLICT DO NOTHING.
+    """
+    tabla = Documento.__table__
+    with app.app_context(), METRICS.stage("db_insert"):
+        try:
+            ids = db.session.execute(
+                select(func.nextval(func.pg_get_serial_sequence("documentos", "id"))).select_from(
+                    func.generate_series(1, len(items))
+                )
+            ).scalars().all()
+            stmt = (
+                pg_insert(tabla)
+                .on_conflict_do_nothing(
+                    index_elements=[tabla.c.pubsub_message_id],
+                    index_where=tabla.c.pubsub_message_id.isnot(None),
+                )
+                .returning(tabla.c.id)
+            )
+            insertados = set(
+                db.session.execute(stmt, [{**row, "id": doc_id} for (row, _), doc_id in zip(items, ids)]).scalars()
+            )
+            campos = [
+                {**c, "documento_id": doc_id}
+                for (_, cs), doc_id in zip(items, ids)
+                if doc_id in insertados
+                for c in cs
+            ]
+            if campos:
+                db.session.execute(insert(DocumentoCampo.__table__), campos)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            METRICS.inc("pubsub_flush_errors_total")
+            raise
+    METRICS.inc("pubsub_flushes_total")
+    METRICS.inc("pubsub_documents_total", len(insertados))
+    METRICS.inc("pubsub_duplicados_total", len(items) - len(insertados))
+    METRICS.inc(
+        "ingest_inline_total",
+        sum(1 for (row, _), doc_id in zip(items, ids) if doc_id in insertados and row["tipo_documento"] != "Pendiente"),
+    )
+
+
+_pubsub_batcher = MicroBatcher(_flush_documentos, PUBSUB_BATCH_SIZE, PUBSUB_BATCH_WAIT_MS)
+METRICS.gauge("pubsub_batch_pending", _pubsub_batcher.pending)
+METRICS.gauge("config_reloads", lambda: REGISTRY.reloads)
+
+
 # =========================
 # Paso 5 - Endpoint de prueba (sin DB)
 # =========================
@@ -110,29 +303,253 @@ def process_text():
     if not isinstance(ocr_text, str) or not ocr_text.strip():
         return jsonify({"error": "ocr_text es requerido"}), 400
 
-    doc_type, confidence, method, details = classify_document(ocr_text)
+    try:
+        response = process_ocr_text_cached(ocr_text)
+    except MissingConfigError as e:
+        return jsonify({"error": str(e)}), 500
 
-    response = {
-        "clasificacion": {
-            "tipo_documento": doc_type,
-            "confianza": confidence,
-            "metodo": method,
-            "detalles": details,
-        },
-        "extraccion": {"campos": {}, "campos_faltantes": [], "errores": []},
+    return jsonify(response), 200
+
+
+# =========================
+# Registro de tipos: versión activa por tipo y recarga en caliente
+# =========================
+def _registry_status(recargado=None):
+    snapshot = get_registry_snapshot()
+    status = {
+        "hash_config": snapshot.fingerprint,
+        "tipos": snapshot.type_versions(),
+        "recargas": REGISTRY.reloads,
+        "intervalo_recarga": REGISTRY.reload_interval,
+        "desde_bundle": REGISTRY.from_bundle,
+        "error": REGISTRY.last_error,
     }
+    if recargado is not None:
+        status["recargado"] = recargado
+    return status
 
-    if doc_type != "DESCONOCIDO":
-        config = get_document_type(doc_type)
-        if not config:
-            return jsonify({"error": f"No existe config para tipo {doc_type}"}), 500
 
-        campos, faltantes, errores = extract_fields(ocr_text, config)
-        response["extraccion"]["campos"] = campos
-        response["extraccion"]["campos_faltantes"] = faltantes
-        response["extraccion"]["errores"] = errores
+@app.route("/config/versions", methods=["GET"])
+def config_versions():
+    return jsonify(_registry_status()), 200
+
+
+@app.route("/config/reload", methods=["POST"])
+def config_reload():
+    # Revisa ya el directorio (sin esperar el intervalo); en error se mantiene la versión anterior
+    recargado = REGISTRY.check()
+    return jsonify(_registry_status(recargado)), 200 if REGISTRY.last_error is None else 500
+
+
+# =========================
+# Proceso inline para servicio-ocr (sin DB): lo que hay que guardar junto al INSERT
+# =========================
+@app.route("/process-text/ingest", methods=["POST"])
+def process_text_ingest():
+    data = request.get_json(silent=True) or {}
+    ocr_text = data.get("ocr_text", "")
+
+    if not isinstance(ocr_text, str) or not ocr_text.strip():
+        return jsonify({"error": "ocr_text es requerido"}), 400
+
+    try:
+        doc_type, patch = process_for_ingest(ocr_text)
+    except MissingConfigError as e:
+        return jsonify({"error": str(e)}), 500
+
+    campos = _campos_rows(None, doc_type, patch)
+    for c in campos:
+        del c["documento_id"]
+    return jsonify({"tipo_documento": doc_type, "contenido": patch, "campos": campos}), 200
+
+
+# =========================
+# Batch de textos (sin DB) - respuesta NDJSON en streaming
+# =========================
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "10000"))
+
+
+class BatchTooLargeError(ValueError):
+    """El batch JSON trae más de BATCH_MAX_ITEMS items."""
+
+
+def _iter_batch_items(state: dict):
+    """
+    Entrega (index, id, ocr_text) desde:
+    - JSON: lista de strings u objetos {"id"?, "ocr_text"}
+    - NDJSON (application/x-ndjson): una línea por item, leída en streaming
+
+    Una lista JSON con más de BATCH_MAX_ITEMS items levanta BatchTooLargeError
+    (413). En NDJSON el largo no se conoce hasta leerlo: se corta en el límite
+    y se marca state["truncado"] para avisarlo al final de la respuesta.
+    """
+    if request.mimetype in ("application/x-ndjson", "application/jsonl"):
+        def _lines():
+            for raw in request.stream:
+                line = raw.strip()
+                if line:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        yield None
+        items = _lines()
+    else:
+        items = request.get_json(silent=True)
+        if isinstance(items, dict):
+            items = items.get("items")
+        if not isinstance(items, list):
+            raise ValueError("Se espera una lista JSON de textos (o NDJSON)")
+        if len(items) > BATCH_MAX_ITEMS:
+            raise BatchTooLargeError(f"Máximo {BATCH_MAX_ITEMS} items por batch (llegaron {len(items)})")
+
+    for index, item in enumerate(items):
+        if index >= BATCH_MAX_ITEMS:
+            state["truncado"] = True
+            break
+        if isinstance(item, dict):
+            yield index, item.get("id"), item.get("ocr_text")
+        else:
+            yield index, None, item
+
+
+@app.route("/process-text/batch", methods=["POST"])
+def process_text_batch():
+    state = {"truncado": False}
+    try:
+        items = _iter_batch_items(state)
+        first = next(items, None)
+    except BatchTooLargeError as e:
+        return jsonify({"error": str(e)}), 413
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if first is None:
+        return jsonify({"error": "El batch viene vacío"}), 400
+
+    def _generate():
+        def _all_items():
+            yield first
+            yield from items
+
+        keyed = (((index, item_id), ocr_text) for index, item_id, ocr_text in _all_items())
+        for (index, item_id), result in process_many(keyed):
+            METRICS.inc("batch_items_total", error="error" in result)
+            yield json.dumps({"index": index, "id": item_id, **result}, ensure_ascii=False) + "\n"
+        if state["truncado"]:
+            # El status 200 ya salió: el corte se avisa como última línea
+            yield json.dumps(
+                {"index": None, "id": None, "error": f"Batch cortado en {BATCH_MAX_ITEMS} items: el resto no se procesó",
+                 "truncado": True},
+                ensure_ascii=False,
+            ) + "\n"
+
+    return Response(stream_with_context(_generate()), mimetype="application/x-ndjson")
+
+
+# =========================
+# Búsqueda full-text sobre el texto OCR (columna busqueda + índice GIN)
+#   GET /search?q=juan perez 12.345.678-5&tipo=LIQUIDACION&limit=20&cursor=...
+# =========================
+SEARCH_MAX_LIMIT = int(os.getenv("SEARCH_MAX_LIMIT", "100"))
+# Coincidencias (las más recientes) que se rankean por consulta: ts_rank no tiene
+# índice, así que cada página lo calcula sobre todas las candidatas
+SEARCH_MAX_MATCHES = int(os.getenv("SEARCH_MAX_MATCHES", "5000"))
+
+
+def _encode_cursor(rank: float, doc_id: int) -> str:
+    raw = json.dumps([rank, doc_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def _decode_cursor(cursor: str):
+    try:
+        rank, doc_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return float(rank), int(doc_id)
+    except (ValueError, TypeError):
+        return None
 
-    return jsonify(response), 200
+
+@app.route("/search", methods=["GET"])
+def search():
+    """
+    Documentos cuyo texto OCR calza con `q` (sintaxis websearch: "frase exacta",
+    OR, -excluir), ordenados por ranking y luego id. Paginación por keyset:
+    `siguiente` se pasa como `cursor` para la página siguiente. `fragmentos=1`
+    agrega un extracto con las coincidencias (solo para las filas de la página).
+
+    El índice GIN resuelve qué documentos calzan, pero el orden por ts_rank no
+    lo sirve ningún índice: cada página calcula el ranking de todas las
+    candidatas (el keyset solo evita el OFFSET). Por eso se rankean solo las
+    SEARCH_MAX_MATCHES coincidencias más recientes (id) y `truncado` = true
+    avisa que hubo más; para llegar a las antiguas hay que acotar la consulta
+    (más términos o `tipo`).
+    """
+    q = (request.args.get("q") or "").strip()
+    if not q:
+        return jsonify({"error": "q es requerido"}), 400
+    try:
+        limit = min(max(int(request.args.get("limit", 20)), 1), SEARCH_MAX_LIMIT)
+    except ValueError:
+        return jsonify({"error": "limit debe ser un entero"}), 400
+    after = None
+    if request.args.get("cursor"):
+        after = _decode_cursor(request.args["cursor"])
+        if after is None:
+            return jsonify({"error": "cursor inválido"}), 400
+
+    # Misma normalización que el clasificador (unidecode) para la consulta
+    query = func.websearch_to_tsquery(literal(BUSQUEDA_CONFIG).cast(REGCONFIG), unidecode(q))
+    # Candidatas: una más que el tope para saber si se cortó
+    candidates = select(
+        Documento.id, func.row_number().over(order_by=Documento.id.desc()).label("n")
+    ).where(Documento.busqueda.op("@@")(query))
+    if request.args.get("tipo"):
+        candidates = candidates.where(Documento.tipo_documento == request.args["tipo"])
+    candidates = candidates.order_by(Documento.id.desc()).limit(SEARCH_MAX_MATCHES + 1).cte("candidatas")
+    truncated = (
+        select(candidates.c.id).where(candidates.c.n > SEARCH_MAX_MATCHES).exists().label("truncado")
+    )
+
+    rank = cast(func.ts_rank(Documento.busqueda, query), db.Float).label("rank")
+    stmt = (
+        select(
+            Documento.id, Documento.nombre_archivo, Documento.tipo_documento, Documento.fecha_proceso, rank, truncated
+        )
+        .join(candidates, candidates.c.id == Documento.id)
+        .where(candidates.c.n <= SEARCH_MAX_MATCHES)
+    )
+    if after is not None:
+        stmt = stmt.where(tuple_(rank, Documento.id) < tuple_(*after))
+    # Una fila extra para saber si hay página siguiente
+    rows = db.session.execute(stmt.order_by(rank.desc(), Documento.id.desc()).limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    fragments = {}
+    if rows and request.args.get("fragmentos") in ("1", "true"):
+        texto = func.coalesce(Documento.texto_ocr, Documento.contenido["contenido"].astext)
+        headline = func.ts_headline(
+            literal(BUSQUEDA_CONFIG).cast(REGCONFIG), texto, query, "MaxFragments=2, MinWords=5, MaxWords=20"
+        )
+        fragments = dict(
+            db.session.execute(select(Documento.id, headline).where(Documento.id.in_([r.id for r in rows]))).all()
+        )
+    db.session.rollback()
+
+    resultados = [
+        {
+            "id": r.id,
+            "nombre_archivo": r.nombre_archivo,
+            "tipo_documento": r.tipo_documento,
+            "fecha_proceso": r.fecha_proceso.isoformat() if r.fecha_proceso else None,
+            "rank": r.rank,
+            **({"fragmento": fragments.get(r.id)} if fragments else {}),
+        }
+        for r in rows
+    ]
+    siguiente = _encode_cursor(rows[-1].rank, rows[-1].id) if has_more else None
+    truncado = bool(rows) and rows[0].truncado
+    return jsonify({"resultados": resultados, "siguiente": siguiente, "truncado": truncado}), 200
 
 
 # =========================
@@ -140,12 +557,13 @@ def process_text():
 # =========================
 @app.route("/process-doc/<int:doc_id>", methods=["POST"])
 def process_doc(doc_id: int):
-    doc = Documento.query.get(doc_id)
+    with METRICS.stage("db_read"):
+        doc = Documento.query.get(doc_id)
     if not doc:
         return jsonify({"error": "Documento no encontrado"}), 404
 
     contenido = doc.contenido or {}
-    ocr_text = _get_ocr_text_from_contenido(contenido)
+    ocr_text, ruta_texto = _document_text(doc.texto_ocr, contenido)
 
     if not ocr_text.strip():
         return jsonify(
@@ -155,56 +573,35 @@ def process_doc(doc_id: int):
             }
         ), 400
 
-    # Clasificación
-    doc_type, confidence, method, details = classify_document(ocr_text)
-    doc.tipo_documento = doc_type  # actualiza la columna simple
-
-    # Guardamos dentro del JSONB también (sin romper tu data original)
-    contenido.setdefault("clasificacion", {})
-    contenido["clasificacion"] = {
-        "tipo_documento": doc_type,
-        "confianza": confidence,
-        "metodo": method,
-        "detalles": details,
-        "fecha": datetime.utcnow().isoformat() + "Z",
-    }
-
-    # Extracción (solo si tipo conocido)
-    extraccion = {"campos": {}, "campos_faltantes": [], "errores": []}
-    if doc_type != "DESCONOCIDO":
-        config = get_document_type(doc_type)
-        if not config:
-            return jsonify({"error": f"No existe config para tipo {doc_type}"}), 500
-
-        campos, faltantes, errores = extract_fields(ocr_text, config)
-        extraccion = {
-            "version_diccionario": config.get("version", "1.0"),
-            "campos": campos,
-            "campos_faltantes": faltantes,
-            "errores": errores,
-            "fecha": datetime.utcnow().isoformat() + "Z",
-        }
-
-    contenido["extraccion"] = extraccion
+    # Mismo texto + misma config => nada que hacer (salvo ?force=1)
+    if not _force_requested() and is_up_to_date(contenido, ocr_text):
+        METRICS.inc("process_doc_sin_cambios_total")
+        return jsonify(
+            {
+                "id": doc.id,
+                "tipo_documento": doc.tipo_documento,
+                "clasificacion": contenido.get("clasificacion"),
+                "extraccion": contenido.get("extraccion"),
+                "sin_cambios": True,
+            }
+        ), 200
 
-    # Estado pipeline mínimo (sin cambiar tu diseño actual más de la cuenta)
-    contenido.setdefault("estado_pipeline", {})
-    contenido["estado_pipeline"]["etapa_actual"] = "EXTRAIDO" if doc_type != "DESCONOCIDO" else "CLASIFICADO"
-    contenido["estado_pipeline"].setdefault("historial", [])
-    contenido["estado_pipeline"]["historial"].append(
-        {
-            "etapa": contenido["estado_pipeline"]["etapa_actual"],
-            "fecha": datetime.utcnow().isoformat() + "Z",
-            "detalle": "Procesado por servicio-sql (clasificación + extracción)",
-        }
-    )
+    # Clasificación + extracción (solo si tipo conocido)
+    try:
+        result = process_for_storage(ocr_text)
+    except MissingConfigError as e:
+        return jsonify({"error": str(e)}), 500
 
-    # Persistir
-    doc.contenido = contenido
-    doc.fecha_proceso = datetime.utcnow()
+    # Guardamos dentro del JSONB también (sin romper tu data original)
+    doc_type, contenido = apply_result_to_contenido(contenido, result)
+    row = _result_row(doc.id, doc_type, contenido, ruta_texto, ocr_text)
+    db.session.expunge(doc)  # el UPDATE va directo; que el ORM no reescriba la fila
 
     try:
-        db.session.commit()
+        with METRICS.stage("db_write"):
+            _bulk_update_documentos([row])
+            _replace_documento_campos([doc.id], _campos_rows(doc.id, doc_type, result))
+            db.session.commit()
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": f"Error guardando resultado: {str(e)}"}), 500
@@ -212,12 +609,297 @@ def process_doc(doc_id: int):
     return jsonify(
         {
             "id": doc.id,
-            "tipo_documento": doc.tipo_documento,
+            "tipo_documento": doc_type,
             "clasificacion": contenido.get("clasificacion"),
             "extraccion": contenido.get("extraccion"),
         }
     ), 200
 
 
+# =========================
+# Reproceso masivo (CLI)
+#   flask --app main reprocess --pendientes --checkpoint /tmp/reprocess.json
+# =========================
+def _reprocess_filters(pendientes: bool, desde_id, hasta_id, version_antigua: bool):
+    filters = []
+    if pendientes:
+        filters.append(Documento.tipo_documento == "Pendiente")
+    if desde_id is not None:
+        filters.append(Documento.id >= desde_id)
+    if hasta_id is not None:
+        filters.append(Documento.id <= hasta_id)
+    if version_antigua:
+        # "Antigua" = distinta a la versión actual del JSON de su tipo (o sin versión)
+        version_guardada = Documento.contenido["extraccion"]["version_diccionario"].astext
+        por_tipo = [
+            and_(
+                Documento.tipo_documento == type_id,
+                version_guardada.is_distinct_from(str(cfg.get("version", "1.0"))),
+            )
+            for type_id, cfg in get_all_document_types().items()
+        ]
+        filters.append(or_(*por_tipo) if por_tipo else false())
+    return filters
+
+
+def _load_checkpoint(path, filtros):
+    if not path or not os.path.exists(path):
+        return {"last_id": 0, "procesados": 0, "sin_cambios": 0, "errores": 0, "filtros": filtros}
+    with open(path, "r", encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("filtros") != filtros:
+        raise click.UsageError(
+            f"El checkpoint {path} es de otros filtros ({checkpoint.get('filtros')}); usa --reset o cambia de archivo"
+        )
+    checkpoint.setdefault("sin_cambios", 0)
+    return checkpoint
+
+
+def _save_checkpoint(path, checkpoint):
+    if not path:
+        return
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, ensure_ascii=False)
+    os.replace(tmp_path, path)  # atómico: nunca queda un checkpoint a medias
+
+
+def _result_row(doc_id, doc_type, contenido, ruta_texto, ocr_text):
+    """
+    Fila para _bulk_update_documentos: solo las llaves del pipeline y, si el
+    texto OCR seguía dentro de contenido, su ruta para moverlo a texto_ocr.
+    """
+    return {
+        "id": doc_id,
+        "tipo_documento": doc_type,
+        "patch": {k: contenido[k] for k in RESULT_KEYS if k in contenido},
+        "ruta_texto": ruta_texto,
+        "texto_ocr": ocr_text if ruta_texto else None,
+    }
+
+
+def _bulk_update_documentos(rows):
+    """
+    Un solo UPDATE ... FROM (VALUES ...) por chunk, en vez de un UPDATE por fila.
+
+    No se reescribe el payload OCR: contenido = (contenido #- ruta_texto) || patch,
+    donde patch trae solo clasificacion/extraccion/estado_pipeline. El texto
+    OCR se mueve una sola vez a texto_ocr (que después no se vuelve a tocar).
+    """
+    if not rows:
+        return
+    v = values(
+        column("id", Integer),
+        column("tipo_documento", String),
+        column("patch", String),
+        column("ruta_texto", String),
+        column("texto_ocr", Text),
+        name="v",
+    ).data(
+        [
+            (r["id"], r["tipo_documento"], json.dumps(r["patch"], ensure_ascii=False), r["ruta_texto"], r["texto_ocr"])
+            for r in rows
+        ]
+    )
+
+    tabla = Documento.__table__
+    sin_texto = func.coalesce(tabla.c.contenido, cast("{}", JSONB)).op("#-", return_type=JSONB)(
+        func.string_to_array(v.c.ruta_texto, ".")
+    )
+    db.session.execute(
+        update(tabla)
+        .where(tabla.c.id == v.c.id)
+        .values(
+            tipo_documento=v.c.tipo_documento,
+            contenido=sin_texto.op("||", return_type=JSONB)(cast(v.c.patch, JSONB)),
+            texto_ocr=func.coalesce(tabla.c.texto_ocr, cast(v.c.texto_ocr, Text)),
+            fecha_proceso=datetime.utcnow(),
+        )
+    )
+
+
+@app.cli.command("reprocess")
+@click.option("--pendientes", is_flag=True, help="Solo tipo_documento = 'Pendiente'")
+@click.option("--desde-id", type=int, default=None, help="id mínimo (inclusive)")
+@click.option("--hasta-id", type=int, default=None, help="id máximo (inclusive)")
+@click.option("--version-antigua", is_flag=True, help="Solo version_diccionario distinta a la config actual")
+@click.option("--chunk", type=int, default=500, show_default=True, help="Filas por lectura/UPDATE")
+@click.option("--checkpoint", type=click.Path(dir_okay=False), default=None, help="Archivo JSON para retomar")
+@click.option("--reset", is_flag=True, help="Ignora el checkpoint existente y parte de cero")
+@click.option("--force", is_flag=True, help="Reprocesa aunque texto y config no hayan cambiado")
+def reprocess_command(pendientes, desde_id, hasta_id, version_antigua, chunk, checkpoint, reset, force):
+    """
+    Reclasifica y re-extrae documentos guardados en lote.
+
+    Lee con cursor del lado del servidor en chunks ordenados por id, procesa en
+    paralelo con el pool de pipeline y escribe cada chunk con un UPDATE en lote.
+    Tras cada chunk guarda el último id confirmado en --checkpoint.
+    Sin --force se saltan los documentos cuyo texto y config no cambiaron.
+    """
+    filtros = {
+        "pendientes": pendientes,
+        "desde_id": desde_id,
+        "hasta_id": hasta_id,
+        "version_antigua": version_antigua,
+    }
+    if reset and checkpoint and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    state = _load_checkpoint(checkpoint, filtros)
+
+    filters = _reprocess_filters(pendientes, desde_id, hasta_id, version_antigua)
+    filters.append(Documento.id > state["last_id"])
+
+    total = db.session.execute(select(func.count(Documento.id)).where(*filters)).scalar()
+    click.echo(f"Documentos por procesar: {total} (retomando desde id > {state['last_id']})")
+
+    query = (
+        select(Documento.id, Documento.contenido, Documento.texto_ocr)
+        .where(*filters)
+        .order_by(Documento.id)
+        .execution_options(stream_results=True, yield_per=chunk)
+    )
+
+    started = time.monotonic()
+    done = 0
+    # Conexión aparte para leer: los commit de cada chunk (en db.session) no cierran el cursor
+    with db.engine.connect() as read_conn:
+        for partition in read_conn.execute(query).partitions(chunk):
+            contenidos = {}
+            textos = {}
+            items = []
+            for doc_id, contenido, texto_ocr in partition:
+                contenido = contenido or {}
+                ocr_text, ruta_texto = _document_text(texto_ocr, contenido)
+                if not force and ocr_text.strip() and is_up_to_date(contenido, ocr_text):
+                    state["sin_cambios"] += 1
+                    continue
+                contenidos[doc_id] = contenido
+                textos[doc_id] = (ruta_texto, ocr_text)
+                items.append((doc_id, ocr_text))
+
+            rows = []
+            campos_rows = []
+            for doc_id, result in process_many(items, fn=process_for_storage):
+                if "error" in result:
+                    state["errores"] += 1
+                    click.echo(f"  id={doc_id}: {result['error']}", err=True)
+                    continue
+                doc_type, contenido = apply_result_to_contenido(contenidos.pop(doc_id), result)
+                rows.append(_result_row(doc_id, doc_type, contenido, *textos.pop(doc_id)))
+                campos_rows.extend(_campos_rows(doc_id, doc_type, result))
+
+            try:
+                _bulk_update_documentos(rows)
+                _replace_documento_campos([r["id"] for r in rows], campos_rows)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+            done += len(partition)
+            state["last_id"] = partition[-1][0]
+            state["procesados"] += len(rows)
+            _save_checkpoint(checkpoint, state)
+
+            elapsed = max(time.monotonic() - started, 1e-9)
+            click.echo(
+                f"[{done}/{total}] último id={state['last_id']} ok={state['procesados']} "
+                f"sin_cambios={state['sin_cambios']} errores={state['errores']} ({done / elapsed:.1f} docs/s)"
+            )
+
+    click.echo(
+        f"Listo: {state['procesados']} actualizados, {state['sin_cambios']} sin cambios, "
+        f"{state['errores']} con error"
+    )
+
+
+# =========================
+# Esquema: índices y vistas para consultar campos extraídos
+#   flask --app main migrate-schema [--dry-run]
+# =========================
+# Clave del advisory lock de migrate-schema: instancias arrancando a la vez migran de a una
+MIGRATE_LOCK_KEY = 726417001
+
+
+@app.cli.command("migrate-schema")
+@click.option("--dry-run", is_flag=True, help="Solo imprime el SQL")
+@click.option("--no-concurrently", is_flag=True, help="CREATE INDEX sin CONCURRENTLY (bloquea escrituras)")
+@click.option("--backfill-campos", is_flag=True, help="Llena documento_campos desde el JSONB ya guardado")
+@click.option("--backfill-busqueda", is_flag=True, help="Calcula la columna busqueda de los documentos sin ella")
+@click.option("--chunk", type=int, default=1000, show_default=True, help="Filas por UPDATE en --backfill-busqueda")
+@click.option("--lock-timeout", default="10s", show_default=True,
+              help="lock_timeout de Postgres: si la tabla está tomada se falla en vez de encolar el tráfico detrás")
+def migrate_schema_command(dry_run, no_concurrently, backfill_campos, backfill_busqueda, chunk, lock_timeout):
+    """
+    Crea (si no existen) los índices de tipo_documento/fecha_proceso y de cada
+    campo declarado en los JSON de tipos, las vistas v_<tipo> y la tabla
+    documento_campos. Idempotente: se puede correr en cada deploy o cuando se
+    agrega un tipo/campo. También instala la búsqueda full-text (columna
+    busqueda, trigger e índice GIN).
+
+    El contenedor lo corre antes de levantar gunicorn (start.sh), así el código
+    nuevo nunca atiende tráfico sin las tablas/columnas que usa. Si otra
+    instancia ya está migrando (advisory lock tomado) esta se salta la
+    migración y arranca igual.
+    """
+    doc_types = get_all_document_types()
+    stmts = schema_statements(doc_types, concurrently=not no_concurrently)
+    if backfill_campos:
+        stmts.extend(backfill_statements(doc_types))
+    if dry_run:
+        for stmt in stmts:
+            click.echo(stmt + ";")
+        if backfill_busqueda:
+            click.echo(f"-- repetir hasta 0 filas:\n{search_backfill_statement(chunk)};")
+        return
+
+    # CREATE INDEX CONCURRENTLY no puede ir dentro de una transacción
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        # Sin esperar: una sesión bloqueada en pg_advisory_lock retiene un snapshot y el
+        # CREATE INDEX CONCURRENTLY de la que migra la esperaría (se bloquean entre sí)
+        if not conn.exec_driver_sql("SELECT pg_try_advisory_lock(%s)", (MIGRATE_LOCK_KEY,)).scalar():
+            click.echo("Otra instancia está aplicando el esquema: se salta")
+            return
+        try:
+            # Solo para el DDL: si una tabla/vista está tomada falla en vez de encolar el tráfico detrás
+            conn.exec_driver_sql("SELECT set_config('lock_timeout', %s, false)", (lock_timeout,))
+            for stmt in stmts:
+                index = index_name(stmt)
+                if index and _drop_invalid_index(conn, index):
+                    click.echo(f"Índice inválido (CREATE INDEX CONCURRENTLY interrumpido): {index} se recrea")
+                click.echo(stmt)
+                conn.exec_driver_sql(stmt)
+            click.echo(f"Listo: {len(stmts)} sentencias aplicadas")
+
+            if backfill_busqueda:
+                # Un commit por lote: no deja una transacción larga ni bloquea toda la tabla
+                total = 0
+                while True:
+                    n = conn.exec_driver_sql(search_backfill_statement(chunk)).rowcount
+                    if not n:
+                        break
+                    total += n
+                    click.echo(f"  busqueda: {total} documentos")
+                click.echo(f"Backfill de busqueda listo: {total} documentos")
+        finally:
+            conn.exec_driver_sql("SELECT set_config('lock_timeout', '0', false)")
+            conn.exec_driver_sql("SELECT pg_advisory_unlock(%s)", (MIGRATE_LOCK_KEY,))
+
+
+def _drop_invalid_index(conn, index):
+    """
+    Un CREATE INDEX CONCURRENTLY cancelado deja el índice INVALID y el IF NOT
+    EXISTS lo saltaría para siempre: se borra para volver a crearlo.
+    """
+    invalid = conn.exec_driver_sql(
+        "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = %s AND c.relnamespace = current_schema()::regnamespace AND NOT i.indisvalid",
+        (index,),
+    ).scalar()
+    if invalid:
+        conn.exec_driver_sql(f'DROP INDEX CONCURRENTLY IF EXISTS "{index}"')
+    return bool(invalid)
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 8080)))
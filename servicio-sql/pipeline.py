@@ -0,0 +1,245 @@
+import hashlib
+import multiprocessing
+import os
+import threading
+from datetime import datetime
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from classifier import classify_document
+from extractor import extract_fields
+from config_loader import RegistrySnapshot, get_config_fingerprint, get_registry_snapshot
+from metrics import METRICS
+from result_cache import RESULT_CACHE
+
+
+class MissingConfigError(RuntimeError):
+    """El clasificador devolvió un tipo que no tiene config cargada."""
+
+
+def process_ocr_text(ocr_text: str, snapshot: Optional[RegistrySnapshot] = None) -> Dict[str, Any]:
+    """
+    Clasificación + extracción sobre un texto OCR (sin DB).
+    Devuelve el mismo payload que /process-text: {"clasificacion", "extraccion"}.
+
+    Todo el proceso usa un solo snapshot del registro de tipos, aunque haya
+    una recarga en medio.
+    """
+    snapshot = snapshot or get_registry_snapshot()
+    with METRICS.stage("classify"):
+        doc_type, confidence, method, details = classify_document(ocr_text, snapshot.classifier)
+
+    response = {
+        "clasificacion": {
+            "tipo_documento": doc_type,
+            "confianza": confidence,
+            "metodo": method,
+            "detalles": details,
+        },
+        "extraccion": {"campos": {}, "campos_faltantes": [], "errores": []},
+    }
+
+    if doc_type != "DESCONOCIDO":
+        config = snapshot.types.get(doc_type)
+        if not config:
+            raise MissingConfigError(f"No existe config para tipo {doc_type}")
+
+        with METRICS.stage("extract"):
+            campos, faltantes, errores = extract_fields(ocr_text, config)
+        response["extraccion"]["campos"] = campos
+        response["extraccion"]["campos_faltantes"] = faltantes
+        response["extraccion"]["errores"] = errores
+
+    return response
+
+
+def text_fingerprint(ocr_text: str) -> str:
+    return hashlib.sha256((ocr_text or "").encode("utf-8")).hexdigest()
+
+
+def process_ocr_text_cached(ocr_text: str) -> Dict[str, Any]:
+    """
+    process_ocr_text con la caché de resultados (result_cache). La llave es el
+    hash del texto tal cual (el mismo hash_texto que se guarda en contenido)
+    más el fingerprint de la config.
+    """
+    snapshot = get_registry_snapshot()
+    if RESULT_CACHE is None:
+        return process_ocr_text(ocr_text, snapshot)
+    text_hash = text_fingerprint(ocr_text)
+    result = RESULT_CACHE.get(snapshot.fingerprint, text_hash)
+    if result is None:
+        result = process_ocr_text(ocr_text, snapshot)
+        RESULT_CACHE.set(snapshot.fingerprint, text_hash, result)
+    return result
+
+
+def is_up_to_date(contenido: Dict[str, Any], ocr_text: str) -> bool:
+    """
+    True si el documento ya se procesó con este mismo texto OCR y esta misma
+    config (hash_texto / hash_config guardados en contenido["extraccion"]).
+    """
+    extraccion = (contenido or {}).get("extraccion")
+    if not isinstance(extraccion, dict):
+        return False
+    return (
+        extraccion.get("hash_config") == get_config_fingerprint()
+        and extraccion.get("hash_texto") == text_fingerprint(ocr_text)
+    )
+
+
+def process_for_storage(ocr_text: str) -> Dict[str, Any]:
+    """
+    Igual que process_ocr_text, pero con el formato que se persiste en
+    Documento.contenido (fechas, version_diccionario del tipo y hashes para
+    saltarse reprocesos sin cambios).
+    """
+    snapshot = get_registry_snapshot()
+    result = process_ocr_text(ocr_text, snapshot)
+    now = datetime.utcnow().isoformat() + "Z"
+    result["clasificacion"]["fecha"] = now
+
+    doc_type = result["clasificacion"]["tipo_documento"]
+    if doc_type != "DESCONOCIDO":
+        config = snapshot.types[doc_type]
+        result["extraccion"] = {
+            "version_diccionario": config.get("version", "1.0"),
+            **result["extraccion"],
+            "fecha": now,
+        }
+
+    result["extraccion"]["hash_texto"] = text_fingerprint(ocr_text)
+    result["extraccion"]["hash_config"] = snapshot.fingerprint
+    return result
+
+
+# Máximo de entradas en estado_pipeline.historial (las más antiguas se descartan); 0 = sin límite
+PIPELINE_HISTORIAL_MAX = int(os.getenv("PIPELINE_HISTORIAL_MAX", "20"))
+
+# Llaves de contenido que escribe el pipeline (el resto es el payload OCR original)
+RESULT_KEYS = ("clasificacion", "extraccion", "estado_pipeline")
+
+
+def apply_result_to_contenido(contenido: Dict[str, Any], result: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    """
+    Mezcla el resultado de process_for_storage en el JSONB del documento
+    (sin tocar el payload OCR original). Devuelve (tipo_documento, contenido).
+    """
+    doc_type = result["clasificacion"]["tipo_documento"]
+    contenido["clasificacion"] = result["clasificacion"]
+    contenido["extraccion"] = result["extraccion"]
+
+    # Estado pipeline mínimo (sin cambiar tu diseño actual más de la cuenta)
+    contenido.setdefault("estado_pipeline", {})
+    contenido["estado_pipeline"]["etapa_actual"] = "EXTRAIDO" if doc_type != "DESCONOCIDO" else "CLASIFICADO"
+    contenido["estado_pipeline"].setdefault("historial", [])
+    contenido["estado_pipeline"]["historial"].append(
+        {
+            "etapa": contenido["estado_pipeline"]["etapa_actual"],
+            "fecha": datetime.utcnow().isoformat() + "Z",
+            "detalle": "Procesado por servicio-sql (clasificación + extracción)",
+        }
+    )
+    if PIPELINE_HISTORIAL_MAX > 0:
+        del contenido["estado_pipeline"]["historial"][:-PIPELINE_HISTORIAL_MAX]
+    return doc_type, contenido
+
+
+def process_for_ingest(ocr_text: str) -> Tuple[str, Dict[str, Any]]:
+    """
+    Clasificación + extracción antes del primer INSERT. Devuelve (tipo_documento,
+    llaves del pipeline para mezclar en contenido), con el mismo formato que deja
+    process_doc.
+    """
+    return apply_result_to_contenido({}, process_for_storage(ocr_text))
+
+
+# =========================
+# Pool de workers (procesos: clasificar/extraer es CPU puro y el GIL no ayuda)
+# =========================
+PROCESS_TEXT_WORKERS = int(os.getenv("PROCESS_TEXT_WORKERS", str(os.cpu_count() or 1)))
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> Optional[ProcessPoolExecutor]:
+    """
+    Pool perezoso: se crea en el primer batch (ya dentro del worker de gunicorn,
+    no en el master). Con PROCESS_TEXT_WORKERS <= 1 se procesa en línea.
+    """
+    global _executor
+    if PROCESS_TEXT_WORKERS <= 1:
+        return None
+    if _executor is None:
+        # Con --threads varios primeros batches llegan a la vez: un solo pool por proceso
+        with _executor_lock:
+            if _executor is None:
+                # spawn, igual que servicio-ocr: un fork desde un proceso con threads (gunicorn
+                # --threads, MicroBatcher) puede heredar tomado un lock (METRICS, REGISTRY)
+                _executor = ProcessPoolExecutor(
+                    max_workers=PROCESS_TEXT_WORKERS, mp_context=multiprocessing.get_context("spawn")
+                )
+    return _executor
+
+
+def _safe_process(fn: Callable[[str], Dict[str, Any]], ocr_text: Optional[str]) -> Dict[str, Any]:
+    if not isinstance(ocr_text, str) or not ocr_text.strip():
+        return {"error": "ocr_text es requerido"}
+    try:
+        return fn(ocr_text)
+    except Exception as e:
+        return {"error": str(e)}
+
+
+def _pooled_process(fn: Callable[[str], Dict[str, Any]], ocr_text: Optional[str]):
+    # Corre en el proceso del pool: devuelve también sus métricas (classify, extract, ...)
+    with METRICS.capture() as observed:
+        result = _safe_process(fn, ocr_text)
+    return result, observed
+
+
+def _future_result(fut) -> Dict[str, Any]:
+    try:
+        result, observed = fut.result()
+    except Exception as e:  # p.ej. BrokenProcessPool si un worker muere
+        return {"error": str(e)}
+    METRICS.replay(observed)
+    return result
+
+
+def process_many(
+    items: Iterable[Tuple[Any, Optional[str]]],
+    max_in_flight: Optional[int] = None,
+    fn: Callable[[str], Dict[str, Any]] = process_ocr_text,
+) -> Iterator[Tuple[Any, Dict[str, Any]]]:
+    """
+    Procesa (clave, ocr_text) con `fn` (función de módulo, debe ser picklable) en el pool y va entregando (clave, resultado)
+    a medida que terminan (no en orden de entrada).
+
+    Las métricas de cada texto (etapas classify/extract, contadores) se juntan
+    en el proceso del pool y se registran aquí, así llegan al /metrics de este
+    worker igual que en el camino en línea.
+
+    Se mantienen a lo más `max_in_flight` textos encolados, así un stream
+    largo de entrada no se carga entero en memoria.
+    """
+    executor = get_executor()
+    if executor is None:
+        for key, ocr_text in items:
+            yield key, _safe_process(fn, ocr_text)
+        return
+
+    limit = max_in_flight or PROCESS_TEXT_WORKERS * 4
+    pending = {}
+    for key, ocr_text in items:
+        pending[executor.submit(_pooled_process, fn, ocr_text)] = key
+        if len(pending) >= limit:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                yield pending.pop(fut), _future_result(fut)
+
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            yield pending.pop(fut), _future_result(fut)
@@ -0,0 +1,139 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from metrics import METRICS
+
+
+# Caché de resultados de /process-text (reintentos de la UI, tests de
+# integración y documentos duplicados mandan el mismo texto una y otra vez).
+# Tamaño 0 = apagada. TTL en segundos.
+PROCESS_TEXT_CACHE_SIZE = int(os.getenv("PROCESS_TEXT_CACHE_SIZE", "2048"))
+PROCESS_TEXT_CACHE_TTL = float(os.getenv("PROCESS_TEXT_CACHE_TTL", "600"))
+# Backend compartido entre instancias/workers (redis://...); sin URL solo la caché local
+PROCESS_TEXT_CACHE_URL = os.getenv("PROCESS_TEXT_CACHE_URL")
+
+
+class LocalBackend:
+    """
+    LRU con TTL en memoria del proceso. También hace de reemplazo local del
+    backend compartido (misma interfaz get/set) para desarrollo y pruebas.
+    """
+
+    def __init__(self, max_items: int, ttl: float):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str):
+        if self.max_items <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RedisBackend:
+    """
+    Backend compartido. Cualquier error (caído, timeout) cuenta como miss: la
+    caché nunca hace fallar un request.
+    """
+
+    def __init__(self, url: str, ttl: float):
+        import redis  # opcional: solo si se configura PROCESS_TEXT_CACHE_URL
+
+        self.ttl = ttl
+        self._client = redis.Redis.from_url(url, socket_timeout=0.2, socket_connect_timeout=0.2)
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            value = self._client.get(key)
+        except Exception:
+            METRICS.inc("process_text_cache_errores_total")
+            return None
+        return value.decode("utf-8") if value is not None else None
+
+    def set(self, key: str, value: str):
+        try:
+            self._client.setex(key, max(1, int(self.ttl)), value)
+        except Exception:
+            METRICS.inc("process_text_cache_errores_total")
+
+
+class ResultCache:
+    """
+    Resultados de process_ocr_text por (config, texto). La llave lleva el
+    fingerprint del registro de tipos: al recargar la config las entradas
+    viejas dejan de calzar y salen por LRU/TTL (no se vacía nada, así un
+    request que aún usa el snapshot anterior no borra lo de los nuevos). Los
+    valores se guardan como JSON, así cada hit entrega una copia que el
+    llamador puede modificar.
+    """
+
+    def __init__(self, local: LocalBackend, shared: Any = None):
+        self.local = local
+        self.shared = shared
+
+    @staticmethod
+    def key(config_fingerprint: str, text_hash: str) -> str:
+        return f"process-text:{config_fingerprint}:{text_hash}"
+
+    def get(self, config_fingerprint: str, text_hash: str) -> Optional[Dict[str, Any]]:
+        key = self.key(config_fingerprint, text_hash)
+        value = self.local.get(key)
+        if value is not None:
+            METRICS.inc("process_text_cache_total", resultado="hit")
+            return json.loads(value)
+        if self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                METRICS.inc("process_text_cache_total", resultado="hit_compartido")
+                self.local.set(key, value)
+                return json.loads(value)
+        METRICS.inc("process_text_cache_total", resultado="miss")
+        return None
+
+    def set(self, config_fingerprint: str, text_hash: str, result: Dict[str, Any]):
+        key = self.key(config_fingerprint, text_hash)
+        value = json.dumps(result, ensure_ascii=False)
+        self.local.set(key, value)
+        if self.shared is not None:
+            self.shared.set(key, value)
+
+
+def _build_cache() -> Optional[ResultCache]:
+    if PROCESS_TEXT_CACHE_SIZE <= 0 and not PROCESS_TEXT_CACHE_URL:
+        return None
+    shared = None
+    if PROCESS_TEXT_CACHE_URL:
+        try:
+            shared = RedisBackend(PROCESS_TEXT_CACHE_URL, PROCESS_TEXT_CACHE_TTL)
+        except ImportError:
+            print("PROCESS_TEXT_CACHE_URL configurada pero falta el paquete redis: solo caché local")
+    return ResultCache(LocalBackend(PROCESS_TEXT_CACHE_SIZE, PROCESS_TEXT_CACHE_TTL), shared)
+
+
+RESULT_CACHE = _build_cache()
+if RESULT_CACHE is not None:
+    METRICS.gauge("process_text_cache_entradas", lambda: len(RESULT_CACHE.local))
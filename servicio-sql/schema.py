@@ -0,0 +1,359 @@
+import hashlib
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from unidecode import unidecode
+
+
+# Ruta JSONB donde process_doc deja los campos extraídos
+CAMPOS_PATH = "contenido->'extraccion'->'campos'"
+
+# Tabla angosta con un registro por (documento, campo) y valor tipado
+CAMPOS_TABLE = "documento_campos"
+
+_MAX_IDENT = 63  # límite de Postgres para nombres
+
+# Búsqueda full-text: columna documentos.busqueda (tsvector) mantenida por trigger
+BUSQUEDA_CONFIG = "es_unaccent"
+# Texto indexado por documento: un tsvector no puede pasar de 1 MB y los OCR
+# con muchos números distintos se acercan a eso por sobre ~500k caracteres
+BUSQUEDA_MAX_CHARS = 300000
+
+
+def _accent_table() -> Tuple[str, str]:
+    """
+    Letras latinas (Latin-1 y Latin Extended-A/B) que unidecode convierte en una
+    sola letra ASCII, para translate() en SQL. Cuando la extensión unaccent
+    existe la configuración es_unaccent ya quita todos los acentos y esto no
+    cambia nada. Sin ella quedan sin plegar las letras que unidecode convierte
+    en más de una (æ, œ, ß, ...) y las de otros alfabetos.
+    """
+    src, dst = [], []
+    for cp in range(0xC0, 0x250):
+        char = chr(cp)
+        ascii_char = unidecode(char)
+        if char.isalpha() and len(ascii_char) == 1 and ascii_char.isalpha() and ascii_char != char:
+            src.append(char)
+            dst.append(ascii_char)
+    return "".join(src), "".join(dst)
+
+
+# Misma normalización que unidecode (classifier/extractor y la consulta de /search)
+_ACENTOS = _accent_table()
+BUSQUEDA_TEXTO = "COALESCE(texto_ocr, contenido->>'contenido')"
+
+
+def _literal(value: str) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _quoted(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _add_column(table: str, column: str, sql_type: str) -> str:
+    """
+    ADD COLUMN que mira antes el catálogo: ALTER TABLE toma un lock exclusivo
+    aunque la columna ya exista (IF NOT EXISTS no lo evita), y migrate-schema
+    corre en cada arranque.
+    """
+    return f"""DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = {_literal(table)} AND column_name = {_literal(column)}
+    ) THEN
+        ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {sql_type};
+    END IF;
+END $$"""
+
+
+_INDEX_RE = re.compile(r"^CREATE (?:UNIQUE )?INDEX (?:CONCURRENTLY )?IF NOT EXISTS (\w+)")
+
+
+def index_name(stmt: str) -> Optional[str]:
+    # Nombre del índice de un CREATE INDEX de schema_statements (None si es otra sentencia)
+    match = _INDEX_RE.match(stmt)
+    return match.group(1) if match else None
+
+
+def _ident(*parts: str) -> str:
+    """
+    Nombre SQL seguro (minúsculas, [a-z0-9_]) y de largo válido; si hay que
+    recortar se agrega un hash corto para no chocar con otro nombre.
+    """
+    raw = "_".join(parts)
+    name = re.sub(r"[^a-z0-9_]+", "_", raw.lower()).strip("_")
+    if len(name) > _MAX_IDENT:
+        suffix = hashlib.sha1(raw.encode("utf-8")).hexdigest()[:8]
+        name = f"{name[:_MAX_IDENT - 9]}_{suffix}"
+    return name
+
+
+def field_expression(field_name: str, field_cfg: Dict[str, Any]) -> str:
+    """
+    Expresión SQL tipada para un campo extraído.
+
+    Los "number" se castean solo si el JSON trae un número: la expresión nunca
+    falla, así un valor raro no puede hacer fallar un INSERT/UPDATE por culpa
+    del índice. Las consultas deben usar exactamente esta expresión (o las
+    vistas v_<tipo>) para que Postgres use el índice.
+    """
+    if field_cfg.get("tipo") == "number":
+        node = f"({CAMPOS_PATH}->{_literal(field_name)})"
+        return f"(CASE WHEN jsonb_typeof({node}) = 'number' THEN {node}::numeric END)"
+    return f"({CAMPOS_PATH}->>{_literal(field_name)})"
+
+
+def typed_field_rows(
+    doc_id: int,
+    doc_type: str,
+    campos: Dict[str, Any],
+    campos_cfg: Optional[Dict[str, Dict[str, Any]]],
+) -> List[Dict[str, Any]]:
+    """
+    Filas para documento_campos a partir del resultado de extract_fields.
+    Solo se escriben los campos declarados en el JSON del tipo y que vinieron
+    con valor; los "number" van a valor_num y el resto a valor_txt.
+    """
+    rows = []
+    for field_name, field_cfg in (campos_cfg or {}).items():
+        value = (campos or {}).get(field_name)
+        if value is None:
+            continue
+        valor_num = valor_txt = None
+        if field_cfg.get("tipo") == "number" and isinstance(value, (int, float)) and not isinstance(value, bool):
+            valor_num = value
+        else:
+            valor_txt = value if isinstance(value, str) else str(value)
+        rows.append(
+            {
+                "documento_id": doc_id,
+                "tipo_documento": doc_type,
+                "campo": field_name,
+                "valor_num": valor_num,
+                "valor_txt": valor_txt,
+            }
+        )
+    return rows
+
+
+def view_statement(view: str, select_sql: str) -> str:
+    """
+    Crea o actualiza la vista solo si su definición cambió (se compara
+    pg_get_viewdef contra una vista temporal con la definición nueva), así
+    cada arranque no toma un lock exclusivo sobre una vista que alguien está
+    consultando. Si solo se agregaron columnas al final: CREATE OR REPLACE; si
+    no, DROP + CREATE en la misma transacción (la vista nunca desaparece).
+    """
+    tmp = _ident("tmp", view)
+    return f"""DO $v$
+BEGIN
+    IF to_regclass({_literal(view)}) IS NULL THEN
+        CREATE VIEW {view} AS {select_sql};
+        RETURN;
+    END IF;
+    CREATE TEMP VIEW {tmp} AS {select_sql};
+    IF pg_get_viewdef({_literal(view)}::regclass) IS DISTINCT FROM pg_get_viewdef({_literal('pg_temp.' + tmp)}::regclass) THEN
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_attribute o
+            LEFT JOIN pg_attribute n ON n.attrelid = {_literal('pg_temp.' + tmp)}::regclass AND n.attnum = o.attnum
+            WHERE o.attrelid = {_literal(view)}::regclass AND o.attnum > 0 AND NOT o.attisdropped
+              AND (n.attname IS DISTINCT FROM o.attname OR n.atttypid IS DISTINCT FROM o.atttypid)
+        ) THEN
+            CREATE OR REPLACE VIEW {view} AS {select_sql};
+        ELSE
+            DROP VIEW {view};
+            CREATE VIEW {view} AS {select_sql};
+        END IF;
+    END IF;
+    DROP VIEW pg_temp.{tmp};
+END $v$"""
+
+
+def schema_statements(doc_types: Dict[str, Dict[str, Any]], concurrently: bool = True) -> List[str]:
+    """
+    DDL idempotente para consultar documentos sin recorrer la tabla:
+    - índice (tipo_documento, fecha_proceso)
+    - índice por contenido->>'hash_archivo' (deduplicación de servicio-ocr)
+    - GIN jsonb_path_ops sobre los campos extraídos (consultas con @>)
+    - por cada tipo y campo declarado en su JSON: índice de expresión parcial
+      (WHERE tipo_documento = <tipo>)
+    - por cada tipo: vista v_<tipo> con un campo por columna usando las mismas
+      expresiones que los índices
+    - columnas documentos.texto_ocr y documentos.pubsub_message_id (único)
+    - tabla documento_campos (valores tipados, la escriben process_doc y
+      reprocess) con sus índices
+    - búsqueda full-text (ver search_statements)
+    - tabla ocr_jobs de servicio-ocr (ver jobs_statements)
+    """
+    conc = "CONCURRENTLY " if concurrently else ""
+    stmts = [
+        # Texto OCR fuera del JSONB (lo mueven process_doc / reprocess); sin reescribir la tabla
+        _add_column("documentos", "texto_ocr", "TEXT"),
+        f"CREATE TABLE IF NOT EXISTS {CAMPOS_TABLE} ("
+        "documento_id INTEGER NOT NULL REFERENCES documentos (id) ON DELETE CASCADE, "
+        "tipo_documento VARCHAR NOT NULL, "
+        "campo VARCHAR NOT NULL, "
+        "valor_num NUMERIC, "
+        "valor_txt TEXT, "
+        "PRIMARY KEY (documento_id, campo))",
+        f"CREATE INDEX {conc}IF NOT EXISTS idx_{CAMPOS_TABLE}_num "
+        f"ON {CAMPOS_TABLE} (tipo_documento, campo, valor_num) WHERE valor_num IS NOT NULL",
+        f"CREATE INDEX {conc}IF NOT EXISTS idx_{CAMPOS_TABLE}_txt "
+        f"ON {CAMPOS_TABLE} (tipo_documento, campo, valor_txt) WHERE valor_txt IS NOT NULL",
+        f"CREATE INDEX {conc}IF NOT EXISTS idx_documentos_tipo_fecha ON documentos (tipo_documento, fecha_proceso)",
+        # Reenvíos de Pub/Sub: el INSERT del push hace ON CONFLICT DO NOTHING sobre este índice
+        _add_column("documentos", "pubsub_message_id", "VARCHAR"),
+        f"CREATE UNIQUE INDEX {conc}IF NOT EXISTS idx_documentos_pubsub_message "
+        "ON documentos (pubsub_message_id) WHERE pubsub_message_id IS NOT NULL",
+        # Deduplicación de PDFs en servicio-ocr (busca por hash antes de extraer)
+        f"CREATE INDEX {conc}IF NOT EXISTS idx_documentos_hash_archivo ON documentos ((contenido->>'hash_archivo'))",
+        f"CREATE INDEX {conc}IF NOT EXISTS idx_documentos_campos_gin "
+        f"ON documentos USING GIN (({CAMPOS_PATH}) jsonb_path_ops)",
+    ]
+
+    for type_id, cfg in doc_types.items():
+        if type_id == "DESCONOCIDO":
+            continue
+        campos = cfg.get("campos", {}) or {}
+        where = f"tipo_documento = {_literal(type_id)}"
+
+        columns = ["id", "nombre_archivo", "fecha_proceso"]
+        for field_name, field_cfg in campos.items():
+            expr = field_expression(field_name, field_cfg)
+            stmts.append(
+                f"CREATE INDEX {conc}IF NOT EXISTS {_ident('idx_doc', type_id, field_name)} "
+                f"ON documentos ({expr}) WHERE {where}"
+            )
+            columns.append(f"{expr} AS {_quoted(field_name)}")
+
+        view = _ident("v", type_id)
+        stmts.append(view_statement(view, f"SELECT {', '.join(columns)} FROM documentos WHERE {where}"))
+
+    stmts.extend(search_statements(concurrently))
+    stmts.extend(jobs_statements(concurrently))
+    return stmts
+
+
+def jobs_statements(concurrently: bool = True) -> List[str]:
+    """
+    Cola de jobs OCR asíncronos de servicio-ocr (POST /jobs y POST /?async=1).
+    intentos cuenta las veces que un worker tomó el job; servicio-ocr lo da por
+    perdido pasado JOBS_MAX_INTENTOS.
+    """
+    conc = "CONCURRENTLY " if concurrently else ""
+    return [
+        "CREATE TABLE IF NOT EXISTS ocr_jobs ("
+        "id TEXT PRIMARY KEY, "
+        "estado TEXT NOT NULL, "
+        "nombre_archivo TEXT, "
+        "pdf BYTEA, "
+        "paginas_total INTEGER, "
+        "paginas_hechas INTEGER NOT NULL DEFAULT 0, "
+        "documento_id INTEGER, "
+        "cache_hit BOOLEAN, "
+        "error TEXT, "
+        "intentos INTEGER NOT NULL DEFAULT 0, "
+        "creado TIMESTAMPTZ NOT NULL DEFAULT now(), "
+        "actualizado TIMESTAMPTZ NOT NULL DEFAULT now())",
+        # Tablas creadas antes de que existiera la columna
+        _add_column("ocr_jobs", "intentos", "INTEGER NOT NULL DEFAULT 0"),
+        f"CREATE INDEX {conc}IF NOT EXISTS idx_ocr_jobs_pendientes ON ocr_jobs (creado) WHERE estado = 'PENDIENTE'",
+    ]
+
+
+def search_statements(concurrently: bool = True) -> List[str]:
+    """
+    Búsqueda full-text sobre el texto OCR (texto_ocr o, si aún no se movió,
+    contenido->>'contenido'):
+    - configuración es_unaccent (spanish + unaccent si la extensión existe)
+    - función documentos_tsvector(texto) y columna busqueda. Sin unaccent los
+      acentos se pliegan con translate() (ver _accent_table); si la extensión
+      se instala después, la configuración ya creada no cambia: hay que
+      recrearla y volver a llenar busqueda
+    - trigger que la recalcula solo cuando el texto cambia (mover el texto de
+      contenido a texto_ocr no la recalcula)
+    - índice GIN
+    Los documentos ya guardados se llenan con migrate-schema --backfill-busqueda.
+    """
+    conc = "CONCURRENTLY " if concurrently else ""
+    return [
+        f"""DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = {_literal(BUSQUEDA_CONFIG)}) THEN
+        CREATE TEXT SEARCH CONFIGURATION {BUSQUEDA_CONFIG} (COPY = spanish);
+        IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'unaccent') THEN
+            CREATE EXTENSION IF NOT EXISTS unaccent;
+            ALTER TEXT SEARCH CONFIGURATION {BUSQUEDA_CONFIG}
+                ALTER MAPPING FOR hword, hword_part, word WITH unaccent, spanish_stem;
+        ELSE
+            RAISE NOTICE 'Extensión unaccent no disponible: {BUSQUEDA_CONFIG} queda como spanish';
+        END IF;
+    END IF;
+END $$""",
+        "CREATE OR REPLACE FUNCTION documentos_tsvector(texto TEXT) RETURNS tsvector "
+        "LANGUAGE sql IMMUTABLE PARALLEL SAFE AS "
+        f"$$ SELECT to_tsvector({_literal(BUSQUEDA_CONFIG)}::regconfig, "
+        f"translate(left(COALESCE(texto, ''), {BUSQUEDA_MAX_CHARS}), {_literal(_ACENTOS[0])}, {_literal(_ACENTOS[1])})) $$",
+        _add_column("documentos", "busqueda", "tsvector"),
+        f"""CREATE OR REPLACE FUNCTION documentos_busqueda_trigger() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    -- Sin cambio de texto (o backfill que ya trae el valor): se deja tal cual
+    IF TG_OP = 'UPDATE' AND NEW.busqueda IS NOT NULL
+       AND COALESCE(NEW.texto_ocr, NEW.contenido->>'contenido')
+           IS NOT DISTINCT FROM COALESCE(OLD.texto_ocr, OLD.contenido->>'contenido')
+    THEN
+        RETURN NEW;
+    END IF;
+    NEW.busqueda := documentos_tsvector(COALESCE(NEW.texto_ocr, NEW.contenido->>'contenido'));
+    RETURN NEW;
+END $$""",
+        # Solo si falta: DROP TRIGGER toma un lock exclusivo (y la función ya se actualizó arriba)
+        """DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_trigger
+        WHERE tgname = 'trg_documentos_busqueda' AND tgrelid = 'documentos'::regclass
+    ) THEN
+        CREATE TRIGGER trg_documentos_busqueda BEFORE INSERT OR UPDATE ON documentos
+            FOR EACH ROW EXECUTE FUNCTION documentos_busqueda_trigger();
+    END IF;
+END $$""",
+        f"CREATE INDEX {conc}IF NOT EXISTS idx_documentos_busqueda ON documentos USING GIN (busqueda)",
+    ]
+
+
+def search_backfill_statement(batch: int) -> str:
+    # Se repite hasta que no actualice filas (lotes cortos: no bloquea la tabla entera)
+    return (
+        f"UPDATE documentos SET busqueda = documentos_tsvector({BUSQUEDA_TEXTO}) "
+        f"WHERE id IN (SELECT id FROM documentos WHERE busqueda IS NULL ORDER BY id LIMIT {int(batch)})"
+    )
+
+
+def backfill_statements(doc_types: Dict[str, Dict[str, Any]]) -> Iterable[str]:
+    """
+    Llena documento_campos desde el JSONB de los documentos ya procesados (sin
+    reclasificar). No pisa filas existentes.
+    """
+    for type_id, cfg in doc_types.items():
+        if type_id == "DESCONOCIDO":
+            continue
+        for field_name, field_cfg in (cfg.get("campos", {}) or {}).items():
+            if field_cfg.get("tipo") == "number":
+                num_expr = field_expression(field_name, field_cfg)
+                txt_expr = (
+                    f"(CASE WHEN jsonb_typeof({CAMPOS_PATH}->{_literal(field_name)}) <> 'number' "
+                    f"THEN {CAMPOS_PATH}->>{_literal(field_name)} END)"
+                )
+            else:
+                num_expr = "NULL::numeric"
+                txt_expr = field_expression(field_name, field_cfg)
+            yield (
+                f"INSERT INTO {CAMPOS_TABLE} (documento_id, tipo_documento, campo, valor_num, valor_txt) "
+                f"SELECT id, tipo_documento, {_literal(field_name)}, {num_expr}, {txt_expr} FROM documentos "
+                f"WHERE tipo_documento = {_literal(type_id)} "
+                f"AND jsonb_typeof({CAMPOS_PATH}->{_literal(field_name)}) <> 'null' "
+                f"ON CONFLICT (documento_id, campo) DO NOTHING"
+            )
@@ -0,0 +1,9 @@
+#!/bin/sh
+# Esquema primero (idempotente; con MIGRATE_ON_START=0 se salta) y después el servidor.
+# Si la migración falla el contenedor no arranca y sigue atendiendo la revisión anterior;
+# si otra instancia ya está migrando, esta se la salta y arranca.
+set -e
+if [ "${MIGRATE_ON_START:-1}" != "0" ]; then
+    flask --app main migrate-schema
+fi
+exec gunicorn --bind 0.0.0.0:8080 --threads 8 main:app
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Los módulos del servicio se importan planos (como en la imagen, desde /app)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,85 @@
+import random
+
+import pytest
+
+from classifier import classify_document
+from config_loader import build_classifier, compile_document_type
+
+TYPES = {
+    "LIQUIDACION": {
+        "clasificacion": {
+            "palabras_clave": ["LIQUIDACION DE SUELDO", "LIQUIDACIÓN DE REMUNERACIONES"],
+            "regex_titulo": "LIQUID(ACION|ACIÓN).*SUELDO",
+            "confianza_minima": 0.8,
+        }
+    },
+    "CONTRATO": {
+        "clasificacion": {
+            "palabras_clave": ["CONTRATO DE TRABAJO", "EMPLEADOR", "TRABAJADOR"],
+            "regex_titulo": "CONTRATO.*TRABAJO",
+            "confianza_minima": 0.8,
+        }
+    },
+    "FINIQUITO": {
+        "clasificacion": {
+            "palabras_clave": ["FINIQUITO", "TERMINO DE CONTRATO"],
+            "confianza_minima": 0.5,
+            "pesos": {"keywords": 1.0, "regex_titulo": 0.0},
+        }
+    },
+}
+
+WORDS = ["el", "la", "de", "señor", "pago", "año", "\n", "\n\n", "  ", "ß", "\t"]
+KEYWORDS = ["Liquidación de sueldo", "LIQUIDACION DE REMUNERACIONES", "contrato de trabajo",
+            "empleador", "TRABAJADOR", "finiquito", "termino de\ncontrato", "LIQUIDACION\nDE SUELDO"]
+
+
+@pytest.fixture(scope="module")
+def compiled():
+    return build_classifier({type_id: compile_document_type(type_id, cfg) for type_id, cfg in TYPES.items()})
+
+
+def _random_text(rnd):
+    parts = [rnd.choice(KEYWORDS) if rnd.random() < 0.03 else rnd.choice(WORDS)
+             for _ in range(rnd.randint(20, 1500))]
+    return (" " if rnd.random() < 0.5 else "").join(parts)
+
+
+def _without_prefix_detail(result):
+    details = dict(result[3])
+    details.pop("prefijo", None)
+    return result[0], result[1], result[2], details
+
+
+def test_prefix_gives_same_result_as_full_text(compiled):
+    # El prefijo solo puede decidir si el texto completo no cambia el resultado,
+    # y el fallback reutiliza el trabajo del prefijo: todo debe dar lo mismo que sin prefijo
+    rnd = random.Random(2024)
+    decided = 0
+    for _ in range(1500):
+        text = _random_text(rnd)
+        full = classify_document(text, compiled, prefix_chars=0)
+        for prefix_chars in (rnd.randint(1, 200), 500, 3000):
+            result = classify_document(text, compiled, prefix_chars=prefix_chars)
+            decided += "prefijo" in result[3]
+            assert _without_prefix_detail(result) == full
+    assert decided, "ningún caso decidió en el prefijo: el test no cubre el atajo"
+
+
+def test_prefix_does_not_decide_when_an_earlier_type_can_still_tie(compiled):
+    # CONTRATO completo en el prefijo empata en 1.0 con lo que LIQUIDACION (antes en
+    # el orden) podría alcanzar más adelante: hay que leer el texto completo
+    text = "CONTRATO DE TRABAJO EMPLEADOR TRABAJADOR\n" + "relleno\n" * 50 + "LIQUIDACION DE SUELDO\nLIQUIDACION DE REMUNERACIONES\n"
+    result = classify_document(text, compiled, prefix_chars=60)
+    assert "prefijo" not in result[3]
+    assert result[0] == "LIQUIDACION"
+    assert _without_prefix_detail(result) == classify_document(text, compiled, prefix_chars=0)
+
+
+def test_keyword_split_across_prefix_cut(compiled):
+    # Keyword que cruza el corte del prefijo (el salto de línea se normaliza a espacio)
+    text = "x" * 40 + " LIQUIDACION DE\nSUELDO " + "y" * 100
+    cut = text.index("\n") + 1
+    result = classify_document(text, compiled, prefix_chars=cut)
+    assert _without_prefix_detail(result) == classify_document(text, compiled, prefix_chars=0)
+    assert result[3]["keywords_found"] == 1
@@ -0,0 +1,88 @@
+import json
+import os
+import random
+import re
+
+from extractor import extract_fields, normalize_money, normalize_period, normalize_text
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           "config", "document_types", "liquidacion.json")
+
+
+def _reference_extract_fields(ocr_text, doc_config):
+    # Extractor anterior a los planes compilados: re.search sin compilar en cada campo
+    text = normalize_text(ocr_text)
+    results, missing = {}, []
+    for field_name, cfg in doc_config.get("campos", {}).items():
+        value = None
+        for key in cfg.get("claves_busqueda", []):
+            idx = text.find(normalize_text(key))
+            if idx != -1:
+                numbers = re.findall(r"[\d\.,]+", text[idx: idx + 200])
+                if numbers:
+                    value = numbers[0]
+                    break
+        if not value:
+            if cfg.get("regex"):
+                m = re.search(cfg["regex"], text)
+                if m:
+                    value = m.group(0)
+            for r in cfg.get("regex_opciones", []):
+                m = re.search(r, text)
+                if m:
+                    value = m.group(0)
+                    break
+        if value:
+            if cfg.get("tipo") == "number":
+                value = normalize_money(value, doc_config)
+            if field_name == "periodo_remuneracion":
+                value = normalize_period(value, doc_config)
+        if value is None:
+            if cfg.get("obligatorio"):
+                missing.append(field_name)
+        else:
+            results[field_name] = value
+    return results, missing, []
+
+
+def _load_config():
+    with open(CONFIG_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _random_document(rnd):
+    months = ["enero", "Octubre", "DICIEMBRE", "marzo"]
+    parts = [
+        rnd.choice(["LIQUIDACIÓN DE SUELDO", "Liquidacion de remuneraciones", ""]),
+        f"RUT {rnd.randint(1, 99)}.{rnd.randint(100, 999)}.{rnd.randint(100, 999)}-{rnd.choice('0123456789Kk')}",
+        rnd.choice([f"{rnd.choice(months)} del {rnd.randint(2020, 2029)}",
+                    f"{rnd.randint(1, 12):02d}/{rnd.randint(2020, 2029)}", ""]),
+        rnd.choice(["Total Imponible", "HABERES IMPONIBLES", "imponible"]) + f" $ {rnd.randint(0, 9999999):,}",
+        rnd.choice(["TOTAL HABERES:", "Totales", ""]) + f" {rnd.randint(0, 9999999):,}".replace(",", "."),
+        rnd.choice(["Líquido a recibir", "ALCANCE LÍQUIDO", "liquido a pagar", ""]) + f" {rnd.randint(0, 999999)}",
+    ]
+    noise = ["texto", "ñandú", "\n", "\t", "\x1c", "  ", "año", "N°"]
+    out = []
+    for part in parts:
+        out.append(part)
+        out.extend(rnd.choice(noise) for _ in range(rnd.randint(0, 20)))
+    rnd.shuffle(out)
+    return " ".join(out)
+
+
+def test_compiled_extract_fields_matches_reference():
+    config = _load_config()
+    rnd = random.Random(99)
+    for _ in range(300):
+        text = _random_document(rnd)
+        assert extract_fields(text, config) == _reference_extract_fields(text, config)
+
+
+def test_plan_is_recompiled_for_a_new_config_dict():
+    config = _load_config()
+    text = "TOTAL IMPONIBLE 1.234 LIQUIDO A PAGAR 99"
+    assert extract_fields(text, config)[0]["total_imponible"] == 1234
+
+    changed = _load_config()
+    changed["campos"]["total_imponible"]["claves_busqueda"] = ["LIQUIDO A PAGAR"]
+    assert extract_fields(text, changed)[0]["total_imponible"] == 99
@@ -0,0 +1,64 @@
+import threading
+
+import pytest
+
+from ingest import MicroBatcher
+
+
+def _submit_all(batcher, items, timeout=5):
+    errors = {}
+
+    def run(item):
+        try:
+            batcher.submit(item, timeout=timeout)
+        except Exception as e:
+            errors[item] = e
+
+    threads = [threading.Thread(target=run, args=(item,)) for item in items]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return errors
+
+
+def test_failed_batch_is_retried_item_by_item():
+    flushed = []
+
+    def flush(items):
+        if "malo" in items:
+            raise ValueError("fila mala")
+        flushed.extend(items)
+
+    batcher = MicroBatcher(flush, max_items=10, max_wait_ms=50)
+    items = ["a", "b", "malo", "c"]
+    errors = _submit_all(batcher, items)
+
+    assert set(errors) == {"malo"}
+    assert isinstance(errors["malo"], ValueError)
+    assert sorted(flushed) == ["a", "b", "c"]
+    assert batcher.pending() == 0
+
+
+def test_timeout_before_flush_removes_item_from_buffer():
+    started, release = threading.Event(), threading.Event()
+    flushed = []
+
+    def flush(items):
+        started.set()
+        release.wait(5)
+        flushed.extend(items)
+
+    batcher = MicroBatcher(flush, max_items=1, max_wait_ms=0)
+    first = threading.Thread(target=batcher.submit, args=("primero",))
+    first.start()
+    assert started.wait(5)
+
+    # El thread de flush está ocupado con "primero": "segundo" vence en el buffer
+    with pytest.raises(TimeoutError, match="no llegó a flush"):
+        batcher.submit("segundo", timeout=0.05)
+    assert batcher.pending() == 0
+
+    release.set()
+    first.join(5)
+    assert flushed == ["primero"]
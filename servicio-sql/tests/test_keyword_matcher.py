@@ -0,0 +1,38 @@
+import random
+
+from keyword_matcher import AhoCorasickMatcher, SubstringMatcher, build_keyword_matcher
+
+
+def _random_case(rnd):
+    # Alfabeto chico: muchos prefijos/sufijos compartidos y keywords solapadas
+    alphabet = "ABC "
+    patterns = ["".join(rnd.choice(alphabet) for _ in range(rnd.randint(1, 6))) for _ in range(rnd.randint(1, 30))]
+    text = "".join(rnd.choice(alphabet + "D") for _ in range(rnd.randint(0, 300)))
+    return patterns, text
+
+
+def test_aho_corasick_matches_substring_search():
+    rnd = random.Random(1234)
+    for _ in range(500):
+        patterns, text = _random_case(rnd)
+        assert AhoCorasickMatcher(patterns).find(text) == SubstringMatcher(patterns).find(text)
+
+
+def test_overlapping_and_nested_patterns():
+    patterns = ["LIQUIDACION DE SUELDO", "LIQUIDACION", "SUELDO", "DE S", "ION DE"]
+    text = "XX LIQUIDACION DE SUELDO YY"
+    assert AhoCorasickMatcher(patterns).find(text) == set(patterns)
+    assert AhoCorasickMatcher(patterns).find("LIQUIDACION DE REMUNERACIONES") == {"LIQUIDACION", "ION DE"}
+
+
+def test_empty_text_and_patterns():
+    assert AhoCorasickMatcher(["A"]).find("") == set()
+    assert AhoCorasickMatcher([]).find("ABC") == set()
+    assert AhoCorasickMatcher(["", "A"]).patterns == ("A",)
+
+
+def test_build_keyword_matcher_threshold():
+    assert isinstance(build_keyword_matcher(["A", "B"], min_patterns=3), SubstringMatcher)
+    assert isinstance(build_keyword_matcher(["A", "B", "C"], min_patterns=3), AhoCorasickMatcher)
+    # Duplicados y vacíos no cuentan para el umbral
+    assert isinstance(build_keyword_matcher(["A", "A", "", "B"], min_patterns=3), SubstringMatcher)
@@ -0,0 +1,96 @@
+import schema
+from schema import (
+    _add_column,
+    _ident,
+    field_expression,
+    index_name,
+    jobs_statements,
+    schema_statements,
+    search_statements,
+    typed_field_rows,
+    view_statement,
+)
+
+TYPES = {
+    "LIQUIDACION": {
+        "campos": {
+            "total_liquido": {"tipo": "number"},
+            "rut_trabajador": {"tipo": "string"},
+        }
+    },
+    "DESCONOCIDO": {"campos": {"x": {"tipo": "string"}}},
+}
+
+
+def test_index_name():
+    assert index_name("CREATE INDEX IF NOT EXISTS idx_a ON t (c)") == "idx_a"
+    assert index_name("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_b ON t (c)") == "idx_b"
+    assert index_name("CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_c ON t (c)") == "idx_c"
+    assert index_name("CREATE TABLE IF NOT EXISTS t (c int)") is None
+    assert index_name(_add_column("t", "c", "TEXT")) is None
+
+
+def test_every_index_is_named_and_idempotent():
+    for concurrently in (True, False):
+        for stmt in schema_statements(TYPES, concurrently=concurrently):
+            if "CREATE INDEX" in stmt or "CREATE UNIQUE INDEX" in stmt:
+                assert index_name(stmt), stmt
+            assert ("CONCURRENTLY" in stmt) == (concurrently and index_name(stmt) is not None), stmt
+
+
+def test_schema_statements_skip_desconocido_and_add_views():
+    stmts = schema_statements(TYPES)
+    names = {index_name(s) for s in stmts}
+    assert _ident("idx_doc", "LIQUIDACION", "total_liquido") in names
+    assert not any("DESCONOCIDO" in s for s in stmts)
+    views = [s for s in stmts if s.startswith("DO $v$")]
+    assert len(views) == 1 and "CREATE VIEW v_liquidacion AS" in views[0]
+    plain = schema_statements(TYPES, concurrently=False)
+    assert plain[-len(jobs_statements()):] == jobs_statements(False)
+    assert set(search_statements(False)) <= set(plain)
+
+
+def test_add_column_checks_catalog_first():
+    stmt = _add_column("ocr_jobs", "intentos", "INTEGER NOT NULL DEFAULT 0")
+    assert "table_name = 'ocr_jobs' AND column_name = 'intentos'" in stmt
+    assert "ALTER TABLE ocr_jobs ADD COLUMN IF NOT EXISTS intentos INTEGER NOT NULL DEFAULT 0" in stmt
+    assert stmt.index("IF NOT EXISTS (") < stmt.index("ALTER TABLE")
+
+
+def test_view_statement_only_replaces_on_change():
+    stmt = view_statement("v_x", "SELECT id FROM documentos")
+    assert stmt.count("SELECT id FROM documentos") == 4  # crear, temporal, replace, drop+create
+    assert "pg_get_viewdef('v_x'::regclass) IS DISTINCT FROM pg_get_viewdef('pg_temp.tmp_v_x'::regclass)" in stmt
+    assert "CREATE OR REPLACE VIEW v_x" in stmt
+    assert stmt.index("DROP VIEW v_x;") < stmt.index("CREATE VIEW v_x AS SELECT id FROM documentos;\n        END IF")
+    assert stmt.rstrip().endswith("DROP VIEW pg_temp.tmp_v_x;\nEND $v$")
+
+
+def test_ident_is_safe_and_bounded():
+    assert _ident("idx_doc", "Liquidación Sueldo", "total-líquido") == "idx_doc_liquidaci_n_sueldo_total_l_quido"
+    long_a, long_b = _ident("idx", "a" * 80, "x"), _ident("idx", "a" * 80, "y")
+    assert len(long_a) == len(long_b) == 63 and long_a != long_b
+
+
+def test_field_expression():
+    assert field_expression("rut", {"tipo": "string"}) == f"({schema.CAMPOS_PATH}->>'rut')"
+    expr = field_expression("monto", {"tipo": "number"})
+    assert "jsonb_typeof" in expr and expr.endswith("::numeric END)")
+    assert field_expression("o'neil", {}) == f"({schema.CAMPOS_PATH}->>'o''neil')"
+
+
+def test_typed_field_rows():
+    campos_cfg = TYPES["LIQUIDACION"]["campos"]
+    rows = typed_field_rows(7, "LIQUIDACION", {"total_liquido": 1500, "rut_trabajador": "1.234.567-8", "otro": 1},
+                            campos_cfg)
+    assert rows == [
+        {"documento_id": 7, "tipo_documento": "LIQUIDACION", "campo": "total_liquido",
+         "valor_num": 1500, "valor_txt": None},
+        {"documento_id": 7, "tipo_documento": "LIQUIDACION", "campo": "rut_trabajador",
+         "valor_num": None, "valor_txt": "1.234.567-8"},
+    ]
+    # Un "number" que no vino como número va a valor_txt; bool no es número
+    rows = typed_field_rows(1, "L", {"total_liquido": True}, campos_cfg)
+    assert rows[0]["valor_num"] is None and rows[0]["valor_txt"] == "True"
+    assert typed_field_rows(1, "L", {"total_liquido": None}, campos_cfg) == []
+    assert typed_field_rows(1, "L", None, None) == []
@@ -0,0 +1,20 @@
+import re
+from unidecode import unidecode
+
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normaliza para comparación:
+    - sin acentos
+    - mayúsculas
+    - colapsa espacios
+    """
+    if not text:
+        return ""
+    text = unidecode(text)
+    text = text.upper()
+    text = _WHITESPACE_RE.sub(" ", text).strip()
+    return text